@@ -0,0 +1,647 @@
+"""Asyncio entry point for the wiki server.
+
+    python async_server.py
+
+Serves the same routes and static tree as server.py from one event loop, so
+idle keep-alive connections and slow upstream calls cost a coroutine instead
+of a thread. The read-only API routes, wiki pages and the Discord OAuth
+callback await Supabase (PostgREST) and Discord directly; every other route
+(writes, uploads, search, static files) runs through SaveRequestHandler on a
+small executor so its behaviour stays identical to server.py. Static file
+bodies are not buffered there; the event loop sends them with sendfile.
+"""
+import asyncio
+import base64
+import email.parser
+import http.client
+import io
+import json
+import os
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import httpx
+from supabase import acreate_client
+
+import server
+from server import (
+    PORT, KEEPALIVE_TIMEOUT, KEEPALIVE_MAX_REQUESTS, MAX_REQUEST_BODY, CLIENT_ID, CLIENT_SECRET, BOT_TOKEN, GUILD_ID,
+    SUPABASE_URL, SUPABASE_KEY, STORAGE_BACKEND, UserDatabase, SessionManager, SessionCache,
+    InvalidationBus, SessionTokens, SessionExpiry, PermissionService, SESSION_MAX_AGE,
+    Metrics, PageCache, PageMirror, RenderedPage, Warmup, api_cors_headers, render_page, shape_comments, discord_avatar_url,
+    log_access, log_db, log_discord, log_server,
+)
+
+BRIDGE_WORKERS = int(os.environ.get('BRIDGE_WORKERS', 8))
+MAX_HEADER_BYTES = 64 * 1024
+
+_REASONS = {code: phrase for code, (phrase, _desc) in server.SaveRequestHandler.responses.items()}
+
+
+class AsyncRequest:
+    def __init__(self, method, target, version, headers, raw_head, body):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.raw_head = raw_head
+        self.body = body
+        parsed = urllib.parse.urlparse(target)
+        self.path = parsed.path
+        self.query = urllib.parse.parse_qs(parsed.query)
+
+    def param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    @property
+    def keep_alive(self):
+        conn = (self.headers.get('Connection') or '').lower()
+        if self.version == 'HTTP/1.1':
+            return conn != 'close'
+        return conn == 'keep-alive'
+
+
+class RequestError(ValueError):
+    """A request that can't be read off the connection; answered with `status`, then the connection is closed."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncResponse:
+    def __init__(self, status=200, body=b'', content_type='application/json', headers=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = list(headers or [])
+
+    @classmethod
+    def json(cls, payload, status=200, headers=None):
+        return cls(status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+    @classmethod
+    def error(cls, status, message):
+        return cls.json({'status': 'error', 'message': message, 'code': status}, status)
+
+
+# === UPSTREAM CLIENTS ===
+class AsyncSupabaseStore(server.SupabaseStore):
+    """server.SupabaseStore on the async Supabase client - every method returns a coroutine."""
+    async def _run(self, query, transform=None):
+        rows = (await query.execute()).data or []
+        return transform(rows) if transform else rows
+
+
+class ThreadedStore:
+    """Awaitable view of a blocking store (SQLite), each call run on a worker thread."""
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        method = getattr(self._store, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+class AsyncUpstream:
+    """Async Supabase (PostgREST) and Discord clients shared by every connection."""
+
+    def __init__(self):
+        self.store = None
+        self.http = None
+        self.oauth_exchange_lock = asyncio.Lock()
+
+    async def start(self):
+        if STORAGE_BACKEND == 'supabase':
+            self.store = AsyncSupabaseStore(server._InstrumentedClient(await acreate_client(SUPABASE_URL, SUPABASE_KEY)))
+        else:
+            self.store = ThreadedStore(server.store)
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+
+    async def get_user(self, user_id):
+        try:
+            return await self.store.get_user(user_id)
+        except Exception as e:
+            log_db.error(f"Error getting user {user_id}: {e}")
+            return None
+
+    async def save_user(self, user_data):
+        existing_user = await self.get_user(user_data['id'])
+        final_data = UserDatabase.resolve(user_data, existing_user)
+        try:
+            await self.store.upsert_user(final_data)
+        except Exception as e:
+            log_db.error(f"Error saving user {final_data['id']}: {e}")
+        else:
+            PermissionService.note_user(final_data)
+        InvalidationBus.publish('users', final_data['id'])
+        return final_data
+
+    async def user_from_headers(self, headers):
+        session_id = SessionManager.session_id_from_headers(headers)
+        if not session_id:
+            return None
+        claims = None
+        if SessionTokens.is_token(session_id):
+            claims = SessionTokens.verify(session_id)
+            if claims is None:
+                return None
+            if SessionTokens.is_current(claims):
+                return SessionTokens.user(claims)
+        # Opaque session id, or a signed token whose role is stale (see SessionManager.user_from_token)
+        cache_key = claims['jti'] if claims else session_id
+        cached, user = SessionCache.get(cache_key)
+        if cached:
+            return user
+        generation = SessionCache.generation()
+        try:
+            if claims:
+                user = await self.store.get_user(claims['uid'])
+            else:
+                session = await self.store.get_session(session_id)
+                if session and SessionExpiry.expired(session):
+                    session = None
+                elif session:
+                    SessionExpiry.seen(session)
+                user = await self.store.get_user(session['user_id']) if session else None
+            SessionCache.put(cache_key, user, generation)
+            return user
+        except Exception as e:
+            log_db.error(f"Error verifying session: {e}")
+        return None
+
+    async def create_session(self, user_id, user=None):
+        if user is not None and SessionTokens.enabled():
+            return SessionTokens.issue(user)
+        session_id = str(uuid.uuid4())
+        try:
+            await self.store.create_session(SessionExpiry.new_row(session_id, user_id))
+        except Exception as e:
+            log_db.error(f"Error creating session: {e}")
+        return session_id
+
+    async def discord(self, method, url, attempts=3, **kwargs):
+        """Async twin of server._urlopen_with_rate_limit_retry."""
+        headers = {'User-Agent': 'DiscordBot', **kwargs.pop('headers', {})}
+        endpoint = server.discord_endpoint(url)
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                res = await self.http.request(method, url, headers=headers, **kwargs)
+            except Exception:
+                server.record_discord_call(endpoint, 'error', started)
+                raise
+            server.record_discord_call(endpoint, res.status_code, started)
+            if res.status_code not in (429, 503):
+                res.raise_for_status()
+                return res
+            log_discord.warning("HTTP %s from %s: %r", res.status_code, endpoint, res.content[:500])
+            if attempt >= attempts - 1:
+                res.raise_for_status()
+            await asyncio.sleep(server._rate_limit_delay(res.headers, res.content, attempt))
+
+
+# === NATIVE ROUTES ===
+async def health(upstream, req):
+    return AsyncResponse.json({"status": "ok", **Warmup.status()})
+
+
+async def user_me(upstream, req):
+    user = await upstream.user_from_headers(req.headers)
+    if user:
+        return AsyncResponse.json({"status": "success", "user": user})
+    return AsyncResponse.json({"status": "error", "message": "Not logged in"})
+
+
+async def permissions(upstream, req):
+    # Usually precomputed; only a (re)load of the users table blocks, so keep it off the loop
+    return _page_response(req, await asyncio.to_thread(PermissionService.response), 'application/json')
+
+
+async def comments(upstream, req):
+    page_id = req.param('pageId')
+    if not page_id:
+        return AsyncResponse.json({"status": "error", "message": "Missing pageId"}, 400)
+
+    # Comments and the users they reference are independent queries, run them together
+    comments_q = upstream.store.comments_for_page(page_id)
+    users_q = upstream.store.list_users()
+    page_comments, users = await asyncio.gather(comments_q, users_q, return_exceptions=True)
+    if isinstance(page_comments, Exception):
+        log_db.error(f"Error fetching comments for {page_id}: {page_comments}")
+        return AsyncResponse.json({"status": "error", "message": "Failed to fetch comments"}, 500)
+    if isinstance(users, Exception):
+        log_db.error(f"Error fetching user data for comments: {users}")
+        users = None
+
+    shape_comments(page_comments, users, req.param('sort', 'newest'))
+    return AsyncResponse.json({"status": "success", "comments": page_comments, "total": len(page_comments)})
+
+
+async def profile(upstream, req):
+    username = req.param('user')
+    try:
+        user_profile = await upstream.store.get_profile(username) or {}
+        if user_profile:
+            user_profile['bio'] = user_profile.get('about', '')
+    except Exception as e:
+        log_db.error(f"Error fetching profile: {e}")
+        user_profile = {}
+    return AsyncResponse.json({"status": "success", "profile": user_profile})
+
+
+async def activity(upstream, req):
+    username = req.param('user')
+    try:
+        logs = await upstream.store.recent_activity(username, limit=50)
+    except Exception as e:
+        log_db.error(f"Error fetching activity {e}")
+        logs = []
+    return AsyncResponse.json({"status": "success", "activity": logs})
+
+
+async def wiki_page(upstream, req):
+    clean_path = 'index.html' if req.path == '/' else req.path.lstrip('/')
+    key = server.page_key(clean_path)
+    cached = PageCache.get(key)
+    if cached is not None:
+        return _page_response(req, cached)
+    version = PageCache.version(key)
+    db_ok = False
+
+    # Same breaker and mirror as SaveRequestHandler, see server.load_page
+    breaker = server.page_breaker
+    if breaker.allow():
+        try:
+            record = await upstream.store.get_page_record(clean_path)
+            db_ok = True
+            breaker.success()
+        except Exception as e:
+            breaker.failure()
+            log_db.error(f"Error serving page {clean_path} from Supabase: {e}")
+        else:
+            if record is not None:
+                await asyncio.to_thread(PageMirror.write, clean_path, record['content'])
+                page = RenderedPage(render_page(record['content'], clean_path).encode('utf-8'),
+                                    server.parse_timestamp(record.get('updated_at')))
+                PageCache.put(key, page, version)
+                return _page_response(req, page)
+
+    content = await asyncio.to_thread(PageMirror.read, clean_path, not db_ok)
+    if content is None:
+        return None
+    page = RenderedPage(render_page(content, clean_path).encode('utf-8'), PageMirror.modified(clean_path, not db_ok))
+    if db_ok:
+        PageCache.put(key, page, version)
+    elif breaker.is_open:
+        PageMirror.mark_stale(clean_path)
+        PageCache.put(key, page, version)
+    return _page_response(req, page)
+
+
+def _page_response(req, page, content_type='text/html'):
+    """200 with validators for a RenderedPage, or 304 when the client's copy is current (see send_page)."""
+    etag = page.etag
+    if server.page_gzipped(page, req.headers.get('Accept-Encoding')):
+        etag = server.gzip_etag(etag)
+    headers = [('ETag', etag)]
+    if page.last_modified is not None:
+        headers.append(('Last-Modified', formatdate(page.last_modified, usegmt=True)))
+    if server.not_modified(req.headers, etag, page.last_modified):
+        if len(page.body) >= server.GZIP_MIN_SIZE:
+            headers.append(('Vary', 'Accept-Encoding'))
+        return AsyncResponse(304, b'', None, headers)
+    return AsyncResponse(200, page.body, content_type, headers)
+
+
+async def discord_callback(upstream, req):
+    code = req.param('code')
+    returned_state = req.param('state')
+    cookies = {}
+    for c in (req.headers.get('Cookie') or '').split(';'):
+        if '=' in c:
+            k, v = c.split('=', 1)
+            cookies[k.strip()] = v.strip()
+    expected_state = cookies.get('oauth_state')
+
+    if not code:
+        return AsyncResponse.error(400, "No code provided")
+    if not returned_state or not expected_state or returned_state != expected_state:
+        return AsyncResponse.error(400, "Invalid OAuth state")
+    if not server._discord_oauth_mark_code_seen(code, ttl_seconds=60):
+        return AsyncResponse.error(409, "OAuth code already used")
+    rate_limit_remaining = server._discord_oauth_get_rate_limit_remaining_seconds()
+    if rate_limit_remaining > 0:
+        return AsyncResponse.error(503, f"Authentication temporarily rate-limited by Discord. Please try again in {int(rate_limit_remaining)} seconds.")
+
+    try:
+        # Prevent concurrent token exchanges from spiking into rate-limits.
+        async with upstream.oauth_exchange_lock:
+            res = await upstream.discord('POST', "https://discord.com/api/oauth2/token", data={
+                'client_id': CLIENT_ID,
+                'client_secret': CLIENT_SECRET,
+                'grant_type': 'authorization_code',
+                'code': code,
+                'redirect_uri': server.discord_redirect_uri(req.headers),
+            })
+            access_token = res.json()['access_token']
+
+        res_user = await upstream.discord('GET', "https://discord.com/api/users/@me",
+                                          headers={'Authorization': f"Bearer {access_token}"})
+        user_data = res_user.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (429, 503):
+            msg = "Authentication temporarily rate-limited by Discord. Please try again."
+            retry_after = e.response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    server._discord_oauth_set_rate_limit(float(retry_after))
+                except Exception:
+                    pass
+                msg = f"Authentication temporarily rate-limited by Discord. Please try again in {retry_after} seconds."
+            return AsyncResponse.error(503, msg)
+        log_discord.error(f"OAuth HTTP Error: {e}")
+        return AsyncResponse.error(500, f"Authentication Failed: {str(e)}")
+    except Exception as e:
+        log_discord.error(f"OAuth Error: {e}")
+        return AsyncResponse.error(500, f"Authentication Failed: {str(e)}")
+
+    final_user = await upstream.save_user({
+        'id': user_data['id'],
+        'username': user_data['username'],
+        'avatar': discord_avatar_url(user_data)
+    })
+    session_id = await upstream.create_session(final_user['id'], final_user)
+
+    # Guild join and the activity entry go to the shared job queue (retries, dead-lettering)
+    if BOT_TOKEN and GUILD_ID:
+        server.jobs.submit('guild_join', user_id=user_data['id'], access_token=access_token)
+    server.jobs.submit('log_activity', entry={
+        "user": final_user.get('username', 'unknown'),
+        "action": "logged in",
+        "type": "system",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+    cookie = ('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=None; Secure; Max-Age={SESSION_MAX_AGE}')
+    if 'application/json' in (req.headers.get('Accept') or ''):
+        return AsyncResponse.json({"status": "success", "user": final_user, "session_id": session_id}, headers=[cookie])
+    b64_user = base64.b64encode(json.dumps(final_user).encode()).decode()
+    return AsyncResponse(302, b'', None, [cookie, ('Location', f"/?user_data={b64_user}&session_id={session_id}")])
+
+
+NATIVE_ROUTES = {
+    ('GET', '/api/health'): health,
+    ('GET', '/api/user/me'): user_me,
+    ('GET', '/api/permissions'): permissions,
+    ('GET', '/api/comments'): comments,
+    ('GET', '/api/profile'): profile,
+    ('GET', '/api/activity'): activity,
+    ('GET', '/auth/discord/callback'): discord_callback,
+}
+
+
+# === THREADED BRIDGE ===
+class _BufferedRequestHandler(server.SaveRequestHandler):
+    """Runs SaveRequestHandler against an in-memory request and captures the raw response.
+
+    A static file body is not copied into the buffer: file_body keeps its own
+    handle on the file and the body_plan parts for the event loop to send.
+    """
+    file_body = None
+
+    def __init__(self, raw_request, client_address):
+        self._raw_request = raw_request
+        super().__init__(None, client_address, SimpleNamespace())
+
+    def copyfile(self, source, outputfile):
+        if self.body_plan is None:
+            return super().copyfile(source, outputfile)
+        # do_GET closes source when this returns, so hand over a duplicate of its descriptor
+        self.file_body = (os.fdopen(os.dup(source.fileno()), 'rb'), self.body_plan)
+
+    def setup(self):
+        self.connection = None
+        self.rfile = io.BytesIO(self._raw_request)
+        self.wfile = io.BytesIO()
+        self.requests_on_connection = 0
+
+    def finish(self):
+        pass
+
+
+def _run_bridged(raw_request, client_address):
+    """(raw response bytes, file_body or None) - see _BufferedRequestHandler."""
+    handler = _BufferedRequestHandler(raw_request, client_address)
+    return handler.wfile.getvalue(), handler.file_body
+
+
+async def _send_file_body(writer, file_body):
+    """Write body_plan parts of an open file: literal bytes as they are, (offset, count) with sendfile."""
+    f, plan = file_body
+    loop = asyncio.get_running_loop()
+    try:
+        for part in plan:
+            if isinstance(part, bytes):
+                writer.write(part)
+                continue
+            offset, count = part
+            await writer.drain()
+            if await loop.sendfile(writer.transport, f, offset, count) < count:
+                # The file shrank after Content-Length went out; the response can't be completed
+                raise ConnectionAbortedError(f"{f.name} changed while it was being sent")
+    finally:
+        f.close()
+
+
+def _bridged_keeps_alive(raw_response):
+    """A bridged response can share the connection only if it is self-delimiting."""
+    head, _sep, _body = raw_response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    if not lines or not lines[0].startswith('HTTP/1.1'):
+        return False
+    fields = {}
+    for line in lines[1:]:
+        name, _colon, value = line.partition(':')
+        fields[name.strip().lower()] = value.strip().lower()
+    return 'content-length' in fields and fields.get('connection') != 'close'
+
+
+def _with_connection_header(raw_response, keep_alive):
+    """raw_response with its Connection header set to say whether the connection stays open."""
+    head, sep, body = raw_response.partition(b'\r\n\r\n')
+    if not sep:
+        return raw_response
+    lines = [line for line in head.split(b'\r\n') if not line.lower().startswith(b'connection:')]
+    lines.append(b'Connection: keep-alive' if keep_alive else b'Connection: close')
+    return b'\r\n'.join(lines) + sep + body
+
+
+# === CONNECTION HANDLING ===
+class AsyncWikiServer:
+    def __init__(self, port=PORT):
+        self.port = port
+        self.upstream = AsyncUpstream()
+        self.executor = ThreadPoolExecutor(max_workers=BRIDGE_WORKERS, thread_name_prefix='bridge')
+
+    async def serve_forever(self):
+        await self.upstream.start()
+        srv = await asyncio.start_server(self._handle_connection, '', self.port, limit=MAX_HEADER_BYTES)
+        log_server.info(f"Async server started at http://localhost:{self.port}")
+        Warmup.start()
+        SessionExpiry.start()
+        try:
+            async with srv:
+                await srv.serve_forever()
+        finally:
+            await self.upstream.close()
+            self.executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            for served in range(1, KEEPALIVE_MAX_REQUESTS + 1):
+                try:
+                    req = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    await self._write(writer, AsyncResponse.error(getattr(e, 'status', 400), str(e)), None, False)
+                    break
+                if req is None:
+                    break
+                keep_alive = await self._dispatch(req, writer, peer, served < KEEPALIVE_MAX_REQUESTS)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        except ValueError:
+            raise ValueError("Bad request line")
+        raw_head = bytearray(line)
+        header_lines = []
+        while True:
+            hline = await reader.readline()
+            raw_head += hline
+            if len(raw_head) > MAX_HEADER_BYTES:
+                raise ValueError("Request header too large")
+            if hline in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(hline.decode('latin-1'))
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(header_lines))
+        # Bodies are read by Content-Length only (as in SaveRequestHandler); a chunked body would be
+        # left on the connection and read as the next request
+        if headers.get('Transfer-Encoding'):
+            raise RequestError("Transfer-Encoding is not supported, send Content-Length", 411)
+        length = int(headers.get('Content-Length') or 0)
+        if length < 0:
+            raise ValueError("Bad Content-Length")
+        if length > MAX_REQUEST_BODY:
+            raise RequestError("Request body too large", 413)
+        body = await reader.readexactly(length) if length else b''
+        return AsyncRequest(method, target, version, headers, bytes(raw_head), body)
+
+    async def _dispatch(self, req, writer, peer, allow_keep_alive=True):
+        started = time.perf_counter()
+        handler = NATIVE_ROUTES.get((req.method, req.path))
+        Metrics.gauge_add('rtoc_http_requests_in_flight', 1)
+        try:
+            response = await self._native_response(handler, req)
+        finally:
+            Metrics.gauge_add('rtoc_http_requests_in_flight', -1)
+
+        if response is None:
+            # Everything else runs through the threaded handler unchanged (it records its own metrics)
+            loop = asyncio.get_running_loop()
+            try:
+                raw, file_body = await loop.run_in_executor(self.executor, _run_bridged, req.raw_head + req.body, peer)
+            except Exception as e:
+                log_server.error(f"{req.method} {req.path} failed in handler: {e}")
+                await self._write(writer, AsyncResponse.error(500, str(e)), req, False)
+                return False
+            keep_alive = allow_keep_alive and req.keep_alive and _bridged_keeps_alive(raw)
+            writer.write(_with_connection_header(raw, keep_alive))
+            if file_body is not None:
+                await _send_file_body(writer, file_body)
+            await writer.drain()
+            return keep_alive
+
+        keep_alive = allow_keep_alive and req.keep_alive
+        await self._write(writer, response, req, keep_alive)
+        elapsed = time.perf_counter() - started
+        labels = (('method', req.method), ('route', req.path if handler is not None else '*'))
+        Metrics.observe('rtoc_http_request_duration_seconds', elapsed, labels)
+        Metrics.inc('rtoc_http_requests_total', labels + (('status', response.status),))
+        Metrics.inc('rtoc_http_response_bytes_total', value=len(response.body))
+        log_access.info('%s - - "%s %s %s" %s (%.1f ms)', peer[0], req.method, req.target, req.version, response.status, elapsed * 1000)
+        return keep_alive
+
+    async def _native_response(self, handler, req):
+        response = None
+        if handler is not None:
+            try:
+                response = await handler(self.upstream, req)
+            except Exception as e:
+                log_server.error(f"{req.method} {req.path} failed: {e}")
+                response = AsyncResponse.error(500, str(e))
+        elif req.method == 'GET' and (req.path == '/' or req.path.endswith('.html')):
+            response = await wiki_page(self.upstream, req)
+        return response
+
+    async def _write(self, writer, response, req, keep_alive):
+        body, encoding_headers = response.body, []
+        if req is not None and len(body) >= server.GZIP_MIN_SIZE:
+            body, encoding_headers = await asyncio.to_thread(
+                server.negotiate_gzip, body, response.content_type, req.headers.get('Accept-Encoding'))
+        lines = [f"HTTP/1.1 {response.status} {_REASONS.get(response.status, '')}"]
+        if response.content_type:
+            lines.append(f"Content-Type: {response.content_type}")
+        if response.status != 304:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{name}: {value}" for name, value in encoding_headers)
+        if req is not None and (req.path.startswith('/api/') or req.path.startswith('/auth/')):
+            lines.extend(f"{name}: {value}" for name, value in api_cors_headers(req.headers.get('Origin')))
+        has_cache_control = any(name.lower() == 'cache-control' for name, _ in response.headers)
+        lines.extend(f"{name}: {value}" for name, value in response.headers)
+        if not has_cache_control:
+            policy = server.cache_policy(req.path if req is not None else '/api/', response.status)
+            lines.append(f"Cache-Control: {policy}")
+            if policy == 'no-store':
+                lines.append('Pragma: no-cache')
+                lines.append('Expires: 0')
+        lines.append('X-Content-Type-Options: nosniff')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+if __name__ == '__main__':
+    if not os.path.exists('assets/uploads'):
+        os.makedirs('assets/uploads')
+    try:
+        asyncio.run(AsyncWikiServer().serve_forever())
+    except KeyboardInterrupt:
+        log_server.info("Shutting down server...")
@@ -0,0 +1,259 @@
+"""
+Build fingerprinted, minified copies of scripts/*.js and styles/*.css.
+
+    python scripts/build_assets.py
+
+Writes dist/scripts/<name>.<hash>.js, dist/styles/<name>.<hash>.css and
+dist/manifest.json mapping each source path to its built path. server.py
+rewrites asset references in served HTML from the manifest, and the hashed
+files are served as immutable. A deploy therefore only invalidates the assets
+whose content changed. Replaces cache_bust.py.
+
+Relative url() references in CSS are rewritten for the file's new location
+under dist/, pointing at the built copy when the target is itself built.
+
+Minification is deliberately conservative: comments and redundant whitespace
+are dropped outside of strings, template literals and regex literals, and
+line breaks are kept so automatic semicolon insertion is unaffected.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIST = os.path.join(ROOT, 'dist')
+SOURCES = [('scripts', '.js'), ('styles', '.css')]
+
+# A '/' after one of these characters (or at the start) begins a regex literal, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new', 'delete', 'void', 'throw', 'yield', 'await')
+
+
+def minify_js(source):
+    out = []
+    i, n = 0, len(source)
+    pending_space = None  # '\n' or ' ' owed before the next token
+    templates = []        # brace depth of each open ${ ... } in a template literal
+
+    def last_significant():
+        for chunk in reversed(out):
+            stripped = chunk.rstrip()
+            if stripped:
+                return stripped
+        return ''
+
+    def regex_allowed():
+        prev = last_significant()
+        if not prev:
+            return True
+        if prev[-1] in REGEX_PRECEDERS:
+            return True
+        word = re.search(r'[A-Za-z_$][\w$]*$', prev)
+        return bool(word) and word.group(0) in REGEX_KEYWORDS
+
+    def emit(text):
+        nonlocal pending_space
+        if pending_space and out:
+            out.append(pending_space)
+        pending_space = None
+        out.append(text)
+
+    def scan_template(i):
+        """Copy a template literal chunk from i (just after ` or }) to the closing ` or ${."""
+        start = i
+        while i < n:
+            c = source[i]
+            if c == '\\':
+                i += 2
+                continue
+            if c == '`':
+                return i + 1, source[start:i + 1], False
+            if c == '$' and i + 1 < n and source[i + 1] == '{':
+                return i + 2, source[start:i + 2], True
+            i += 1
+        return n, source[start:], False
+
+    while i < n:
+        c = source[i]
+        if c in ' \t\r\n':
+            j = i
+            while j < n and source[j] in ' \t\r\n':
+                j += 1
+            if '\n' in source[i:j]:
+                pending_space = '\n'
+            elif pending_space is None:
+                pending_space = ' '
+            i = j
+            continue
+        if c == '/' and i + 1 < n and source[i + 1] == '/':
+            j = source.find('\n', i)
+            i = n if j == -1 else j
+            continue
+        if c == '/' and i + 1 < n and source[i + 1] == '*':
+            j = source.find('*/', i + 2)
+            if j == -1:
+                break
+            if '\n' in source[i:j]:
+                pending_space = '\n'
+            elif pending_space is None:
+                pending_space = ' '
+            i = j + 2
+            continue
+        if c in '"\'':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            emit(source[i:j + 1])
+            i = j + 1
+            continue
+        if c == '`':
+            i, chunk, opened = scan_template(i + 1)
+            emit('`' + chunk)
+            if opened:
+                templates.append(0)
+            continue
+        if c == '/' and regex_allowed():
+            j, in_class = i + 1, False
+            while j < n and source[j] != '\n':
+                ch = source[j]
+                if ch == '\\':
+                    j += 2
+                    continue
+                if ch == '[':
+                    in_class = True
+                elif ch == ']':
+                    in_class = False
+                elif ch == '/' and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (source[j].isalnum() or source[j] == '_'):
+                j += 1
+            emit(source[i:j])
+            i = j
+            continue
+        if templates and c == '{':
+            templates[-1] += 1
+        elif templates and c == '}':
+            if templates[-1] == 0:
+                templates.pop()
+                i, chunk, opened = scan_template(i + 1)
+                emit('}' + chunk)
+                if opened:
+                    templates.append(0)
+                continue
+            templates[-1] -= 1
+        # Whitespace is only needed between two word characters (or to keep + + / - - apart)
+        if pending_space == ' ' and out:
+            prev = out[-1][-1:]
+            if not ((prev.isalnum() or prev in '_$\\') and (c.isalnum() or c in '_$\\')) \
+                    and not (prev in '+-' and c == prev):
+                pending_space = None
+        emit(c)
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(source):
+    out = []
+    i, n = 0, len(source)
+    space = False
+    while i < n:
+        c = source[i]
+        if c == '/' and i + 1 < n and source[i + 1] == '*':
+            j = source.find('*/', i + 2)
+            i = n if j == -1 else j + 2
+            space = True
+            continue
+        if c in '"\'':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            if space and out and out[-1] not in '{};,>':
+                out.append(' ')
+            out.append(source[i:j + 1])
+            space = False
+            i = j + 1
+            continue
+        if c.isspace():
+            space = True
+            i += 1
+            continue
+        if c in '{};,>':
+            while out and out[-1] == ' ':
+                out.pop()
+            if c == '}' and out and out[-1] == ';':
+                out.pop()
+            out.append(c)
+            space = False
+            i += 1
+            continue
+        if space and out and out[-1] not in '{};,>':
+            out.append(' ')
+        space = False
+        out.append(c)
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)(.*?)\1\s*\)""", re.IGNORECASE)
+
+
+def rewrite_css_urls(source, src_path, built_path, manifest=None):
+    """Re-point relative url() values in the CSS at src_path so they resolve from built_path.
+
+    Paths are site-relative ('styles/main.css'). Absolute, protocol and data:
+    URLs are left alone; a target found in manifest is replaced by its built
+    copy. Query strings and fragments are kept.
+    """
+    manifest = manifest or {}
+    src_dir, built_dir = posixpath.dirname(src_path), posixpath.dirname(built_path)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2).strip()
+        if not url or url.startswith(('/', '#', 'data:')) or re.match(r'^[a-zA-Z][\w+.-]*:', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        target = posixpath.normpath(posixpath.join(src_dir, path))
+        target = manifest.get(target, target)
+        return f"url({quote}{posixpath.relpath(target, built_dir)}{suffix}{quote})"
+
+    return CSS_URL_RE.sub(replace, source)
+
+
+def build(root=ROOT, dist=DIST):
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {}
+    for folder, ext in SOURCES:
+        src_dir = os.path.join(root, folder)
+        os.makedirs(os.path.join(dist, folder), exist_ok=True)
+        for name in sorted(os.listdir(src_dir)):
+            if not name.endswith(ext):
+                continue
+            with open(os.path.join(src_dir, name), 'r', encoding='utf-8') as f:
+                source = f.read()
+            if ext == '.css':
+                # Any name under dist/<folder>/ will do; only the directory matters for relative URLs
+                source = rewrite_css_urls(source, f"{folder}/{name}", f"dist/{folder}/{name}", manifest)
+            minified = MINIFIERS[ext](source)
+            data = minified.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            stem = name[:-len(ext)]
+            built = f"dist/{folder}/{stem}.{digest}{ext}"
+            with open(os.path.join(root, built), 'wb') as f:
+                f.write(data)
+            manifest[f"{folder}/{name}"] = built
+            print(f"{folder}/{name}: {len(source.encode('utf-8'))} -> {len(data)} bytes ({built})")
+    with open(os.path.join(dist, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    build()
@@ -7,6 +7,10 @@ import datetime
 # Supabase SDK
 from supabase import create_client, Client
 
+# Pages are imported through the same HTML pipeline /save applies
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server import HtmlPipeline
+
 URL = "https://zzpjxsqlhxdqhcybmgy.supabase.co"
 KEY = "sb_publishable_zxGFxVUWupq-F03Ed4-SKQ_3judxO00"
 
@@ -174,7 +178,7 @@ def migrate_wiki_pages():
             with open(p, 'r', encoding='utf-8') as f:
                 records.append({
                     'path': rf,
-                    'content': f.read(),
+                    'content': HtmlPipeline.process(f.read(), rf),
                     'updated_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
                 })
 
@@ -187,7 +191,7 @@ def migrate_wiki_pages():
                 with open(full_path, 'r', encoding='utf-8') as f:
                     records.append({
                         'path': rel_path,
-                        'content': f.read(),
+                        'content': HtmlPipeline.process(f.read(), rel_path),
                         'updated_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
                     })
 
@@ -0,0 +1,63 @@
+"""
+Run the write-time HTML pipeline from server.py over existing wiki pages.
+
+    python scripts/process_pages.py           # index.html and pages/ on disk
+    python scripts/process_pages.py --store   # also the copies in the configured store
+
+Pages saved through /save already go through the pipeline; this covers pages
+edited by hand in the repo and content stored before the pipeline existed.
+Only pages whose output differs are rewritten. Replaces fix_nav_bars.py,
+whose nav normalization is now one of the pipeline steps.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import server  # noqa: E402
+
+
+def wiki_pages():
+    return [p for p in server.SearchIndexer.page_paths(ROOT) if p == 'index.html' or p.startswith('pages/')]
+
+
+def process_files(paths):
+    changed = 0
+    for rel_path in paths:
+        with open(rel_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        processed = server.HtmlPipeline.process(content, rel_path)
+        if processed != content:
+            with open(rel_path, 'w', encoding='utf-8') as f:
+                f.write(processed)
+            print(f"Processed: {rel_path}")
+            changed += 1
+    return changed
+
+
+def process_store(paths):
+    changed = 0
+    for rel_path in paths:
+        content = server.store.get_page(rel_path)
+        if content is None:
+            continue
+        processed = server.HtmlPipeline.process(content, rel_path)
+        if processed != content:
+            server.store.save_page(rel_path, processed)
+            print(f"Processed (store): {rel_path}")
+            changed += 1
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--store', action='store_true', help='also process pages in the configured STORAGE_BACKEND')
+    args = parser.parse_args()
+    paths = wiki_pages()
+    count = process_files(paths)
+    if args.store:
+        count += process_store(paths)
+    print(f"Done. {count} of {len(paths)} pages changed.")
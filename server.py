@@ -1,4 +1,5 @@
 import http.server
+import http.client
 import socketserver
 import os
 import json
@@ -9,11 +10,34 @@ import urllib.parse
 import urllib.error
 from datetime import datetime, timezone
 import base64
+import io
 import shutil
 import threading
 import tempfile
 import time
 import random
+import queue
+import select
+import signal
+import socket
+import ssl
+import bisect
+import heapq
+import itertools
+import re
+from concurrent.futures import ThreadPoolExecutor
+import stat
+from email.utils import parsedate_to_datetime
+import gzip
+from collections import OrderedDict
+import hashlib
+import hmac
+import secrets
+import sqlite3
+import inspect
+import atexit
+import logging
+import logging.handlers
 
 # Configuration - use environment variables for deployment
 PORT = int(os.environ.get('PORT', 8081))
@@ -23,6 +47,94 @@ BOT_TOKEN = os.environ.get('DISCORD_BOT_TOKEN') # MUST set this in Render Enviro
 GUILD_ID = os.environ.get('DISCORD_GUILD_ID', '1345014093731332108')
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'https://regressorstaleofcultivation.space/auth/discord/callback')
 
+# Server concurrency - 'pooled' (worker threads + bounded accept queue) or 'single'
+SERVER_MODE = os.environ.get('SERVER_MODE', 'pooled')
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 16))
+ACCEPT_QUEUE_SIZE = int(os.environ.get('ACCEPT_QUEUE_SIZE', 64))
+OVERLOAD_RETRY_AFTER = int(os.environ.get('OVERLOAD_RETRY_AFTER', 2))
+# SERVER_MODE=prefork - worker processes sharing PORT, each running its own pooled server
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1))
+
+# HTTP/1.1 keep-alive - idle seconds before a connection is closed, and requests served per connection
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 15))
+KEEPALIVE_MAX_REQUESTS = int(os.environ.get('KEEPALIVE_MAX_REQUESTS', 100))
+MAX_REQUEST_BODY = int(os.environ.get('MAX_REQUEST_BODY', 25 * 1024 * 1024))
+
+# Logging - global level, per-category overrides ("auth=debug,db=warning") and
+# sampling rates for chatty categories below WARNING ("access=0.1")
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_CATEGORIES = os.environ.get('LOG_CATEGORIES', '')
+LOG_SAMPLE = os.environ.get('LOG_SAMPLE', '')
+
+# HTTP caching - max-age for unversioned static files; fingerprinted files and uploads are immutable
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Per-route Cache-Control overrides, longest matching path prefix wins: "/pages/=public, max-age=60;/index.html=no-cache"
+CACHE_CONTROL_RULES = os.environ.get('CACHE_CONTROL_RULES', '')
+# Image derivatives (?w=320&fmt=webp) - needs Pillow; widths are snapped up to IMAGE_WIDTHS
+IMAGE_WIDTHS = tuple(int(w) for w in os.environ.get('IMAGE_WIDTHS', '160,320,480,640,960,1280,1920').split(','))
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', '.image_cache')
+IMAGE_CACHE_BYTES = int(os.environ.get('IMAGE_CACHE_BYTES', 256 * 1024 * 1024))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+
+# Fingerprinted asset manifest written by scripts/build_assets.py
+ASSET_MANIFEST = os.environ.get('ASSET_MANIFEST', os.path.join('dist', 'manifest.json'))
+# Seconds a static file's stat result is trusted before checking the disk again
+STATIC_STAT_TTL = float(os.environ.get('STATIC_STAT_TTL', 1.0))
+
+# Compression - bodies below GZIP_MIN_SIZE go out as-is; compressed bytes are kept in a bounded LRU
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+GZIP_CACHE_BYTES = int(os.environ.get('GZIP_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Rendered wiki pages - entries kept in the LRU, and seconds before an entry is refetched regardless
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))
+
+# Pages preloaded into the page cache by the background warm-up after the socket binds (0 = index only)
+WARMUP_PAGES = int(os.environ.get('WARMUP_PAGES', 64))
+
+# Session cache - seconds a resolved session (or an unknown session id) is trusted, and entries kept
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 30))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 4096))
+
+# Session expiry - absolute and idle lifetime of a database session, how often last_seen is written,
+# and how often / how many expired rows the reaper deletes
+SESSION_MAX_AGE = int(os.environ.get('SESSION_MAX_AGE', 30 * 24 * 3600))
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 14 * 24 * 3600))
+SESSION_TOUCH_INTERVAL = int(os.environ.get('SESSION_TOUCH_INTERVAL', 3600))
+SESSION_REAP_INTERVAL = float(os.environ.get('SESSION_REAP_INTERVAL', 3600))
+SESSION_REAP_BATCH = int(os.environ.get('SESSION_REAP_BATCH', 500))
+
+# Signed session tokens - HMAC key (unset = opaque database sessions only), token lifetime, revocation list file
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', 30 * 24 * 3600))
+REVOCATIONS_FILE = os.environ.get('REVOCATIONS_FILE', 'revoked_sessions.json')
+
+# Page-read circuit breaker - consecutive wiki_pages failures that open it, and seconds between background probes while open
+PAGE_BREAKER_FAILURES = int(os.environ.get('PAGE_BREAKER_FAILURES', 5))
+PAGE_BREAKER_PROBE_INTERVAL = float(os.environ.get('PAGE_BREAKER_PROBE_INTERVAL', 5))
+
+# Local copies of wiki_pages served while the database is unreachable (kept apart from the tracked site files)
+PAGE_MIRROR_DIR = os.environ.get('PAGE_MIRROR_DIR', os.path.join('cache', 'pages'))
+
+# Background jobs (guild join, activity log) - worker threads, queued jobs, attempts before a job is
+# dead-lettered, delay before the first retry (doubles per attempt) and the dead-letter file
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 1000))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 2))
+JOB_DEAD_LETTER_FILE = os.environ.get('JOB_DEAD_LETTER_FILE', 'dead_jobs.jsonl')
+
+# Discord HTTP client - connections per host (open at once / kept idle), seconds an idle one is kept,
+# and connect / read timeouts
+DISCORD_MAX_CONNECTIONS = int(os.environ.get('DISCORD_MAX_CONNECTIONS', 8))
+DISCORD_MAX_IDLE = int(os.environ.get('DISCORD_MAX_IDLE', 4))
+DISCORD_IDLE_TIMEOUT = float(os.environ.get('DISCORD_IDLE_TIMEOUT', 60))
+DISCORD_CONNECT_TIMEOUT = float(os.environ.get('DISCORD_CONNECT_TIMEOUT', 5))
+DISCORD_READ_TIMEOUT = float(os.environ.get('DISCORD_READ_TIMEOUT', 15))
+
 # CORS - allowed origins for cross-origin requests
 ALLOWED_ORIGINS = [
     'https://regressorstaleofcultivation.space',
@@ -36,11 +148,611 @@ ALLOWED_ORIGINS = [
     'https://regressorstaleofcultivation.onrender.com'
 ]
 
+# === LOGGING ===
+def _parse_log_spec(spec):
+    entries = {}
+    for part in spec.split(','):
+        name, sep, value = part.partition('=')
+        if sep and name.strip() and value.strip():
+            entries[name.strip()] = value.strip()
+    return entries
+
+class _SampleFilter(logging.Filter):
+    """Keeps every WARNING and above, and a random fraction of lower records per category."""
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name.rpartition('.')[2])
+        return rate is None or random.random() < rate
+
+class AsyncLogging:
+    """Routes the rtoc.* loggers through a queue drained by a background thread.
+
+    Request threads only enqueue records that pass the level and sampling
+    checks; the listener thread does the blocking write to stderr.
+    """
+    _queue = queue.SimpleQueue()
+    _listener = None
+
+    @staticmethod
+    def configure():
+        root = logging.getLogger('rtoc')
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        for category, level in _parse_log_spec(LOG_CATEGORIES).items():
+            logging.getLogger(f'rtoc.{category}').setLevel(getattr(logging, level.upper(), logging.INFO))
+        rates = {}
+        for category, rate in _parse_log_spec(LOG_SAMPLE).items():
+            try:
+                rates[category] = float(rate)
+            except ValueError:
+                pass
+        handler = logging.handlers.QueueHandler(AsyncLogging._queue)
+        handler.addFilter(_SampleFilter(rates))
+        root.handlers[:] = [handler]
+        AsyncLogging.start()
+
+    @staticmethod
+    def start():
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        AsyncLogging._listener = logging.handlers.QueueListener(AsyncLogging._queue, output)
+        AsyncLogging._listener.start()
+
+    @staticmethod
+    def stop():
+        if AsyncLogging._listener:
+            AsyncLogging._listener.stop()
+            AsyncLogging._listener = None
+
+    @staticmethod
+    def _after_fork():
+        # The listener thread does not survive fork - give each worker its own
+        AsyncLogging._queue = queue.SimpleQueue()
+        for handler in logging.getLogger('rtoc').handlers:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                handler.queue = AsyncLogging._queue
+        AsyncLogging.start()
+
+AsyncLogging.configure()
+atexit.register(AsyncLogging.stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=AsyncLogging._after_fork)
+
+log_access = logging.getLogger('rtoc.access')
+log_auth = logging.getLogger('rtoc.auth')
+log_comments = logging.getLogger('rtoc.comments')
+log_db = logging.getLogger('rtoc.db')
+log_discord = logging.getLogger('rtoc.discord')
+log_pages = logging.getLogger('rtoc.pages')
+log_search = logging.getLogger('rtoc.search')
+log_server = logging.getLogger('rtoc.server')
+log_upload = logging.getLogger('rtoc.upload')
+
+# === METRICS ===
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Process-wide counters, gauges and histograms rendered in Prometheus text format.
+
+    Recording is a dict lookup and a bisect under one lock. In pre-fork mode
+    every worker process keeps its own numbers.
+    """
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HELP = {
+        'rtoc_http_requests_total': ('counter', 'HTTP requests by route and status.'),
+        'rtoc_http_request_duration_seconds': ('histogram', 'HTTP request latency by route.'),
+        'rtoc_http_requests_in_flight': ('gauge', 'HTTP requests currently being handled.'),
+        'rtoc_http_response_bytes_total': ('counter', 'Response body bytes served.'),
+        'rtoc_db_calls_total': ('counter', 'Database calls by table, operation and outcome.'),
+        'rtoc_db_call_duration_seconds': ('histogram', 'Database call latency by table and operation.'),
+        'rtoc_discord_calls_total': ('counter', 'Discord API calls by endpoint and status.'),
+        'rtoc_discord_call_duration_seconds': ('histogram', 'Discord API call latency by endpoint.'),
+        'rtoc_discord_rate_limited_total': ('counter', 'Discord 429 responses by endpoint.'),
+        'rtoc_gzip_cache_total': ('counter', 'Compressed-body cache lookups by result.'),
+        'rtoc_page_cache_total': ('counter', 'Rendered wiki page cache lookups by result.'),
+        'rtoc_session_cache_total': ('counter', 'Session lookups by result (hit, negative hit, miss).'),
+        'rtoc_sessions_reaped_total': ('counter', 'Expired session rows deleted by the reaper.'),
+        'rtoc_http_connections_total': ('counter', 'Outbound HTTP requests by host and connection (new, reused).'),
+        'rtoc_jobs_total': ('counter', 'Background jobs by job and outcome (ok, retry, dead, rejected).'),
+        'rtoc_job_queue_depth': ('gauge', 'Background jobs waiting to run, including scheduled retries.'),
+        'rtoc_circuit_open': ('gauge', 'Whether a circuit breaker is open (1) or closed (0).'),
+        'rtoc_circuit_rejected_total': ('counter', 'Upstream calls skipped because the circuit breaker was open.'),
+        'rtoc_image_derivatives_total': ('counter', 'Image derivative requests served from disk or generated.'),
+        'rtoc_image_render_duration_seconds': ('histogram', 'Time to resize or transcode one image.'),
+    }
+    _lock = threading.Lock()
+    _counters = {}
+    _gauges = {}
+    _histograms = {}
+
+    @staticmethod
+    def inc(name, labels=(), value=1):
+        key = (name, labels)
+        with Metrics._lock:
+            Metrics._counters[key] = Metrics._counters.get(key, 0) + value
+
+    @staticmethod
+    def gauge_add(name, delta, labels=()):
+        key = (name, labels)
+        with Metrics._lock:
+            Metrics._gauges[key] = Metrics._gauges.get(key, 0) + delta
+
+    @staticmethod
+    def observe(name, seconds, labels=()):
+        key = (name, labels)
+        with Metrics._lock:
+            hist = Metrics._histograms.get(key)
+            if hist is None:
+                hist = Metrics._histograms[key] = Histogram(Metrics.LATENCY_BUCKETS)
+            hist.observe(seconds)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        inner = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+        return '{' + inner + '}'
+
+    @staticmethod
+    def render():
+        with Metrics._lock:
+            counters = dict(Metrics._counters)
+            gauges = dict(Metrics._gauges)
+            histograms = {key: (hist.buckets, list(hist.counts), hist.sum, hist.count) for key, hist in Metrics._histograms.items()}
+
+        by_name = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            by_name.setdefault(name, []).append(f"{name}{Metrics._labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in histograms.items():
+            lines = by_name.setdefault(name, [])
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{Metrics._labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{Metrics._labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{Metrics._labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{Metrics._labels(labels)} {count}")
+
+        out = []
+        for name in sorted(by_name):
+            kind, help_text = Metrics.HELP.get(name, ('untyped', ''))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(by_name[name])
+        return '\n'.join(out) + '\n'
+
+_DB_OPERATIONS = ('select', 'insert', 'upsert', 'update', 'delete')
+
+def record_db_call(table, op, started, outcome):
+    labels = (('table', table), ('op', op))
+    Metrics.observe('rtoc_db_call_duration_seconds', time.perf_counter() - started, labels)
+    Metrics.inc('rtoc_db_calls_total', labels + (('outcome', outcome),))
+
+class _InstrumentedQuery:
+    """Wraps a PostgREST query builder and times execute() per table and operation."""
+    __slots__ = ('_query', '_table', '_op')
+
+    def __init__(self, query, table, op=None):
+        self._query = query
+        self._table = table
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _InstrumentedQuery(result, self._table, self._op or (name if name in _DB_OPERATIONS else None))
+            return result
+        return call
+
+    def _record(self, started, outcome):
+        record_db_call(self._table, self._op or 'other', started, outcome)
+
+    def execute(self):
+        started = time.perf_counter()
+        try:
+            result = self._query.execute()
+        except Exception:
+            self._record(started, 'error')
+            raise
+        if inspect.isawaitable(result):
+            return self._await(result, started)
+        self._record(started, 'ok')
+        return result
+
+    async def _await(self, result, started):
+        try:
+            response = await result
+        except Exception:
+            self._record(started, 'error')
+            raise
+        self._record(started, 'ok')
+        return response
+
+class _InstrumentedClient:
+    """Supabase client (sync or async) whose table queries are timed into Metrics."""
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _InstrumentedQuery(self._client.table(name), name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
 from supabase import create_client, Client
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://zzpjxsqlhxdqhcybmgy.supabase.co')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', 'sb_publishable_zxGFxVUWupq-F03Ed4-SKQ_3judxO00')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Storage - 'supabase' (hosted PostgREST) or 'sqlite' (embedded database file at SQLITE_PATH)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'supabase')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'wiki.db')
+
+# === STORAGE ===
+def _first(rows):
+    return rows[0] if rows else None
+
+class SupabaseStore:
+    """Repository over the Supabase tables in supabase_schema.sql.
+
+    Every method builds one PostgREST query and hands it to _run. The async
+    server subclasses this with an awaiting _run, so the same methods return
+    coroutines there.
+    """
+    def __init__(self, client):
+        self.db = client
+
+    def _run(self, query, transform=None):
+        rows = query.execute().data or []
+        return transform(rows) if transform else rows
+
+    # Users
+    def get_user(self, user_id):
+        return self._run(self.db.table('users').select('*').eq('id', str(user_id)), _first)
+
+    def upsert_user(self, row):
+        return self._run(self.db.table('users').upsert(row))
+
+    def list_users(self):
+        return self._run(self.db.table('users').select('id, username, avatar, role'))
+
+    def set_user_role(self, username, role):
+        return self._run(self.db.table('users').update({'role': role}).eq('username', username))
+
+    # Sessions
+    def get_session(self, session_id):
+        return self._run(self.db.table('sessions').select('*').eq('session_id', session_id), _first)
+
+    def create_session(self, row):
+        return self._run(self.db.table('sessions').insert(row))
+
+    def touch_session(self, session_id, last_seen):
+        return self._run(self.db.table('sessions').update({'last_seen': last_seen}).eq('session_id', session_id))
+
+    def expired_session_ids(self, created_before, seen_before, limit):
+        # A NULL last_seen (rows from before the column existed) idles from created_at, as in SQLiteStore
+        return self._run(self.db.table('sessions').select('session_id')
+                         .or_(f'created_at.lt."{created_before}",last_seen.lt."{seen_before}",'
+                              f'and(last_seen.is.null,created_at.lt."{seen_before}")').limit(limit),
+                         lambda rows: [r['session_id'] for r in rows])
+
+    def delete_sessions(self, session_ids):
+        return self._run(self.db.table('sessions').delete().in_('session_id', list(session_ids)))
+
+    # Comments
+    def comments_for_page(self, page_id):
+        return self._run(self.db.table('comments').select('*').eq('page_id', page_id))
+
+    def get_comment(self, comment_id):
+        return self._run(self.db.table('comments').select('*').eq('id', comment_id), _first)
+
+    def insert_comment(self, row):
+        return self._run(self.db.table('comments').insert(row))
+
+    def update_comment(self, comment_id, values):
+        return self._run(self.db.table('comments').update(values).eq('id', comment_id))
+
+    # Profiles
+    def get_profile(self, username):
+        return self._run(self.db.table('user_profiles').select('*').eq('username', username), _first)
+
+    def upsert_profile(self, row):
+        return self._run(self.db.table('user_profiles').upsert(row))
+
+    # Activity
+    def log_activity(self, entry):
+        return self._run(self.db.table('activity_logs').insert(entry))
+
+    def recent_activity(self, username=None, limit=50):
+        query = self.db.table('activity_logs').select('*')
+        if username:
+            query = query.eq('user', username)
+        return self._run(query.order('timestamp', desc=True).limit(limit))
+
+    # Wiki pages
+    def get_page(self, path):
+        return self._run(self.db.table('wiki_pages').select('content').eq('path', path),
+                         lambda rows: rows[0]['content'] if rows else None)
+
+    def get_page_record(self, path):
+        return self._run(self.db.table('wiki_pages').select('content,updated_at').eq('path', path), _first)
+
+    def save_page(self, path, content):
+        return self._run(self.db.table('wiki_pages').upsert({
+            'path': path,
+            'content': content,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }))
+
+    def delete_page(self, path):
+        return self._run(self.db.table('wiki_pages').delete().eq('path', path))
+
+class SQLiteStore:
+    """The same repository on an embedded SQLite database in WAL mode.
+
+    Mirrors supabase_schema.sql; JSONB columns are stored as JSON text and
+    decoded on read. Each thread gets its own connection.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            avatar TEXT,
+            role TEXT DEFAULT 'user'
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            username TEXT PRIMARY KEY,
+            rank TEXT DEFAULT 'Outer Disciple',
+            title TEXT DEFAULT '',
+            about TEXT DEFAULT '',
+            banner TEXT DEFAULT '',
+            join_date TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS comments (
+            id TEXT PRIMARY KEY,
+            page_id TEXT NOT NULL,
+            user_id TEXT REFERENCES users(id) ON DELETE CASCADE,
+            parent_id TEXT REFERENCES comments(id) ON DELETE CASCADE,
+            text TEXT NOT NULL,
+            created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+            is_pinned INTEGER DEFAULT 0,
+            is_deleted INTEGER DEFAULT 0,
+            likes TEXT DEFAULT '[]',
+            dislikes TEXT DEFAULT '[]',
+            replies TEXT DEFAULT '[]'
+        );
+        CREATE INDEX IF NOT EXISTS idx_comments_page_id ON comments(page_id);
+        CREATE INDEX IF NOT EXISTS idx_comments_parent_id ON comments(parent_id);
+
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT REFERENCES users(id) ON DELETE CASCADE,
+            created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+            last_seen TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
+        CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at);
+
+        CREATE TABLE IF NOT EXISTS activity_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            "user" TEXT NOT NULL,
+            action TEXT NOT NULL,
+            type TEXT NOT NULL,
+            details TEXT,
+            timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_activity_logs_timestamp ON activity_logs(timestamp DESC);
+        CREATE INDEX IF NOT EXISTS idx_activity_logs_user ON activity_logs("user", timestamp DESC);
+
+        CREATE TABLE IF NOT EXISTS wiki_pages (
+            path TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+        );
+    """
+    # Columns added since a table was first created: (table, column, definition)
+    ADDED_COLUMNS = (
+        ('sessions', 'last_seen', 'TEXT'),
+    )
+    JSON_COLUMNS = {'likes', 'dislikes', 'replies', 'details'}
+    BOOL_COLUMNS = {'is_pinned', 'is_deleted'}
+    COLUMNS = {
+        'users': ('id', 'username', 'avatar', 'role'),
+        'user_profiles': ('username', 'rank', 'title', 'about', 'banner', 'join_date'),
+        'comments': ('id', 'page_id', 'user_id', 'parent_id', 'text', 'created_at', 'is_pinned',
+                     'is_deleted', 'likes', 'dislikes', 'replies'),
+        'sessions': ('session_id', 'user_id', 'created_at', 'last_seen'),
+        'activity_logs': ('id', 'user', 'action', 'type', 'details', 'timestamp'),
+        'wiki_pages': ('path', 'content', 'updated_at'),
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        conn = self._conn()
+        for table, column, definition in self.ADDED_COLUMNS:
+            existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=OFF')
+            self._local.conn = conn
+        return conn
+
+    def _decode(self, row):
+        out = dict(row)
+        for key, value in out.items():
+            if key in self.JSON_COLUMNS and isinstance(value, str):
+                out[key] = json.loads(value)
+            elif key in self.BOOL_COLUMNS and value is not None:
+                out[key] = bool(value)
+        return out
+
+    def _encode(self, table, row):
+        columns = self.COLUMNS[table]
+        unknown = [key for key in row if key not in columns]
+        if unknown:
+            raise ValueError(f"Unknown column(s) for {table}: {', '.join(unknown)}")
+        return {key: json.dumps(value) if key in self.JSON_COLUMNS and value is not None else value
+                for key, value in row.items()}
+
+    def _execute(self, table, op, sql, params=()):
+        started = time.perf_counter()
+        try:
+            cursor = self._conn().execute(sql, params)
+            rows = [self._decode(r) for r in cursor.fetchall()]
+        except Exception:
+            record_db_call(table, op, started, 'error')
+            raise
+        record_db_call(table, op, started, 'ok')
+        return rows
+
+    def _select(self, table, where, params=(), columns='*', suffix=''):
+        sql = f'SELECT {columns} FROM {table}' + (f' WHERE {where}' if where else '') + suffix
+        return self._execute(table, 'select', sql, params)
+
+    def _insert(self, table, row, conflict_key=None):
+        row = self._encode(table, row)
+        names = ', '.join(f'"{k}"' for k in row)
+        marks = ', '.join('?' for _ in row)
+        sql = f'INSERT INTO {table} ({names}) VALUES ({marks})'
+        if conflict_key:
+            updates = ', '.join(f'"{k}" = excluded."{k}"' for k in row if k != conflict_key)
+            sql += f' ON CONFLICT({conflict_key}) DO ' + (f'UPDATE SET {updates}' if updates else 'NOTHING')
+        return self._execute(table, 'upsert' if conflict_key else 'insert', sql + ' RETURNING *', tuple(row.values()))
+
+    def _update(self, table, values, key, key_value):
+        values = self._encode(table, values)
+        assignments = ', '.join(f'"{k}" = ?' for k in values)
+        sql = f'UPDATE {table} SET {assignments} WHERE "{key}" = ? RETURNING *'
+        return self._execute(table, 'update', sql, tuple(values.values()) + (key_value,))
+
+    # Users
+    def get_user(self, user_id):
+        return _first(self._select('users', 'id = ?', (str(user_id),)))
+
+    def upsert_user(self, row):
+        return self._insert('users', row, 'id')
+
+    def list_users(self):
+        return self._select('users', None, columns='id, username, avatar, role')
+
+    def set_user_role(self, username, role):
+        return self._update('users', {'role': role}, 'username', username)
+
+    # Sessions
+    def get_session(self, session_id):
+        return _first(self._select('sessions', 'session_id = ?', (session_id,)))
+
+    def create_session(self, row):
+        return self._insert('sessions', row)
+
+    def touch_session(self, session_id, last_seen):
+        return self._update('sessions', {'last_seen': last_seen}, 'session_id', session_id)
+
+    def expired_session_ids(self, created_before, seen_before, limit):
+        rows = self._select('sessions', 'created_at < ? OR COALESCE(last_seen, created_at) < ?',
+                            (created_before, seen_before, limit), columns='session_id', suffix=' LIMIT ?')
+        return [r['session_id'] for r in rows]
+
+    def delete_sessions(self, session_ids):
+        session_ids = list(session_ids)
+        marks = ', '.join('?' for _ in session_ids)
+        return self._execute('sessions', 'delete', f'DELETE FROM sessions WHERE session_id IN ({marks})', tuple(session_ids))
+
+    # Comments
+    def comments_for_page(self, page_id):
+        return self._select('comments', 'page_id = ?', (page_id,))
+
+    def get_comment(self, comment_id):
+        return _first(self._select('comments', 'id = ?', (comment_id,)))
+
+    def insert_comment(self, row):
+        return self._insert('comments', row)
+
+    def update_comment(self, comment_id, values):
+        return self._update('comments', values, 'id', comment_id)
+
+    # Profiles
+    def get_profile(self, username):
+        return _first(self._select('user_profiles', 'username = ?', (username,)))
+
+    def upsert_profile(self, row):
+        return self._insert('user_profiles', row, 'username')
+
+    # Activity
+    def log_activity(self, entry):
+        return self._insert('activity_logs', entry)
+
+    def recent_activity(self, username=None, limit=50):
+        suffix = ' ORDER BY timestamp DESC LIMIT ?'
+        if username:
+            return self._select('activity_logs', '"user" = ?', (username, limit), suffix=suffix)
+        return self._select('activity_logs', None, (limit,), suffix=suffix)
+
+    # Wiki pages
+    def get_page(self, path):
+        row = _first(self._select('wiki_pages', 'path = ?', (path,), columns='content'))
+        return row['content'] if row else None
+
+    def get_page_record(self, path):
+        return _first(self._select('wiki_pages', 'path = ?', (path,), columns='content, updated_at'))
+
+    def save_page(self, path, content):
+        return self._insert('wiki_pages', {
+            'path': path,
+            'content': content,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }, 'path')
+
+    def delete_page(self, path):
+        return self._execute('wiki_pages', 'delete', 'DELETE FROM wiki_pages WHERE path = ?', (path,))
+
+def open_store(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteStore(SQLITE_PATH)
+    if backend != 'supabase':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return SupabaseStore(_InstrumentedClient(create_client(SUPABASE_URL, SUPABASE_KEY)))
+
+store = open_store()
 
 # === DATABASE & SESSION MANAGER ===
 
@@ -52,70 +764,254 @@ import subprocess
 def git_push(message="Auto-save data"):
     pass # Deprecated by Supabase
 
+# === DISCORD HTTP ===
+class PooledResponse:
+    """An http.client response whose connection goes back to its pool once the body is read or closed."""
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # Only a fully read body leaves the connection at a request boundary
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._pool._release(self._key, conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HTTPConnectionPool:
+    """Thread-safe keep-alive connections for a few upstream hosts, on http.client.
+
+    At most max_connections requests per host are in flight (callers wait for
+    a slot) and up to max_idle finished connections are kept for reuse, each
+    for idle_timeout seconds. urlopen() is a stand-in for urllib.request.urlopen
+    on a Request: it returns a PooledResponse to read or stream and raises
+    urllib.error.HTTPError for 4xx/5xx. Redirects and proxies are not followed.
+
+    Idle connections the server has already closed are dropped before use.
+    A reused connection that fails anyway is retried on a fresh one only for
+    idempotent methods; a POST may have reached the server and is not replayed.
+    """
+    IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+
+    def __init__(self, max_connections=DISCORD_MAX_CONNECTIONS, max_idle=DISCORD_MAX_IDLE,
+                 idle_timeout=DISCORD_IDLE_TIMEOUT, connect_timeout=DISCORD_CONNECT_TIMEOUT,
+                 read_timeout=DISCORD_READ_TIMEOUT, ssl_context=None):
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self._idle = {}   # (scheme, host, port) -> [(connection, idle since)]
+        self._slots = {}  # (scheme, host, port) -> BoundedSemaphore
+        self._lock = threading.Lock()
+
+    def _slot(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = threading.BoundedSemaphore(self.max_connections)
+            return slot
+
+    def _idle_connection(self, key):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since < self.idle_timeout and not self._dropped(conn):
+                    return conn
+                conn.close()
+        return None
+
+    @staticmethod
+    def _dropped(conn):
+        """True when an idle connection is readable: the server closed it (or sent something unasked)."""
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _release(self, key, conn, reusable):
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append((conn, time.monotonic()))
+                    conn = None
+        if conn is not None:
+            conn.close()
+        self._slot(key).release()
+
+    def request(self, method, url, body=None, headers=None):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        slot = self._slot(key)
+        if not slot.acquire(timeout=self.connect_timeout + self.read_timeout):
+            raise TimeoutError(f"No free connection to {key[1]} within {self.connect_timeout + self.read_timeout:g}s")
+        try:
+            conn = self._idle_connection(key)
+            while True:
+                reused = conn is not None
+                if not reused:
+                    conn = self._connect(key)
+                try:
+                    conn.request(method, target, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionError):
+                    conn.close()
+                    if not reused or method.upper() not in self.IDEMPOTENT_METHODS:
+                        raise
+                    # The server closed the idle connection under us; safe to send again on a fresh one
+                    conn = None
+                    continue
+                except Exception:
+                    conn.close()
+                    raise
+                break
+        except Exception:
+            slot.release()
+            raise
+        Metrics.inc('rtoc_http_connections_total', (('host', key[1]), ('connection', 'reused' if reused else 'new')))
+        return PooledResponse(self, key, conn, response)
+
+    def urlopen(self, req):
+        """Send a urllib.request.Request; like urlopen, 4xx/5xx raise HTTPError (with the body read)."""
+        res = self.request(req.get_method(), req.full_url, body=req.data, headers=dict(req.header_items()))
+        if res.status >= 400:
+            with res:
+                body = res.read()
+            raise urllib.error.HTTPError(req.full_url, res.status, res.reason, res.headers, io.BytesIO(body))
+        return res
+
+discord_http = HTTPConnectionPool()
+
+def _rate_limit_delay(headers, body, attempt, base_delay_seconds=1.0, max_delay_seconds=10.0):
+    """Work out how long to wait after a 429/503 from Discord (headers, then body, then backoff)."""
+    retry_after_header = None
+    try:
+        retry_after_header = headers.get('Retry-After')
+    except Exception:
+        retry_after_header = None
+
+    reset_after_header = None
+    try:
+        reset_after_header = headers.get('X-RateLimit-Reset-After')
+    except Exception:
+        reset_after_header = None
+
+    body_json = None
+    if body:
+        try:
+            body_json = json.loads(body.decode('utf-8', errors='ignore'))
+        except Exception:
+            body_json = None
+
+    delay = None
+    if retry_after_header is not None:
+        try:
+            delay = float(retry_after_header)
+        except Exception:
+            delay = None
+    if delay is None and reset_after_header is not None:
+        try:
+            delay = float(reset_after_header)
+        except Exception:
+            delay = None
+    if delay is None and isinstance(body_json, dict) and body_json.get('retry_after') is not None:
+        try:
+            delay = float(body_json.get('retry_after'))
+        except Exception:
+            delay = None
+    if delay is None:
+        delay = base_delay_seconds * (2 ** attempt)
+    delay = max(0.0, min(float(delay), float(max_delay_seconds)))
+
+    try:
+        delay = delay + random.uniform(0.0, min(0.5, delay))
+    except Exception:
+        pass
+    return delay
+
+def discord_endpoint(url):
+    """Metrics label for a Discord URL, with snowflake ids collapsed ('/api/guilds/{id}/members/{id}')."""
+    return re.sub(r'/\d+', '/{id}', urllib.parse.urlparse(url).path)
+
+def record_discord_call(endpoint, status, started):
+    Metrics.observe('rtoc_discord_call_duration_seconds', time.perf_counter() - started, (('endpoint', endpoint),))
+    Metrics.inc('rtoc_discord_calls_total', (('endpoint', endpoint), ('status', status)))
+    if status == 429:
+        Metrics.inc('rtoc_discord_rate_limited_total', (('endpoint', endpoint),))
+
 def _urlopen_with_rate_limit_retry(req, max_attempts=3, base_delay_seconds=1.0, max_delay_seconds=10.0):
     last_err = None
+    endpoint = discord_endpoint(req.full_url)
     for attempt in range(max_attempts):
+        started = time.perf_counter()
         try:
-            return urllib.request.urlopen(req)
+            res = discord_http.urlopen(req)
         except urllib.error.HTTPError as e:
             last_err = e
+            record_discord_call(endpoint, e.code, started)
             if getattr(e, 'code', None) not in (429, 503):
                 raise
 
-            retry_after_header = None
-            try:
-                retry_after_header = e.headers.get('Retry-After')
-            except Exception:
-                retry_after_header = None
-
-            reset_after_header = None
-            try:
-                reset_after_header = e.headers.get('X-RateLimit-Reset-After')
-            except Exception:
-                reset_after_header = None
-
             body = None
-            body_json = None
             try:
                 body = e.read()
                 if body:
-                    try:
-                        body_json = json.loads(body.decode('utf-8', errors='ignore'))
-                    except Exception:
-                        body_json = None
-                    print(f"[HTTP {getattr(e, 'code', '?')}] Body: {body[:500]!r}")
+                    log_discord.warning("HTTP %s from %s: %r", getattr(e, 'code', '?'), endpoint, body[:500])
             except Exception:
                 body = None
-                body_json = None
-
-            delay = None
-            if retry_after_header is not None:
-                try:
-                    delay = float(retry_after_header)
-                except Exception:
-                    delay = None
-            if delay is None and reset_after_header is not None:
-                try:
-                    delay = float(reset_after_header)
-                except Exception:
-                    delay = None
-            if delay is None and isinstance(body_json, dict) and body_json.get('retry_after') is not None:
-                try:
-                    delay = float(body_json.get('retry_after'))
-                except Exception:
-                    delay = None
-            if delay is None:
-                delay = base_delay_seconds * (2 ** attempt)
-            delay = max(0.0, min(float(delay), float(max_delay_seconds)))
 
-            try:
-                delay = delay + random.uniform(0.0, min(0.5, delay))
-            except Exception:
-                pass
+            delay = _rate_limit_delay(e.headers, body, attempt, base_delay_seconds, max_delay_seconds)
 
             if attempt >= max_attempts - 1:
                 raise
             time.sleep(delay)
+            continue
+        except Exception:
+            record_discord_call(endpoint, 'error', started)
+            raise
+        record_discord_call(endpoint, res.status, started)
+        return res
 
 _discord_oauth_lock = threading.Lock()
 _discord_oauth_exchange_lock = threading.Lock()
@@ -165,6 +1061,134 @@ def _discord_oauth_set_rate_limit(retry_after_seconds):
             _discord_oauth_rate_limited_until = until
             _discord_oauth_rate_limited_retry_after = retry_after_seconds
 
+# === BACKGROUND JOBS ===
+class JobQueue:
+    """Bounded queue of side effects that shouldn't hold up a response, run on a few worker threads.
+
+    handlers maps a job name to a function taking the job's keyword payload.
+    A job that raises is retried with exponential backoff, up to max_attempts
+    runs. One that still fails, fails permanently (a 4xx from Discord other
+    than 429), or finds the queue full is appended to JOB_DEAD_LETTER_FILE
+    rather than lost without a trace. Workers start on the first submit, so
+    every pre-fork worker runs its own.
+    """
+    REDACTED_KEYS = ('access_token',)
+
+    def __init__(self, handlers, workers=JOB_WORKERS, size=JOB_QUEUE_SIZE,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY):
+        self.handlers = handlers
+        self.workers = workers
+        self.size = size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._heap = []  # (due, seq, name, payload, attempt)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._started = False
+
+    def submit(self, name, **payload):
+        """Queue a job; False (and dead-lettered) when the queue is full."""
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        with self._cond:
+            accepted = len(self._heap) < self.size
+            if accepted:
+                self._push(time.monotonic(), name, payload, 1)
+                self._start()
+        if not accepted:
+            Metrics.inc('rtoc_jobs_total', (('job', name), ('outcome', 'rejected')))
+            self._dead_letter(name, payload, 0, 'queue full')
+        return accepted
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _push(self, due, name, payload, attempt):
+        heapq.heappush(self._heap, (due, next(self._seq), name, payload, attempt))
+        Metrics.gauge_add('rtoc_job_queue_depth', 1)
+        self._cond.notify()
+
+    def _start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(max(1, self.workers)):
+            threading.Thread(target=self._work, name=f"job-{i}", daemon=True).start()
+
+    def _take(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        Metrics.gauge_add('rtoc_job_queue_depth', -1)
+                        return heapq.heappop(self._heap)[2:]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    @staticmethod
+    def retryable(error):
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in (408, 429) or error.code >= 500
+        return True
+
+    def _work(self):
+        while True:
+            name, payload, attempt = self._take()
+            try:
+                self.handlers[name](**payload)
+            except Exception as e:
+                if attempt < self.max_attempts and self.retryable(e):
+                    delay = min(60.0, self.retry_delay * 2 ** (attempt - 1))
+                    log_server.warning(f"Job {name} failed (attempt {attempt}/{self.max_attempts}), retrying in {delay:g}s: {e}")
+                    Metrics.inc('rtoc_jobs_total', (('job', name), ('outcome', 'retry')))
+                    with self._cond:
+                        self._push(time.monotonic() + delay, name, payload, attempt + 1)
+                    continue
+                log_server.error(f"Job {name} failed after {attempt} attempt(s), dead-lettered: {e}")
+                Metrics.inc('rtoc_jobs_total', (('job', name), ('outcome', 'dead')))
+                self._dead_letter(name, payload, attempt, str(e))
+                continue
+            Metrics.inc('rtoc_jobs_total', (('job', name), ('outcome', 'ok')))
+
+    def _dead_letter(self, name, payload, attempts, error):
+        record = {
+            'job': name,
+            'payload': {k: '[redacted]' if k in self.REDACTED_KEYS else v for k, v in payload.items()},
+            'attempts': attempts,
+            'error': error,
+            'failed_at': datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            with FileHandler.get_lock(JOB_DEAD_LETTER_FILE), open(JOB_DEAD_LETTER_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            log_server.error(f"Could not dead-letter job {name}: {e}")
+
+def join_guild(user_id, access_token):
+    """Add a Discord user to GUILD_ID with the bot token (201 = joined, 204 = already a member)."""
+    join_req = urllib.request.Request(
+        f"https://discord.com/api/guilds/{GUILD_ID}/members/{user_id}",
+        data=json.dumps({'access_token': access_token}).encode(),
+        method='PUT',
+        headers={
+            'Authorization': f"Bot {BOT_TOKEN}",
+            'Content-Type': 'application/json',
+            'User-Agent': 'DiscordBot'
+        }
+    )
+    with _urlopen_with_rate_limit_retry(join_req) as join_res:
+        # Read the (usually empty) body so the connection goes back to the pool
+        join_res.read()
+        log_discord.info("Auto-join status: %s", join_res.status)
+
+jobs = JobQueue({
+    'guild_join': join_guild,
+    'log_activity': lambda entry: store.log_activity(entry),
+})
+
 # === FILE HANDLER ===
 class FileHandler:
     _locks = {}
@@ -202,7 +1226,7 @@ class FileHandler:
                 shutil.move(temp_path, filename)
                 return True
             except Exception as e:
-                print(f"[FILE WRITE ERROR] {filename}: {e}", file=sys.stderr)
+                log_server.error(f"File write error {filename}: {e}")
                 if 'temp_path' in locals() and os.path.exists(temp_path):
                     try: os.remove(temp_path)
                     except: pass
@@ -233,34 +1257,41 @@ class UserDatabase:
     @staticmethod
     def get(user_id):
         try:
-            response = supabase.table('users').select('*').eq('id', str(user_id)).execute()
-            if response.data:
-                return response.data[0]
-            return None
+            return store.get_user(user_id)
         except Exception as e:
-            print(f"[DB] Error getting user {user_id}: {e}", file=sys.stderr)
+            log_db.error(f"Error getting user {user_id}: {e}")
             return None
             
     @staticmethod
     def save(user_data):
+        # Check if user exists to preserve role
+        existing_user = UserDatabase.get(str(user_data['id']))
+        final_data = UserDatabase.resolve(user_data, existing_user)
+        
+        try:
+            store.upsert_user(final_data)
+        except Exception as e:
+            log_db.error(f"Error saving user {final_data['id']}: {e}")
+        else:
+            PermissionService.note_user(final_data)
+        InvalidationBus.publish('users', final_data['id'])
+            
+        return final_data
+
+    @staticmethod
+    def resolve(user_data, existing_user):
+        """Build the row to upsert for user_data, keeping the role already stored for existing_user."""
         uid = str(user_data['id'])
         uname = user_data.get('username', '')
         
-        # Check if user exists to preserve role
-        existing_user = UserDatabase.get(uid)
-        
         # Determine initial role
         role = user_data.get('role', 'user')
         
         # 1. Check permissions.json (Static Config)
-        try:
-            static_perms = FileHandler.read_json('permissions.json')
-            if uname in static_perms:
-                role = static_perms[uname]
-                print(f"[DB] Role for {uname} found in permissions.json: {role}")
-        except Exception as e:
-            print(f"[DB] Error reading permissions.json: {e}")
-            pass
+        static_role = PermissionService.static_role(uname)
+        if static_role is not None:
+            role = static_role
+            log_db.debug("Role for %s found in permissions.json: %s", uname, role)
 
         # 2. Preserve existing DB role if it exists and wasn't overridden by static config
         if existing_user and 'role' in existing_user and role == 'user':
@@ -270,42 +1301,32 @@ class UserDatabase:
         if uid == '1021410672803844129' or uname.lower() == 'baderso':
             role = 'owner'
             
-        final_data = {
+        return {
             'id': uid,
             'username': uname,
             'avatar': user_data.get('avatar', ''),
             'role': role
         }
-        
-        try:
-            supabase.table('users').upsert(final_data).execute()
-        except Exception as e:
-            print(f"[DB] Error saving user {uid}: {e}", file=sys.stderr)
-            
-        return final_data
 class SessionManager:
     @staticmethod
-    def create(user_id):
+    def create(user_id, user=None):
+        if user is not None and SessionTokens.enabled():
+            return SessionTokens.issue(user)
         session_id = str(uuid.uuid4())
-        session_data = {
-            'session_id': session_id,
-            'user_id': str(user_id),
-            'created_at': datetime.now(timezone.utc).isoformat()
-        }
         try:
-            supabase.table('sessions').insert(session_data).execute()
+            store.create_session(SessionExpiry.new_row(session_id, user_id))
         except Exception as e:
-            print(f"[DB] Error creating session: {e}", file=sys.stderr)
+            log_db.error(f"Error creating session: {e}")
         return session_id
     @staticmethod
-    def get_user(headers):
+    def session_id_from_headers(headers):
         session_id = None
         
         # 1. Try Authorization header first (works cross-origin)
         auth_header = headers.get('Authorization', '')
         if auth_header.startswith('Bearer '):
             session_id = auth_header[7:].strip()
-            print(f"[AUTH] Found Bearer Token: {session_id[:8]}...")
+            log_auth.debug("Found Bearer Token: %s...", session_id[:8])
         
         # 2. Fallback to cookie (works same-origin)
         if not session_id:
@@ -318,28 +1339,66 @@ class SessionManager:
                         cookies[parts[0].strip()] = parts[1].strip()
                 session_id = cookies.get('session')
                 if session_id:
-                    print(f"[AUTH] Found Cookie Session: {session_id[:8]}...")
-        
+                    log_auth.debug("Found Cookie Session: %s...", session_id[:8])
+        return session_id
+    @staticmethod
+    def get_user(headers):
+        session_id = SessionManager.session_id_from_headers(headers)
         if not session_id: 
-            print("[AUTH] No session ID found in headers/cookies")
+            log_auth.debug("No session ID found in headers/cookies")
             return None
         
+        if SessionTokens.is_token(session_id):
+            return SessionManager.user_from_token(session_id)
+        
+        cached, user = SessionCache.get(session_id)
+        if cached:
+            return user
+        generation = SessionCache.generation()
         try:
-            response = supabase.table('sessions').select('*').eq('session_id', session_id).execute()
-            if response.data:
-                user_id = response.data[0]['user_id']
-                user = UserDatabase.get(user_id)
+            session = store.get_session(session_id)
+            if session and SessionExpiry.expired(session):
+                log_auth.debug("Session expired: %s...", session_id[:8])
+                SessionCache.put(session_id, None, generation)
+            elif session:
+                SessionExpiry.seen(session)
+                user_id = session['user_id']
+                # Not UserDatabase.get: a database error must not be cached as "no such user"
+                user = store.get_user(user_id)
                 if user:
-                    print(f"[AUTH] Session valid for user: {user.get('username')} ({user_id})")
+                    log_auth.debug("Session valid for user: %s (%s)", user.get('username'), user_id)
                 else:
-                    print(f"[AUTH] Session points to non-existent user: {user_id}")
+                    log_auth.warning("Session points to non-existent user: %s", user_id)
+                SessionCache.put(session_id, user, generation)
                 return user
             else:
-                print(f"[AUTH] Session ID not found in database: {session_id[:8]}...")
+                log_auth.debug("Session ID not found in database: %s...", session_id[:8])
+                SessionCache.put(session_id, None, generation)
         except Exception as e:
-            print(f"[DB] Error verifying session: {e}", file=sys.stderr)
+            log_db.error(f"Error verifying session: {e}")
             
         return None
+    @staticmethod
+    def user_from_token(token):
+        claims = SessionTokens.verify(token)
+        if claims is None:
+            log_auth.debug("Invalid, expired or revoked session token")
+            return None
+        if SessionTokens.is_current(claims):
+            return SessionTokens.user(claims)
+
+        # The role changed after the token was issued, so the stored user is authoritative
+        cached, user = SessionCache.get(claims['jti'])
+        if cached:
+            return user
+        generation = SessionCache.generation()
+        try:
+            user = store.get_user(claims['uid'])
+        except Exception as e:
+            log_db.error(f"Error verifying session: {e}")
+            return None
+        SessionCache.put(claims['jti'], user, generation)
+        return user
 # === HELPER FUNCTIONS ===
 def get_authenticated_user(request_handler):
     """Get the authenticated user from the request's session cookie or Authorization header."""
@@ -348,7 +1407,7 @@ def get_authenticated_user(request_handler):
 def is_admin(user):
     """Check if a user has admin or owner role."""
     if not user:
-        print("[ADMIN CHECK] Failed: User object is None")
+        log_auth.debug("Admin check failed: User object is None")
         return False
     
     uid = str(user.get('id', ''))
@@ -357,27 +1416,1369 @@ def is_admin(user):
     
     # Hardcoded owner check (ID or Username)
     if uid == '1021410672803844129' or uname == 'baderso':
-        print(f"[ADMIN CHECK] Success: Owner match ({uname})")
+        log_auth.debug("Admin check success: Owner match (%s)", uname)
         return True
     
     # Role-based check
     if role in ['admin', 'owner']:
-        print(f"[ADMIN CHECK] Success: Role match ({role}) for {uname}")
+        log_auth.debug("Admin check success: Role match (%s) for %s", role, uname)
         return True
         
-    print(f"[ADMIN CHECK] Denied for {uname} (ID: {uid}, Role: {role})")
+    log_auth.debug("Admin check denied for %s (ID: %s, Role: %s)", uname, uid, role)
     return False
 
-from html.parser import HTMLParser
-import re
+def request_proto_host(headers):
+    """(scheme, host) the client used, honouring X-Forwarded-Proto / X-Forwarded-Host from the proxy."""
+    proto = headers.get('X-Forwarded-Proto')
+    if proto:
+        proto = proto.split(',')[0].strip()
+    if not proto:
+        proto = 'https' if os.environ.get('RENDER') else 'http'
+
+    host = headers.get('X-Forwarded-Host') or headers.get('Host')
+    if host:
+        host = host.split(',')[0].strip()
+    if not host:
+        host = f"localhost:{PORT}"
+
+    return proto, host
+
+def discord_redirect_uri(headers):
+    # Prefer configured redirect URI to avoid mismatches between domains/proxies.
+    if REDIRECT_URI:
+        return REDIRECT_URI
+    proto, host = request_proto_host(headers)
+    return f"{proto}://{host}/auth/discord/callback"
+
+EDITOR_SCRIPT_TAG = '<script src="/scripts/editor.js"></script>'
+
+BODY_CLOSE_RE = re.compile(r'</body\s*>', re.IGNORECASE)
+
+def inject_editor_script(content):
+    """Make sure a page includes editor.js so admins can toggle edit mode."""
+    if 'editor.js' in content:
+        return content
+    # The last </body> in any case; the exact-case rfind just narrows the regex scan
+    closing = None
+    for closing in BODY_CLOSE_RE.finditer(content, max(0, content.rfind('</body>'))):
+        pass
+    idx = closing.start() if closing else -1
+    if idx != -1:
+        content = content[:idx] + EDITOR_SCRIPT_TAG + '\n' + content[idx:]
+    else:
+        content = content + '\n' + EDITOR_SCRIPT_TAG
+    return content
+
+def shape_comments(page_comments, users, sort_by='newest'):
+    """Sort a page's comments and attach the latest username/avatar/role for the frontend."""
+    # Sort comments based on requested order, with PINNED comments always on top
+    if sort_by == 'oldest':
+        # Pinned first (False < True for 'not is_pinned'), then oldest (small timestamp)
+        page_comments.sort(key=lambda c: (not c.get('is_pinned', False), c.get('created_at', '')))
+    elif sort_by == 'top':
+        # Pinned first (True > False), then highest score
+        page_comments.sort(key=lambda c: (c.get('is_pinned', False), len(c.get('likes', [])) - len(c.get('dislikes', []))), reverse=True)
+    else:  # newest (default)
+         # Pinned first (True > False), then newest (large timestamp)
+        page_comments.sort(key=lambda c: (c.get('is_pinned', False), c.get('created_at', '')), reverse=True)
+
+    if users is None:
+        return page_comments
+    users_map = {row['id']: row for row in users}
+    for c in page_comments:
+        # Map text -> content for frontend compatibility
+        c['content'] = c.get('text', '')
+        
+        uid = c.get('user_id')
+        if uid and uid in users_map:
+            u_info = users_map[uid]
+            c['user'] = u_info.get('username', 'Unknown')
+            c['avatar'] = u_info.get('avatar')
+            c['role'] = u_info.get('role', 'user')
+        else:
+            # Fallback for anonymous or missing users
+            c['user'] = c.get('user', 'Anonymous')
+    return page_comments
+
+def discord_avatar_url(user_data):
+    if user_data.get('avatar'):
+        ext = 'gif' if user_data['avatar'].startswith('a_') else 'png'
+        return f"https://cdn.discordapp.com/avatars/{user_data['id']}/{user_data['avatar']}.{ext}"
+    try:
+        index = (int(user_data['id']) >> 22) % 6
+    except:
+        index = 0
+    return f"https://cdn.discordapp.com/embed/avatars/{index}.png"
+
+def api_cors_headers(origin):
+    """CORS headers for /api/, /auth/ and /save responses."""
+    # Check if origin is in ALLOWED_ORIGINS
+    if origin in ALLOWED_ORIGINS:
+        allow_origin = origin
+    elif not origin:
+        # Fallback for non-browser clients or same-origin requests without Origin header
+        allow_origin = '*'
+    else:
+        # Default to primary for safety if origin not in list
+        allow_origin = ALLOWED_ORIGINS[0]
+    return [
+        ('Access-Control-Allow-Origin', allow_origin),
+        ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, DELETE, PUT'),
+        ('Access-Control-Allow-Headers', 'Content-Type, Authorization, X-Requested-With, Accept, Cache-Control, Pragma, Expires'),
+        ('Access-Control-Allow-Credentials', 'true'),
+        ('Vary', 'Origin'),
+    ]
+
+# === HTTP CACHING ===
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+
+def parse_cache_rules(spec):
+    """Parse CACHE_CONTROL_RULES into (path prefix, policy) pairs, longest prefix first."""
+    rules = []
+    for item in spec.split(';'):
+        prefix, sep, policy = item.partition('=')
+        if sep and prefix.strip() and policy.strip():
+            rules.append((prefix.strip(), policy.strip()))
+    return sorted(rules, key=lambda rule: len(rule[0]), reverse=True)
+
+CACHE_RULES = parse_cache_rules(CACHE_CONTROL_RULES)
+
+def cache_policy(path, status=200):
+    """Cache-Control for a response to path.
+
+    Errors are never stored. Otherwise a matching CACHE_CONTROL_RULES entry
+    wins; by default API and auth responses are per-user and never stored
+    (except the shared role map, which is revalidated against its ETag),
+    uploads (uuid names) and fingerprinted build outputs are immutable, HTML
+    is revalidated on every use and other static files are cached briefly.
+    """
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    if status >= 400:
+        return 'no-store'
+    for prefix, policy in CACHE_RULES:
+        if path.startswith(prefix):
+            return policy
+    if path == '/api/permissions':
+        return 'no-cache'
+    if path.startswith(('/api/', '/auth/')) or path == '/save':
+        return 'no-store'
+    if path.startswith('/assets/uploads/') or FINGERPRINT_RE.search(path):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    if path.endswith(('/', '.html')):
+        return 'no-cache'
+    return f'public, max-age={STATIC_MAX_AGE}'
+
+class StaticFile:
+    __slots__ = ('size', 'mtime', 'mtime_ns', 'ctype', 'etag', 'checked')
+
+class StaticFiles:
+    """Metadata for static files: size, mtime, content type and a content-hash ETag.
+
+    Entries are re-stat'ed at most every STATIC_STAT_TTL seconds, and the file
+    is only rehashed when its size or mtime changes.
+    """
+    _meta = {}
+
+    @staticmethod
+    def lookup(path, guess_type):
+        """Return the StaticFile for path, or None if it is not a regular file."""
+        now = time.monotonic()
+        meta = StaticFiles._meta.get(path)
+        if meta and now - meta.checked < STATIC_STAT_TTL:
+            return meta
+        try:
+            st = os.stat(path)
+        except OSError:
+            StaticFiles._meta.pop(path, None)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if not meta or meta.mtime_ns != st.st_mtime_ns or meta.size != st.st_size:
+            digest = hashlib.blake2b(digest_size=12)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            meta = StaticFile()
+            meta.size = st.st_size
+            meta.mtime = st.st_mtime
+            meta.mtime_ns = st.st_mtime_ns
+            meta.ctype = guess_type(path)
+            meta.etag = f'"{digest.hexdigest()}"'
+        meta.checked = now
+        StaticFiles._meta[path] = meta
+        return meta
+
+class AssetManifest:
+    """Maps scripts/*.js and styles/*.css to the fingerprinted copies from scripts/build_assets.py.
+
+    Loaded once at startup - the build runs before the server starts on
+    deploy. Without a manifest HTML is served unchanged.
+    """
+    # src/href values that resolve to the site root: '/', '../../', './' or no prefix at all
+    REF_RE = re.compile(r'''((?:src|href)=["'])((?:\.{1,2}/)*|/)((?:scripts|styles)/[\w.-]+\.(?:js|css))(?:\?[^"'#]*)?(["'])''')
+    BUILT_RE = re.compile(r'dist/((?:scripts|styles)/[\w.-]+?)\.[0-9a-f]{8,}\.(js|css)')
+    entries = {}
+
+    @staticmethod
+    def load(path=ASSET_MANIFEST):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                AssetManifest.entries = json.load(f)
+        except FileNotFoundError:
+            AssetManifest.entries = {}
+        except (OSError, ValueError) as e:
+            log_server.error(f"Could not read asset manifest {path}: {e}")
+            AssetManifest.entries = {}
+
+    @staticmethod
+    def rewrite(html):
+        """Point asset references in served HTML at their fingerprinted builds."""
+        entries = AssetManifest.entries
+        if not entries:
+            return html
+
+        def replace(m):
+            built = entries.get(m.group(3))
+            return f"{m.group(1)}{m.group(2)}{built}{m.group(4)}" if built else m.group(0)
+        return AssetManifest.REF_RE.sub(replace, html)
+
+    @staticmethod
+    def restore(html):
+        """Undo rewrite() on HTML coming back from the editor, so stored pages never name a build."""
+        return AssetManifest.BUILT_RE.sub(r'\1.\2', html)
+
+AssetManifest.load()
+
+# === HTML PIPELINE ===
+def normalize_nav(html_content, file_path):
+    """Give the nav bar the nav-start / nav-end layout and drop stray active classes and inline styles."""
+    # 1. First, remove ALL manual 'active' classes from links
+    html_content = re.sub(r'class="nav-link active"', 'class="nav-link"', html_content)
+    
+    # 2. Remove problematic inline styles on nav-links (especially the one on Concepts)
+    html_content = re.sub(r'<a href="[^"]*concepts\.html" class="nav-link"\s+style="[^"]*">Concepts</a>', 
+                          r'<a href="concepts.html" class="nav-link">Concepts</a>', html_content)
+    
+    # Remove any other inline styles on nav-links
+    html_content = re.sub(r'(<a href="[^"]*" class="nav-link")\s+style="[^"]*"', r'\1', html_content)
+
+    # 3. Move a rogue {Pages} link from outside the nav list into it
+    pages_link_match = re.search(r'<a href="[^"]*pages\.html" class="nav-link"[^>]*>\{Pages\}</a>', html_content)
+    if pages_link_match:
+        html_content = html_content.replace(pages_link_match.group(0), "")
+
+    # 4. Restructure Nav Container
+    # We want: <nav class="nav"><div class="nav-container"><div class="nav-start">LOGO + TOGGLE + LINKS</div><div class="nav-end">SEARCH + LOGIN</div></div></nav>
+    nav_container_pattern = r'(<div class="nav-container">)(.*?)(</div>\s*</nav>)'
+    
+    def replacer(match):
+        prefix = match.group(1)
+        content = match.group(2)
+        suffix = match.group(3)
+        
+        # Logo, toggle and links end at </ul>; search and login follow it
+        split_match = re.search(r'</ul>', content)
+        if split_match:
+            split_pos = split_match.end()
+            start_part = content[:split_pos].strip()
+            end_part = content[split_pos:].strip()
+            
+            # Ensure Pages is in the start_part links if we found a rogue one earlier
+            if pages_link_match and 'Pages</a>' not in start_part:
+                # Calculate relative path based on file depth
+                depth = len(os.path.normpath(file_path).replace("\\", "/").split("/")) - 1
+                rel_pages = "pages.html" if depth > 0 else "pages/pages.html"
+                if "pages/" in file_path and depth > 1: rel_pages = "../pages.html"
+                
+                start_part = re.sub(r'</ul>', f'    <li><a href="{rel_pages}" class="nav-link">Pages</a></li>\n            </ul>', start_part)
+            
+            return f'{prefix}\n            <div class="nav-start">\n                {start_part}\n            </div>\n            <div class="nav-end">\n                {end_part}\n            </div>\n        {suffix}'
+        
+        return match.group(0)
+
+    # Apply structural grouping if not already grouped
+    if 'class="nav-start"' not in html_content:
+        html_content = re.sub(nav_container_pattern, replacer, html_content, flags=re.DOTALL)
+
+    return html_content
+
+class HtmlPipeline:
+    """Transforms applied once, when page HTML is written: /save, imports and scripts/process_pages.py.
+
+    Every step is idempotent, so stored pages come out of it final and can be
+    run through it again safely. Asset fingerprinting is not a step: hashes
+    change with every deploy, so stored HTML keeps the source asset URLs and
+    render_page rewrites them when a page enters PageCache.
+    """
+    STEPS = (
+        lambda content, path: AssetManifest.restore(content),
+        normalize_nav,
+        lambda content, path: inject_editor_script(content),
+    )
+
+    @staticmethod
+    def process(content, path=''):
+        for step in HtmlPipeline.STEPS:
+            content = step(content, path)
+        return content
+
+    @staticmethod
+    def is_final(content):
+        """Cheap check that content already went through process() - the last step leaves editor.js in it."""
+        return 'editor.js' in content
+
+def render_page(content, path=''):
+    """HTML to serve for a stored page: asset URLs fingerprinted.
+
+    Pages written before the pipeline existed get it applied here, once per
+    PageCache fill rather than on every view.
+    """
+    if not HtmlPipeline.is_final(content):
+        content = HtmlPipeline.process(content, path)
+    return AssetManifest.rewrite(content)
+
+# === IMAGE DERIVATIVES ===
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+class ImageDerivatives:
+    """Resized / transcoded copies of static images, generated once and kept in a bounded disk cache.
+
+    Files are named after the source's content hash, width and format, so an
+    edited source never serves an old derivative. Generation runs on a small
+    thread pool; concurrent requests for the same derivative share one job.
+    The oldest files are evicted once the directory grows past
+    IMAGE_CACHE_BYTES. Without Pillow every request gets the original.
+    """
+    SOURCE_TYPES = ('.jpg', '.jpeg', '.png', '.webp')
+    FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'png': 'PNG'}
+    _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+    _jobs = {}
+    _lock = threading.Lock()
+    _bytes = None
+
+    @staticmethod
+    def wants(path, query):
+        if Image is None or not query or not path.lower().endswith(ImageDerivatives.SOURCE_TYPES):
+            return None
+        params = urllib.parse.parse_qs(query)
+        fmt = params.get('fmt', [''])[0].lower()
+        width = params.get('w', [''])[0]
+        if fmt and fmt not in ImageDerivatives.FORMATS:
+            return None
+        if not width.isdigit() and not fmt:
+            return None
+        return (int(width) if width.isdigit() else None), fmt or None
+
+    @staticmethod
+    def snap(width):
+        for allowed in IMAGE_WIDTHS:
+            if allowed >= width:
+                return allowed
+        return IMAGE_WIDTHS[-1]
+
+    @staticmethod
+    def get(source, meta, width, fmt):
+        """Path of the derivative for source, or None to serve the original."""
+        ext = os.path.splitext(source)[1].lower().lstrip('.')
+        fmt = 'jpeg' if fmt == 'jpg' else fmt or ('jpeg' if ext == 'jpg' else ext)
+        width = ImageDerivatives.snap(width) if width else None
+        digest = meta.etag.strip('"')
+        name = f"{digest}-{width or 'full'}.{fmt}"
+        target = os.path.join(IMAGE_CACHE_DIR, name)
+        if os.path.exists(target):
+            Metrics.inc('rtoc_image_derivatives_total', (('result', 'hit'),))
+            return target
+        with ImageDerivatives._lock:
+            job = ImageDerivatives._jobs.get(name)
+            if job is None:
+                job = ImageDerivatives._pool.submit(ImageDerivatives._render, source, target, width, fmt)
+                ImageDerivatives._jobs[name] = job
+                job.add_done_callback(lambda _: ImageDerivatives._jobs.pop(name, None))
+        try:
+            return job.result(timeout=30)
+        except Exception as e:
+            log_server.error(f"Image derivative {name} failed: {e}")
+            return None
+
+    @staticmethod
+    def _render(source, target, width, fmt):
+        started = time.perf_counter()
+        with Image.open(source) as img:
+            if getattr(img, 'is_animated', False):
+                return None
+            if width and width < img.width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            elif fmt == os.path.splitext(source)[1].lower().lstrip('.').replace('jpg', 'jpeg'):
+                return None  # no resize and no transcode - the original is the derivative
+            if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=IMAGE_CACHE_DIR, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    img.save(f, ImageDerivatives.FORMATS[fmt], quality=IMAGE_QUALITY, optimize=True)
+                os.replace(temp_path, target)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+        Metrics.inc('rtoc_image_derivatives_total', (('result', 'generated'),))
+        Metrics.observe('rtoc_image_render_duration_seconds', time.perf_counter() - started)
+        ImageDerivatives._account(os.path.getsize(target))
+        return target
+
+    @staticmethod
+    def _account(added):
+        with ImageDerivatives._lock:
+            if ImageDerivatives._bytes is None:
+                ImageDerivatives._bytes = sum(e.stat().st_size for e in os.scandir(IMAGE_CACHE_DIR) if e.is_file())
+            else:
+                ImageDerivatives._bytes += added
+            if ImageDerivatives._bytes <= IMAGE_CACHE_BYTES:
+                return
+            files = sorted((e for e in os.scandir(IMAGE_CACHE_DIR) if e.is_file()), key=lambda e: e.stat().st_mtime)
+            for entry in files:
+                if ImageDerivatives._bytes <= IMAGE_CACHE_BYTES * 0.9:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    ImageDerivatives._bytes -= size
+                except OSError:
+                    pass
+
+MAX_RANGES = 16
+
+def parse_byte_ranges(header, size):
+    """Parse a Range header into inclusive (start, end) pairs.
+
+    Returns None when the header should be ignored (not bytes, malformed or
+    too many ranges) and [] when no range is satisfiable.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    parts = spec.split(',')
+    if len(parts) > MAX_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        first, dash, last = part.strip().partition('-')
+        if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+    return ranges
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against etag (RFC 9110 13.1.2)."""
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def not_modified(headers, etag, mtime):
+    """True if the request's If-None-Match (or, without one, If-Modified-Since) matches etag / mtime."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+    return False
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+def is_compressible(content_type):
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header allows gzip.
+
+    An explicit gzip entry decides on its own, wherever it appears; otherwise
+    a '*' entry does. q=0 (or an unparsable q) forbids the coding.
+    """
+    qualities = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if coding not in ('gzip', '*'):
+            continue
+        q = params.strip()
+        try:
+            qualities[coding] = float(q[2:]) if q.startswith('q=') else 1.0
+        except ValueError:
+            qualities[coding] = 0.0
+    if 'gzip' in qualities:
+        return qualities['gzip'] > 0
+    return qualities.get('*', 0.0) > 0
+
+def gzip_etag(etag):
+    return etag[:-1] + '-gz"'
+
+class GzipCache:
+    """Compressed bodies keyed by file version or content hash, so each version is gzipped once."""
+    _entries = OrderedDict()
+    _bytes = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(key, produce):
+        """Return the compressed bytes for key, calling produce() for the raw bytes on a miss."""
+        with GzipCache._lock:
+            data = GzipCache._entries.get(key)
+            if data is not None:
+                GzipCache._entries.move_to_end(key)
+                Metrics.inc('rtoc_gzip_cache_total', (('result', 'hit'),))
+                return data
+        Metrics.inc('rtoc_gzip_cache_total', (('result', 'miss'),))
+        data = gzip.compress(produce(), compresslevel=GZIP_LEVEL, mtime=0)
+        if len(data) > GZIP_CACHE_BYTES // 8:
+            return data
+        with GzipCache._lock:
+            if key not in GzipCache._entries:
+                GzipCache._entries[key] = data
+                GzipCache._bytes += len(data)
+            while GzipCache._bytes > GZIP_CACHE_BYTES:
+                _, evicted = GzipCache._entries.popitem(last=False)
+                GzipCache._bytes -= len(evicted)
+        return data
+
+def page_gzipped(page, accept_encoding):
+    """Whether negotiate_gzip will compress page for this client - its ETag differs when it does."""
+    return len(page.body) >= GZIP_MIN_SIZE and accepts_gzip(accept_encoding)
+
+def negotiate_gzip(body, content_type, accept_encoding):
+    """Return (body, extra headers) for a response, gzipped when worthwhile and accepted."""
+    if not is_compressible(content_type) or len(body) < GZIP_MIN_SIZE:
+        return body, []
+    if not accepts_gzip(accept_encoding):
+        return body, [('Vary', 'Accept-Encoding')]
+    key = ('body', hashlib.blake2b(body, digest_size=16).digest())
+    return GzipCache.get(key, lambda: body), [('Content-Encoding', 'gzip'), ('Vary', 'Accept-Encoding')]
+
+# === CACHE INVALIDATION ===
+class InvalidationBus:
+    """Delivers cache invalidations to local subscribers and, in pre-fork mode, to sibling workers.
+
+    Topics in use: 'pages' (key = page path), 'permissions' (key = username),
+    'sessions' (key = session id), 'users' (key = user id) and 'revocations'
+    (no key, reload REVOCATIONS_FILE).
+    Each worker holds one end of a Unix datagram socketpair; the parent process
+    relays every message it receives to all the other workers.
+    """
+    _subscribers = {}
+    _lock = threading.Lock()
+    _channel = None
+
+    @staticmethod
+    def subscribe(topic, callback):
+        with InvalidationBus._lock:
+            InvalidationBus._subscribers.setdefault(topic, []).append(callback)
+
+    @staticmethod
+    def publish(topic, key=None):
+        InvalidationBus._deliver(topic, key)
+        channel = InvalidationBus._channel
+        if channel is not None:
+            try:
+                channel.send(json.dumps({'topic': topic, 'key': key}).encode('utf-8'))
+            except OSError as e:
+                log_server.error(f"Failed to broadcast invalidation {topic}:{key}: {e}")
+
+    @staticmethod
+    def _deliver(topic, key):
+        with InvalidationBus._lock:
+            callbacks = list(InvalidationBus._subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(key)
+            except Exception as e:
+                log_server.error(f"Invalidation subscriber for {topic} failed: {e}")
+
+    @staticmethod
+    def attach(channel):
+        """Join the worker broadcast channel and start applying invalidations from siblings."""
+        InvalidationBus._channel = channel
+
+        def listen():
+            while True:
+                try:
+                    data = channel.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                try:
+                    msg = json.loads(data.decode('utf-8'))
+                except ValueError:
+                    continue
+                InvalidationBus._deliver(msg.get('topic'), msg.get('key'))
+
+        threading.Thread(target=listen, name='invalidation-listener', daemon=True).start()
+
+# === SESSION CACHE ===
+class SessionCache:
+    """Session id -> resolved user, so authenticated requests skip the sessions and users round trips.
+
+    Unknown session ids are cached too (as None), so a bogus token costs one
+    lookup per SESSION_CACHE_TTL rather than one per request. Entries go on
+    logout ('sessions'), when a user row is re-saved at login ('users') and
+    on role changes ('permissions'). Every invalidation bumps a generation,
+    and a lookup that raced one is not stored.
+    """
+    _entries = OrderedDict()  # session id -> (expires, user or None)
+    _generation = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(session_id):
+        """(True, user or None) when cached, (False, None) otherwise."""
+        with SessionCache._lock:
+            entry = SessionCache._entries.get(session_id)
+            if entry and entry[0] > time.monotonic():
+                SessionCache._entries.move_to_end(session_id)
+                user = entry[1]
+                Metrics.inc('rtoc_session_cache_total', (('result', 'hit' if user else 'negative'),))
+                return True, dict(user) if user else None
+            if entry:
+                del SessionCache._entries[session_id]
+        Metrics.inc('rtoc_session_cache_total', (('result', 'miss'),))
+        return False, None
+
+    @staticmethod
+    def generation():
+        return SessionCache._generation
+
+    @staticmethod
+    def put(session_id, user, generation):
+        with SessionCache._lock:
+            if SessionCache._generation != generation:
+                return
+            SessionCache._entries[session_id] = (time.monotonic() + SESSION_CACHE_TTL, dict(user) if user else None)
+            SessionCache._entries.move_to_end(session_id)
+            while len(SessionCache._entries) > SESSION_CACHE_SIZE:
+                SessionCache._entries.popitem(last=False)
+
+    @staticmethod
+    def _drop(match):
+        with SessionCache._lock:
+            SessionCache._generation += 1
+            for session_id in [sid for sid, (_exp, user) in SessionCache._entries.items() if match(sid, user)]:
+                del SessionCache._entries[session_id]
+
+    @staticmethod
+    def invalidate(session_id):
+        SessionCache._drop(lambda sid, user: sid == session_id)
+
+    @staticmethod
+    def invalidate_user(user_id):
+        SessionCache._drop(lambda sid, user: user is not None and str(user.get('id')) == str(user_id))
+
+    @staticmethod
+    def invalidate_username(username):
+        SessionCache._drop(lambda sid, user: user is not None and user.get('username') == username)
+
+InvalidationBus.subscribe('sessions', SessionCache.invalidate)
+InvalidationBus.subscribe('users', SessionCache.invalidate_user)
+InvalidationBus.subscribe('permissions', SessionCache.invalidate_username)
+
+# === SESSION EXPIRY ===
+class SessionExpiry:
+    """Server-side lifetime of database sessions, which the cookie Max-Age alone doesn't enforce.
+
+    A session is dead SESSION_MAX_AGE after created_at, or SESSION_IDLE_TIMEOUT
+    after last_seen. last_seen slides forward at most once per
+    SESSION_TOUCH_INTERVAL per session, and those writes are batched onto a
+    background thread, so a busy session costs no write per request. The same
+    thread deletes expired rows, SESSION_REAP_BATCH at a time. Signed tokens
+    carry their own expiry and are not affected.
+    """
+    FLUSH_INTERVAL = 15
+    _pending = {}  # session id -> last_seen not yet written
+    _lock = threading.Lock()
+    _wake = threading.Event()
+    _started = False
+
+    @staticmethod
+    def new_row(session_id, user_id):
+        now = datetime.now(timezone.utc).isoformat()
+        return {'session_id': session_id, 'user_id': str(user_id), 'created_at': now, 'last_seen': now}
+
+    @staticmethod
+    def last_seen(session):
+        with SessionExpiry._lock:
+            pending = SessionExpiry._pending.get(session['session_id'])
+        return parse_timestamp(pending or session.get('last_seen') or session.get('created_at'))
+
+    @staticmethod
+    def expired(session, now=None):
+        now = time.time() if now is None else now
+        created = parse_timestamp(session.get('created_at'))
+        last_seen = SessionExpiry.last_seen(session)
+        if created is not None and now - created > SESSION_MAX_AGE:
+            return True
+        return last_seen is not None and now - last_seen > SESSION_IDLE_TIMEOUT
+
+    @staticmethod
+    def seen(session):
+        """Queue a last_seen update if the stored one is older than SESSION_TOUCH_INTERVAL."""
+        last_seen = SessionExpiry.last_seen(session)
+        if last_seen is not None and time.time() - last_seen < SESSION_TOUCH_INTERVAL:
+            return
+        with SessionExpiry._lock:
+            SessionExpiry._pending[session['session_id']] = datetime.now(timezone.utc).isoformat()
+
+    @staticmethod
+    def start():
+        with SessionExpiry._lock:
+            if SessionExpiry._started:
+                return
+            SessionExpiry._started = True
+        threading.Thread(target=SessionExpiry._run, name='session-expiry', daemon=True).start()
+
+    @staticmethod
+    def flush():
+        with SessionExpiry._lock:
+            pending, SessionExpiry._pending = SessionExpiry._pending, {}
+        for session_id, last_seen in pending.items():
+            try:
+                store.touch_session(session_id, last_seen)
+            except Exception as e:
+                log_db.error(f"Error touching session: {e}")
+        return len(pending)
+
+    @staticmethod
+    def reap(now=None):
+        """Delete expired session rows in batches; returns how many were deleted."""
+        now = time.time() if now is None else now
+        created_before = datetime.fromtimestamp(now - SESSION_MAX_AGE, timezone.utc).isoformat()
+        seen_before = datetime.fromtimestamp(now - SESSION_IDLE_TIMEOUT, timezone.utc).isoformat()
+        deleted = 0
+        while True:
+            session_ids = store.expired_session_ids(created_before, seen_before, SESSION_REAP_BATCH)
+            if not session_ids:
+                break
+            store.delete_sessions(session_ids)
+            deleted += len(session_ids)
+            if len(session_ids) < SESSION_REAP_BATCH:
+                break
+        Metrics.inc('rtoc_sessions_reaped_total', value=deleted)
+        return deleted
+
+    @staticmethod
+    def _run():
+        next_reap = time.monotonic()
+        while True:
+            SessionExpiry._wake.wait(SessionExpiry.FLUSH_INTERVAL)
+            SessionExpiry._wake.clear()
+            SessionExpiry.flush()
+            if time.monotonic() < next_reap:
+                continue
+            next_reap = time.monotonic() + SESSION_REAP_INTERVAL
+            try:
+                deleted = SessionExpiry.reap()
+            except Exception as e:
+                log_db.error(f"Error reaping expired sessions: {e}")
+                continue
+            if deleted:
+                log_auth.info(f"Reaped {deleted} expired sessions")
+
+# === SIGNED SESSIONS ===
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class TokenRevocations:
+    """Revoked signed tokens and per-user role versions, kept in REVOCATIONS_FILE.
+
+    tokens maps a token id to its expiry, so entries can be pruned once the
+    token would have expired anyway. role_versions maps a user id to the time
+    of their last role change; tokens issued before it carry a stale role.
+    Every worker holds the file in memory and reloads it on 'revocations'.
+    """
+    _data = {'tokens': {}, 'role_versions': {}}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def load():
+        data = FileHandler.read_json(REVOCATIONS_FILE, default={})
+        TokenRevocations._data = {'tokens': data.get('tokens', {}), 'role_versions': data.get('role_versions', {})}
+
+    @staticmethod
+    def _change(apply):
+        # The file lock keeps pre-fork workers from overwriting each other's changes
+        with TokenRevocations._lock, open(REVOCATIONS_FILE + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            TokenRevocations.load()
+            data = TokenRevocations._data
+            apply(data)
+            now = time.time()
+            data['tokens'] = {jti: exp for jti, exp in data['tokens'].items() if exp > now}
+            FileHandler.write_json(REVOCATIONS_FILE, data)
+        InvalidationBus.publish('revocations')
+
+    @staticmethod
+    def revoke(claims):
+        TokenRevocations._change(lambda data: data['tokens'].__setitem__(claims['jti'], claims['exp']))
+
+    @staticmethod
+    def bump_role_version(user_id):
+        TokenRevocations._change(lambda data: data['role_versions'].__setitem__(str(user_id), time.time()))
+
+    @staticmethod
+    def is_revoked(claims):
+        return claims['jti'] in TokenRevocations._data['tokens']
+
+    @staticmethod
+    def role_version(user_id):
+        return TokenRevocations._data['role_versions'].get(str(user_id), 0)
+
+TokenRevocations.load()
+InvalidationBus.subscribe('revocations', lambda _key: TokenRevocations.load())
+
+class SessionTokens:
+    """Stateless session tokens: 'v1.<claims>.<HMAC-SHA256>' with both parts base64url.
+
+    The claims carry the user (id, username, avatar, role), the user's role
+    version at issue time, an expiry and a token id, so a valid token is
+    checked without any database call. Logout revokes the token id; a role
+    change bumps the role version, and older tokens then resolve the user
+    from the database (through SessionCache) until the user logs in again.
+    Issued only when SESSION_SIGNING_KEY is set; opaque database sessions
+    keep working alongside.
+    """
+    PREFIX = 'v1.'
+
+    @staticmethod
+    def enabled():
+        return bool(SESSION_SIGNING_KEY)
+
+    @staticmethod
+    def is_token(value):
+        return value.startswith(SessionTokens.PREFIX)
+
+    @staticmethod
+    def _b64(data):
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+    @staticmethod
+    def _sign(message):
+        return SessionTokens._b64(hmac.new(SESSION_SIGNING_KEY.encode('utf-8'), message.encode('ascii'), hashlib.sha256).digest())
+
+    @staticmethod
+    def issue(user):
+        now = int(time.time())
+        claims = {
+            'uid': str(user['id']),
+            'name': user.get('username'),
+            'avatar': user.get('avatar'),
+            'role': user.get('role', 'user'),
+            'rv': TokenRevocations.role_version(user['id']),
+            'iat': now,
+            'exp': now + SESSION_TOKEN_TTL,
+            'jti': secrets.token_urlsafe(12),
+        }
+        body = SessionTokens.PREFIX + SessionTokens._b64(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        return f"{body}.{SessionTokens._sign(body)}"
+
+    @staticmethod
+    def verify(token):
+        """The token's claims if the signature and expiry check out and it isn't revoked, else None."""
+        if not SessionTokens.enabled():
+            return None
+        # Tokens come straight from headers and cookies; anything that isn't ASCII base64url is just invalid
+        try:
+            body, _, signature = token.rpartition('.')
+            if not body or not hmac.compare_digest(signature.encode('ascii'), SessionTokens._sign(body).encode('ascii')):
+                return None
+            encoded = body[len(SessionTokens.PREFIX):]
+            claims = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+        except (UnicodeError, TypeError, ValueError):
+            return None
+        # Only issue() can sign claims, but a malformed payload must still read as invalid, not raise
+        if not isinstance(claims, dict) or not isinstance(claims.get('jti'), str):
+            return None
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)) or isinstance(exp, bool):
+            return None
+        if exp < time.time() or TokenRevocations.is_revoked(claims):
+            return None
+        return claims
+
+    @staticmethod
+    def user(claims):
+        return {'id': claims['uid'], 'username': claims['name'], 'avatar': claims['avatar'], 'role': claims['role']}
+
+    @staticmethod
+    def is_current(claims):
+        """False when the user's role changed after the token was issued."""
+        return claims.get('rv', 0) >= TokenRevocations.role_version(claims['uid'])
+
+def page_key(path):
+    """Normalize a page path ('/pages/x.html', 'pages\\x.html') to the 'pages/x.html' form used as cache key."""
+    return os.path.normpath(path.lstrip('/\\')).replace('\\', '/')
+
+# === PERMISSIONS ===
+class PermissionService:
+    """The merged username -> role map: permissions.json over the roles in the users table.
+
+    permissions.json is re-read only when its mtime or size changes, which is
+    also how a role set through another worker reaches this one. The users
+    table is listed once and then kept current from UserDatabase.save and
+    set_role; a user id saved in any worker ('users') is re-read on the next
+    build. GET /api/permissions is a precomputed body with an ETag, rebuilt
+    only when the map changes. Database reads happen outside _lock.
+    """
+    FILE = 'permissions.json'
+    _static = {}
+    _stamp = None       # (mtime_ns, size) of FILE when _static was read
+    _users = {}         # user id -> (username, role)
+    _users_loaded = False
+    _dirty = set()      # user ids saved since their row was read
+    _response = None    # RenderedPage for GET /api/permissions
+    _lock = threading.RLock()
+
+    @staticmethod
+    def _file_stamp():
+        try:
+            st = os.stat(PermissionService.FILE)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _check_file():
+        stamp = PermissionService._file_stamp()
+        if stamp == PermissionService._stamp:
+            return
+        with PermissionService._lock:
+            if stamp == PermissionService._stamp:
+                return
+            PermissionService._stamp = stamp
+            if stamp is None:
+                PermissionService._static = {}
+            else:
+                try:
+                    with FileHandler.get_lock(PermissionService.FILE), \
+                            open(PermissionService.FILE, 'r', encoding='utf-8') as f:
+                        PermissionService._static = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Keep the roles we have rather than demoting everyone over a bad edit
+                    log_auth.error(f"Error reading {PermissionService.FILE}: {e}")
+                    return
+            PermissionService._response = None
+            log_auth.debug("Loaded %d roles from %s", len(PermissionService._static), PermissionService.FILE)
+
+    @staticmethod
+    def static_role(username):
+        """The role permissions.json assigns to username, None when it has none."""
+        PermissionService._check_file()
+        return PermissionService._static.get(username)
+
+    @staticmethod
+    def roles():
+        PermissionService._check_file()
+        with PermissionService._lock:
+            perms = dict(PermissionService._static)
+            for username, role in PermissionService._users.values():
+                if username and username not in perms:
+                    perms[username] = role
+        return perms
+
+    @staticmethod
+    def set_role(username, role):
+        """Record a role in permissions.json and in the in-memory map."""
+        with PermissionService._lock:
+            PermissionService._check_file()
+            perms = dict(PermissionService._static)
+            perms[username] = role
+            if FileHandler.write_json(PermissionService.FILE, perms):
+                PermissionService._stamp = PermissionService._file_stamp()
+            PermissionService._static = perms
+            for user_id, (name, _role) in list(PermissionService._users.items()):
+                if name == username:
+                    PermissionService._users[user_id] = (name, role)
+            PermissionService._response = None
+
+    @staticmethod
+    def note_user(row):
+        """Apply a users row this worker just wrote."""
+        entry = (row.get('username'), row.get('role'))
+        with PermissionService._lock:
+            if PermissionService._users.get(str(row['id'])) != entry:
+                PermissionService._users[str(row['id'])] = entry
+                PermissionService._response = None
+
+    @staticmethod
+    def _user_saved(user_id):
+        # Known ids too: a rename in another worker must replace the old username here
+        with PermissionService._lock:
+            PermissionService._dirty.add(str(user_id))
+            PermissionService._response = None
+
+    @staticmethod
+    def _fetch(reload, user_ids):
+        """{user id: users row or None} - every user when reload, else just user_ids."""
+        if reload:
+            return {str(row['id']): row for row in store.list_users()}
+        return {user_id: store.get_user(user_id) for user_id in user_ids}
+
+    @staticmethod
+    def response():
+        """The GET /api/permissions body as a RenderedPage."""
+        PermissionService._check_file()
+        with PermissionService._lock:
+            if PermissionService._response is not None:
+                return PermissionService._response
+            reload = not PermissionService._users_loaded
+            dirty = set(PermissionService._dirty)
+        try:
+            rows = PermissionService._fetch(reload, dirty)
+        except Exception as e:
+            log_db.error(f"Permissions: user fetch error: {e}")
+            rows = None
+        with PermissionService._lock:
+            if rows is not None:
+                users = {} if reload else PermissionService._users
+                for user_id, row in rows.items():
+                    if row:
+                        users[user_id] = (row.get('username'), row.get('role'))
+                    else:
+                        users.pop(user_id, None)
+                PermissionService._users = users
+                PermissionService._users_loaded = True
+                # Ids saved while the rows were being read stay dirty for the next build
+                PermissionService._dirty -= dirty
+            body = json.dumps({"status": "success", "permissions": PermissionService.roles()}).encode('utf-8')
+            page = RenderedPage(body)
+            # Without fresh user rows the map is incomplete; build it again next time
+            if PermissionService._users_loaded and not PermissionService._dirty:
+                PermissionService._response = page
+            return page
+
+InvalidationBus.subscribe('users', PermissionService._user_saved)
+
+# === PAGE CACHE ===
+class RenderedPage:
+    """A wiki page as served: the final bytes and the validators for conditional requests.
+
+    last_modified is wiki_pages.updated_at (or the local file's mtime) as a
+    timestamp, None when unknown; the ETag is a hash of the body.
+    """
+    __slots__ = ('body', 'etag', 'last_modified')
+
+    def __init__(self, body, last_modified=None):
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.last_modified = last_modified
+
+def parse_timestamp(value):
+    """Unix timestamp for an ISO 8601 string from the database, None if it can't be parsed."""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+class PageCache:
+    """RenderedPage objects for wiki pages, keyed by page_key.
+
+    Entries are dropped on the 'pages' invalidation topic (save/delete in any
+    worker) and expire after PAGE_CACHE_TTL as a safety net for edits made
+    outside the server. A per-key version stops a render that started before
+    an invalidation from storing its stale result afterwards.
+    """
+    _entries = OrderedDict()
+    _versions = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(key):
+        with PageCache._lock:
+            entry = PageCache._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                PageCache._entries.move_to_end(key)
+                Metrics.inc('rtoc_page_cache_total', (('result', 'hit'),))
+                return entry[1]
+            if entry:
+                del PageCache._entries[key]
+        Metrics.inc('rtoc_page_cache_total', (('result', 'miss'),))
+        return None
+
+    @staticmethod
+    def version(key):
+        return PageCache._versions.get(key, 0)
+
+    @staticmethod
+    def put(key, body, version):
+        with PageCache._lock:
+            if PageCache._versions.get(key, 0) != version:
+                return
+            PageCache._entries[key] = (time.monotonic() + PAGE_CACHE_TTL, body)
+            PageCache._entries.move_to_end(key)
+            while len(PageCache._entries) > PAGE_CACHE_SIZE:
+                PageCache._entries.popitem(last=False)
+
+    @staticmethod
+    def invalidate(key):
+        with PageCache._lock:
+            PageCache._versions[key] = PageCache._versions.get(key, 0) + 1
+            PageCache._entries.pop(key, None)
+
+InvalidationBus.subscribe('pages', PageCache.invalidate)
+
+# === PAGE READ BREAKER ===
+class CircuitBreaker:
+    """Stops calling a failing upstream and probes it from a background thread instead.
+
+    While closed, calls go through and `failures` consecutive errors open it.
+    While open, allow() is False so callers take their fallback straight away,
+    and a daemon thread runs probe() every `interval` seconds. The first
+    successful probe closes the breaker and calls on_recover.
+    """
+    def __init__(self, name, probe, failures=1, interval=5.0, on_recover=None):
+        self.name = name
+        self.probe = probe
+        self.threshold = max(1, failures)
+        self.interval = interval
+        self.on_recover = on_recover
+        self.is_open = False
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.is_open:
+            Metrics.inc('rtoc_circuit_rejected_total', (('breaker', self.name),))
+            return False
+        return True
+
+    def success(self):
+        self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.is_open or self._failures < self.threshold:
+                return
+            self.is_open = True
+        Metrics.gauge_add('rtoc_circuit_open', 1, (('breaker', self.name),))
+        log_db.warning(f"Circuit '{self.name}' open after {self._failures} failures, probing every {self.interval}s")
+        threading.Thread(target=self._probe_until_recovered, name=f"breaker-{self.name}", daemon=True).start()
+
+    def _probe_until_recovered(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe()
+                break
+            except Exception as e:
+                log_db.debug("Circuit '%s' probe failed: %s", self.name, e)
+        with self._lock:
+            self.is_open = False
+            self._failures = 0
+        Metrics.gauge_add('rtoc_circuit_open', -1, (('breaker', self.name),))
+        log_db.info(f"Circuit '{self.name}' closed, upstream recovered")
+        if self.on_recover:
+            try:
+                self.on_recover()
+            except Exception as e:
+                log_db.error(f"Circuit '{self.name}' recovery hook failed: {e}")
+
+class PageMirror:
+    """A copy of wiki_pages under PAGE_MIRROR_DIR for reads while the database is unreachable.
+
+    Successful database reads refresh the mirror file when it differs; the
+    tracked site files are never written. Reads prefer the mirror and fall
+    back to the site file. Pages served during an outage are cached anyway
+    (stale) and recorded; once the breaker closes they are re-read from the
+    database, the mirror updated and the stale cache entry dropped.
+    """
+    _stale = set()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def file_path(clean_path, root=None):
+        """clean_path under root (the site directory by default), or None if it would escape it."""
+        root = os.path.abspath(root or os.getcwd())
+        path = os.path.normpath(os.path.join(root, clean_path))
+        try:
+            inside = os.path.commonpath([root, path]) == root
+        except ValueError:
+            inside = False
+        return path if inside and path != root else None
+
+    @staticmethod
+    def source(clean_path, mirrored=True):
+        """The file a read should use: the mirror copy if there is one, else the site file."""
+        roots = (PAGE_MIRROR_DIR, None) if mirrored else (None,)
+        for root in roots:
+            path = PageMirror.file_path(clean_path, root)
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    @staticmethod
+    def modified(clean_path, mirrored=True):
+        path = PageMirror.source(clean_path, mirrored)
+        try:
+            return os.path.getmtime(path) if path else None
+        except OSError:
+            return None
+
+    @staticmethod
+    def read(clean_path, mirrored=True):
+        """Page content from the mirror or the site file; mirrored=False skips the mirror."""
+        path = PageMirror.source(clean_path, mirrored)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                return f.read()
+        except OSError as e:
+            log_pages.error(f"Error reading local file {clean_path}: {e}")
+            return None
+
+    @staticmethod
+    def write(clean_path, content):
+        """Replace the mirror copy with content unless the page already reads back as content."""
+        path = PageMirror.file_path(clean_path, PAGE_MIRROR_DIR)
+        if not path or PageMirror.read(clean_path) == content:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.mirror-')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            log_pages.error(f"Could not refresh local mirror of {clean_path}: {e}")
+
+    @staticmethod
+    def remove(clean_path):
+        """Drop the mirror copy of a deleted page so an outage can't bring it back."""
+        path = PageMirror.file_path(clean_path, PAGE_MIRROR_DIR)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log_pages.error(f"Could not remove local mirror of {clean_path}: {e}")
+        with PageMirror._lock:
+            PageMirror._stale.discard(clean_path)
+
+    @staticmethod
+    def mark_stale(clean_path):
+        with PageMirror._lock:
+            PageMirror._stale.add(clean_path)
+
+    @staticmethod
+    def revalidate():
+        with PageMirror._lock:
+            paths, PageMirror._stale = PageMirror._stale, set()
+        for i, clean_path in enumerate(sorted(paths)):
+            try:
+                content = store.get_page(clean_path)
+            except Exception as e:
+                log_db.error(f"Revalidating {clean_path} failed: {e}")
+                for rest in sorted(paths)[i:]:
+                    PageMirror.mark_stale(rest)
+                page_breaker.failure()
+                return
+            if content is not None:
+                PageMirror.write(clean_path, content)
+            PageCache.invalidate(page_key(clean_path))
+        if paths:
+            log_pages.info(f"Revalidated {len(paths)} pages served from the local mirror")
+
+page_breaker = CircuitBreaker('wiki_pages', probe=lambda: store.get_page('index.html'),
+                              failures=PAGE_BREAKER_FAILURES, interval=PAGE_BREAKER_PROBE_INTERVAL,
+                              on_recover=PageMirror.revalidate)
+
+def load_page(clean_path):
+    """RenderedPage for a wiki page ('pages/x.html'), through PageCache; None when there is no such page.
+
+    The database copy wins over the local mirror. While page_breaker is open
+    the mirror is served without asking the database; see PageMirror.
+    """
+    key = page_key(clean_path)
+    cached = PageCache.get(key)
+    if cached is not None:
+        return cached
+    version = PageCache.version(key)
+    db_ok = False
+
+    if page_breaker.allow():
+        try:
+            record = store.get_page_record(clean_path)
+            db_ok = True
+            page_breaker.success()
+        except Exception as e:
+            page_breaker.failure()
+            log_db.error(f"Error serving page {clean_path} from Supabase: {e}")
+        else:
+            if record is not None:
+                PageMirror.write(clean_path, record['content'])
+                page = RenderedPage(render_page(record['content'], clean_path).encode('utf-8'),
+                                    parse_timestamp(record.get('updated_at')))
+                PageCache.put(key, page, version)
+                return page
+
+    # With the database reachable and no row, only the site file counts; a mirror copy would be a deleted page
+    content = PageMirror.read(clean_path, mirrored=not db_ok)
+    if content is None:
+        return None
+    page = RenderedPage(render_page(content, clean_path).encode('utf-8'), PageMirror.modified(clean_path, not db_ok))
+    if db_ok:
+        # The database has no copy, so the local file is the page
+        PageCache.put(key, page, version)
+    elif page_breaker.is_open:
+        # Serve stale until the breaker closes, then revalidate
+        PageMirror.mark_stale(clean_path)
+        PageCache.put(key, page, version)
+    return page
+
+from html.parser import HTMLParser
 
 # === SEARCH INDEXER ===
 class SearchIndexer:
     _instance = None
+    # Directories that never hold wiki pages; pruned from the walk instead of filtered afterwards
+    SKIP_DIRS = {'assets', 'dist', 'node_modules', 'scripts', 'styles', 'tests', '__pycache__'}
     
     def __init__(self):
         self.index = [] # List of {path, title, content, headers}
         self.is_indexed = False
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._stale = set()  # pages saved while a build was running
         
     @classmethod
     def get_instance(cls):
@@ -385,43 +2786,89 @@ class SearchIndexer:
             cls._instance = cls()
         return cls._instance
 
-    def index_all(self, root_dir):
-        print("Building Search Index...", file=sys.stderr)
-        self.index = []
-        for root, _, files in os.walk(root_dir):
+    @staticmethod
+    def page_paths(root_dir):
+        """Relative paths of every .html page under root_dir."""
+        paths = []
+        for root, dirs, files in os.walk(root_dir):
+            dirs[:] = [d for d in dirs if d not in SearchIndexer.SKIP_DIRS and not d.startswith('.')]
             for file in files:
                 if file.endswith('.html'):
-                    path = os.path.join(root, file)
-                    rel_path = os.path.relpath(path, root_dir).replace('\\', '/')
-                    
-                    # Skip administrative/hidden pages if needed
-                    if 'node_modules' in rel_path or '.git' in rel_path:
-                        continue
-                        
-                    try:
-                        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read()
-                            self.parse_and_add(rel_path, content)
-                    except Exception as e:
-                        print(f"Failed to index {rel_path}: {e}", file=sys.stderr)
-        
-        self.is_indexed = True
-        print(f"Search Index Built: {len(self.index)} pages indexed.", file=sys.stderr)
+                    paths.append(os.path.relpath(os.path.join(root, file), root_dir).replace('\\', '/'))
+        return sorted(paths)
+
+    def index_all(self, root_dir):
+        with self._build_lock:
+            if self.is_indexed:
+                return
+            self._building = True
+            started = time.monotonic()
+            log_search.info("Building Search Index...")
+            entries = []
+            for rel_path in self.page_paths(root_dir):
+                try:
+                    with open(os.path.join(root_dir, rel_path), 'r', encoding='utf-8', errors='ignore') as f:
+                        entries.append(self._parse(rel_path, f.read()))
+                except Exception as e:
+                    log_search.error(f"Failed to index {rel_path}: {e}")
+
+            self.index = entries
+            self.is_indexed = True
+            self._building = False
+            for rel_path in self._stale:
+                self.refresh_page(rel_path)
+            self._stale.clear()
+        log_search.info(f"Search Index Built: {len(self.index)} pages indexed in {time.monotonic() - started:.2f}s.")
+
+    def build_in_background(self):
+        """Start index_all on a daemon thread unless the index exists or is already being built."""
+        with self._build_lock:
+            if self.is_indexed or self._building:
+                return
+            self._building = True
+        threading.Thread(target=self.index_all, args=(os.getcwd(),), name='search-index', daemon=True).start()
 
     def parse_and_add(self, path, html_content):
+        self.index.append(self._parse(path, html_content))
+
+    def _parse(self, path, html_content):
         parser = TextExtractor()
         parser.feed(html_content)
         
-        self.index.append({
+        content = parser.get_body_text()
+        return {
             'path': path,
             'title': parser.title,
             'headers': parser.headers,
-            'content': parser.get_body_text()
-        })
+            'content': content,
+            # Lowercased once here rather than on every search
+            'title_lower': parser.title.lower() if parser.title else "",
+            'headers_lower': [h.lower() for h in parser.headers],
+            'content_lower': content.lower(),
+        }
+
+    def refresh_page(self, rel_path):
+        """Re-index a single page after it was saved or deleted."""
+        if not self.is_indexed:
+            if self._building:
+                self._stale.add(rel_path)
+            return
+        entries = [page for page in self.index if page['path'] != rel_path]
+        file_path = os.path.join(os.getcwd(), rel_path)
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    entries.append(self._parse(rel_path, f.read()))
+            except Exception as e:
+                log_search.error(f"Failed to index {rel_path}: {e}")
+        # Swap in one assignment so concurrent searches see either the old or new list
+        self.index = entries
 
     def search(self, query, limit=10):
         if not self.is_indexed:
-            self.index_all(os.getcwd())
+            # Never build the index inside a user's request; answer from file names meanwhile
+            self.build_in_background()
+            return self.search_paths(query, limit)
             
         terms = query.lower().split()
         results = []
@@ -430,7 +2877,7 @@ class SearchIndexer:
             score = 0
             
             # 1. Title Match (High Priority)
-            title_lower = page['title'].lower() if page['title'] else ""
+            title_lower = page['title_lower']
             if query.lower() in title_lower:
                 score += 20
             
@@ -439,14 +2886,13 @@ class SearchIndexer:
                     score += 10
             
             # 2. Header Match (Medium Priority)
-            for header in page['headers']:
-                header_lower = header.lower()
+            for header_lower in page['headers_lower']:
                 for term in terms:
                     if term in header_lower:
                         score += 5
             
             # 3. Content Match (Low Priority)
-            content_lower = page['content'].lower()
+            content_lower = page['content_lower']
             term_matches = 0
             for term in terms:
                 if term in content_lower:
@@ -458,7 +2904,7 @@ class SearchIndexer:
                 score += 5
                 
             if score > 0:
-                snippet = self.get_snippet(page['content'], terms)
+                snippet = self.get_snippet(page['content'], terms, content_lower)
                 results.append({
                     'path': page['path'],
                     'name': page['title'] or os.path.basename(page['path']),
@@ -470,8 +2916,26 @@ class SearchIndexer:
         results.sort(key=lambda x: x['score'], reverse=True)
         return results[:limit]
 
-    def get_snippet(self, content, terms, window_size=60):
-        content_lower = content.lower()
+    def search_paths(self, query, limit=10):
+        """Cheap stand-in used until the index is built: match the terms against page file names."""
+        terms = query.lower().replace('-', ' ').split()
+        results = []
+        for rel_path in self.page_paths(os.getcwd()):
+            name = os.path.splitext(os.path.basename(rel_path))[0].replace('_', ' ').replace('-', ' ').lower()
+            score = sum(10 for term in terms if term in name)
+            if score:
+                results.append({
+                    'path': rel_path,
+                    'name': name.title(),
+                    'score': score,
+                    'snippet': ''
+                })
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:limit]
+
+    def get_snippet(self, content, terms, content_lower=None, window_size=60):
+        if content_lower is None:
+            content_lower = content.lower()
         best_pos = -1
         
         # Find the first occurrence of the rarest term (heuristic)
@@ -497,6 +2961,8 @@ class SearchIndexer:
         
         return text
 
+InvalidationBus.subscribe('pages', lambda path: SearchIndexer.get_instance().refresh_page(path))
+
 class TextExtractor(HTMLParser):
     def __init__(self):
         super().__init__()
@@ -536,32 +3002,216 @@ class TextExtractor(HTMLParser):
         else:
             self.text_parts.append(clean_data)
 
-    def get_body_text(self):
-        return " ".join(self.text_parts)
+    def get_body_text(self):
+        return " ".join(self.text_parts)
+
+# === WARM-UP ===
+class Warmup:
+    """Builds the search index and fills PageCache on a background thread once the server is listening.
+
+    Nothing waits for it: until the index is ready searches answer from page
+    file names, and uncached pages render on demand as usual. /api/health
+    reports the progress, so a cold worker can be told from a warm one.
+    """
+    LINK_RE = re.compile(r'href="/?([^"#?:]+\.html)"')
+    _started = False
+    _lock = threading.Lock()
+    _state = {'ready': False, 'indexed_pages': 0, 'cached_pages': 0, 'warmup_seconds': None}
+
+    @staticmethod
+    def start():
+        with Warmup._lock:
+            if Warmup._started:
+                return
+            Warmup._started = True
+        threading.Thread(target=Warmup._run, name='warmup', daemon=True).start()
+
+    @staticmethod
+    def status():
+        return dict(Warmup._state)
+
+    @staticmethod
+    def hot_pages(root, pages):
+        """index.html, then the pages it links to, then everything else."""
+        try:
+            with open(os.path.join(root, 'index.html'), 'r', encoding='utf-8', errors='ignore') as f:
+                linked = [page_key(link) for link in Warmup.LINK_RE.findall(f.read())]
+        except OSError:
+            linked = []
+        known = set(pages)
+        return [p for p in dict.fromkeys(['index.html'] + linked + list(pages)) if p in known]
+
+    @staticmethod
+    def _run():
+        started = time.monotonic()
+        root = os.getcwd()
+        state = Warmup._state
+        try:
+            indexer = SearchIndexer.get_instance()
+            indexer.index_all(root)
+            state['indexed_pages'] = len(indexer.index)
+            pages = [page['path'] for page in indexer.index]
+            for rel_path in Warmup.hot_pages(root, pages)[:max(0, WARMUP_PAGES)]:
+                if load_page(rel_path) is not None:
+                    state['cached_pages'] += 1
+        except Exception as e:
+            log_server.error(f"Warm-up failed: {e}")
+        finally:
+            state['warmup_seconds'] = round(time.monotonic() - started, 3)
+            state['ready'] = True
+        log_server.info(f"Warm-up done in {state['warmup_seconds']}s: {state['indexed_pages']} pages indexed, {state['cached_pages']} cached")
+
+# === ROUTER ===
+class Route:
+    """A single (method, path) entry with its hit count and timing totals."""
+    def __init__(self, method, pattern, handler):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        self.hits = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self.hits += 1
+            self.total_seconds += elapsed
+            if elapsed > self.max_seconds:
+                self.max_seconds = elapsed
+
+    def stats(self):
+        with self._lock:
+            avg_ms = (self.total_seconds / self.hits * 1000) if self.hits else 0.0
+            return {
+                'method': self.method,
+                'route': self.pattern,
+                'hits': self.hits,
+                'avg_ms': round(avg_ms, 3),
+                'max_ms': round(self.max_seconds * 1000, 3),
+            }
+
+class Router:
+    """Dispatch table built once at startup.
+
+    Patterns ending in '*' match by prefix, everything else must match the path
+    exactly (query string ignored). Exact paths are a dict lookup; prefixes are
+    compiled into one regex per method, longest first. Requests matching nothing
+    go to the method's fallback route. HEAD runs the matching GET route, except
+    for the patterns in no_head (GETs with side effects), which get the
+    'HEAD' fallback instead.
+    """
+    def __init__(self, routes, fallbacks, no_head=()):
+        self._no_head = frozenset(no_head)
+        self._exact = {}
+        self._prefix_routes = {}
+        self._prefix_res = {}
+        self._fallbacks = {}
+        self.routes = []
+        for method, pattern, handler in routes:
+            route = Route(method, pattern, handler)
+            self.routes.append(route)
+            if pattern.endswith('*'):
+                self._prefix_routes.setdefault(method, {})[pattern[:-1]] = route
+            else:
+                self._exact[(method, pattern)] = route
+        for method, table in self._prefix_routes.items():
+            alternatives = '|'.join(re.escape(p) for p in sorted(table, key=len, reverse=True))
+            self._prefix_res[method] = re.compile(f'(?:{alternatives})')
+        for method, handler in fallbacks.items():
+            route = Route(method, '*', handler)
+            self.routes.append(route)
+            self._fallbacks[method] = route
+
+    def match(self, method, path):
+        # HEAD runs the GET handler; send_body and send_head leave the body out
+        if method == 'HEAD':
+            route = self._match('GET', path)
+            if route is not None and route.pattern in self._no_head:
+                return self._fallbacks.get('HEAD')
+            return route
+        return self._match(method, path)
+
+    def _match(self, method, path):
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        route = self._exact.get((method, path))
+        if route is not None:
+            return route
+        prefix_re = self._prefix_res.get(method)
+        if prefix_re is not None:
+            m = prefix_re.match(path)
+            if m:
+                return self._prefix_routes[method][m.group(0)]
+        return self._fallbacks.get(method)
+
+    def stats(self):
+        return [route.stats() for route in self.routes]
 
 
 class SaveRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def _get_request_proto_host(self):
-        proto = self.headers.get('X-Forwarded-Proto')
-        if proto:
-            proto = proto.split(',')[0].strip()
-        if not proto:
-            proto = 'https' if os.environ.get('RENDER') else 'http'
+    # Persistent connections: every response path below must send Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    response_status = None
+    cache_control_sent = False
+    etag = None
+    vary_encoding = False
+    body_plan = None
+    # Headers and body go out as separate writes; don't let Nagle hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+    # Seconds between checks for queued connections while a keep-alive connection is idle
+    idle_poll_interval = 0.05
+
+    def setup(self):
+        super().setup()
+        self.requests_on_connection = 0
 
-        host = self.headers.get('X-Forwarded-Host') or self.headers.get('Host')
-        if host:
-            host = host.split(',')[0].strip()
-        if not host:
-            host = f"localhost:{PORT}"
+    def handle_one_request(self):
+        if self.requests_on_connection and not self._next_request_ready():
+            self.close_connection = True
+            return
+        self.requests_on_connection += 1
+        self.etag = None
+        self.vary_encoding = False
+        super().handle_one_request()
+
+    def _next_request_ready(self):
+        """Wait up to self.timeout for the next request on a kept-alive connection.
+
+        Returns False (close it) when the connection stays idle that long, or as
+        soon as the server has connections waiting for a worker, so an idle
+        client never holds a worker while others queue behind it.
+        """
+        sock = self.connection
+        if sock is None:
+            return True
+        # A pipelined request may already sit in rfile's buffer, where select() can't see it
+        sock.settimeout(0.0)
+        try:
+            if self.rfile.peek(1):
+                return True
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(self.timeout)
+        busy = getattr(self.server, 'is_busy', None)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (busy and busy()):
+                return False
+            try:
+                readable, _, _ = select.select([sock], [], [], min(remaining, self.idle_poll_interval))
+            except (OSError, ValueError):
+                return False
+            if readable:
+                return True
 
-        return proto, host
+    def _get_request_proto_host(self):
+        return request_proto_host(self.headers)
 
     def _get_discord_redirect_uri(self):
-        # Prefer configured redirect URI to avoid mismatches between domains/proxies.
-        if REDIRECT_URI:
-            return REDIRECT_URI
-        proto, host = self._get_request_proto_host()
-        return f"{proto}://{host}/auth/discord/callback"
+        return discord_redirect_uri(self.headers)
 
     def get_cors_origin(self):
         """Get the appropriate CORS origin header based on request origin."""
@@ -588,475 +3238,590 @@ class SaveRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         # API endpoints and /save need CORS headers
         if self.path.startswith('/api/') or self.path == '/save' or self.path.startswith('/auth/'):
-            origin = self.headers.get('Origin')
-            
-            # Check if origin is in ALLOWED_ORIGINS
-            if origin in ALLOWED_ORIGINS:
-                self.send_header('Access-Control-Allow-Origin', origin)
-            elif not origin:
-                # Fallback for non-browser clients or same-origin requests without Origin header
-                self.send_header('Access-Control-Allow-Origin', '*')
-            else:
-                # Default to primary for safety if origin not in list
-                self.send_header('Access-Control-Allow-Origin', ALLOWED_ORIGINS[0])
-                
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, DELETE, PUT')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, X-Requested-With, Accept, Cache-Control, Pragma, Expires')
-            self.send_header('Access-Control-Allow-Credentials', 'true')
-            self.send_header('Vary', 'Origin')
+            for name, value in api_cors_headers(self.headers.get('Origin')):
+                self.send_header(name, value)
         
-        # Security and Cache Headers
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
+        # Close after the last allowed request, or early when the worker pool has a backlog
+        if not self.close_connection:
+            busy = getattr(self.server, 'is_busy', None)
+            if self.requests_on_connection >= KEEPALIVE_MAX_REQUESTS or (busy and busy()):
+                self.send_header('Connection', 'close')
+
+        # Validators and Cache-Control - a handler's own Cache-Control wins over the path policy
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        if self.vary_encoding:
+            self.send_header('Vary', 'Accept-Encoding')
+        if not self.cache_control_sent:
+            policy = cache_policy(self.path, self.response_status or 200)
+            self.send_header('Cache-Control', policy)
+            if policy == 'no-store':
+                self.send_header('Pragma', 'no-cache')
+                self.send_header('Expires', '0')
         self.send_header('X-Content-Type-Options', 'nosniff')
         
         super().end_headers()
 
     def send_error(self, code, message=None, explain=None):
         if self.path.startswith('/api/') or self.path == '/save':
-            self.send_response(code)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            response = {'status': 'error', 'message': message, 'code': code}
-            self.wfile.write(json.dumps(response).encode())
+            self.send_json({'status': 'error', 'message': message, 'code': code}, code)
         else:
             super().send_error(code, message, explain)
 
-    def do_GET(self):
-        # API endpoints should return early to avoid falling through to static file serving
-        if self.path == '/api/health':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+    def log_message(self, format, *args):
+        # Access and error lines from BaseHTTPRequestHandler go through the async logger
+        log_access.info("%s - %s", self.address_string(), format % args)
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        """Send a complete response with Content-Length so the connection can be reused."""
+        body, encoding_headers = negotiate_gzip(body, content_type, self.headers.get('Accept-Encoding'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in encoding_headers:
+            self.send_header(name, value)
+        for name, value in headers or ():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_page(self, page, content_type='text/html'):
+        """Send a RenderedPage, or a 304 when the client's copy is still current."""
+        self.etag = page.etag
+        if page_gzipped(page, self.headers.get('Accept-Encoding')):
+            self.etag = gzip_etag(self.etag)
+        headers = []
+        if page.last_modified is not None:
+            headers.append(('Last-Modified', self.date_time_string(page.last_modified)))
+        if not_modified(self.headers, self.etag, page.last_modified):
+            self.vary_encoding = len(page.body) >= GZIP_MIN_SIZE
+            self.send_response(304)
+            for name, value in headers:
+                self.send_header(name, value)
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "ok"}).encode())
             return
+        self.send_body(page.body, content_type, headers=headers)
 
-        # API: Search
-        if self.path.startswith('/api/search'):
-            try:
-                query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
-                q = query_params.get('q', [''])[0]
-                limit = int(query_params.get('limit', [10])[0])
-                
-                indexer = SearchIndexer.get_instance()
-                results = indexer.search(q, limit)
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "results": results}).encode())
-            except Exception as e:
-                self.send_error(500, str(e))
-            return
+    def send_json(self, payload, status=200, headers=None):
+        self.send_body(json.dumps(payload).encode('utf-8'), 'application/json', status, headers)
+
+    def send_redirect(self, location, headers=None):
+        self.send_response(302)
+        for name, value in headers or ():
+            self.send_header(name, value)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
 
-        # API: Get Current User (Session Check)
-        if self.path == '/api/user/me':
-            user = SessionManager.get_user(self.headers)
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        self.cache_control_sent = False
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        name = keyword.lower()
+        if name == 'content-length' and self.command != 'HEAD':
+            Metrics.inc('rtoc_http_response_bytes_total', value=int(value))
+        elif name == 'cache-control':
+            self.cache_control_sent = True
+        super().send_header(keyword, value)
+
+    def send_head(self):
+        """Serve a static file: validators and 304s, cached gzip for text types, and byte ranges.
+
+        Returns the open file (or a BytesIO for gzip) for do_GET to copy, with
+        self.body_plan describing which parts of it to send. Directories and
+        missing files are left to SimpleHTTPRequestHandler.
+        """
+        self.body_plan = None
+        path = self.translate_path(self.path)
+        meta = None if self.path.split('?', 1)[0].endswith('/') else StaticFiles.lookup(path, self.guess_type)
+        if meta is None:
+            return super().send_head()
+        derivative = ImageDerivatives.wants(path, urllib.parse.urlsplit(self.path).query)
+        if derivative:
+            target = ImageDerivatives.get(path, meta, *derivative)
+            derived = StaticFiles.lookup(target, self.guess_type) if target else None
+            if derived:
+                path, meta = target, derived
+        self.etag = meta.etag
+
+        range_header = self.headers.get('Range')
+        encoded = False
+        if is_compressible(meta.ctype) and meta.size >= GZIP_MIN_SIZE:
+            self.vary_encoding = True
+            # Ranges address the identity bytes, so a range request is never gzipped
+            encoded = not range_header and accepts_gzip(self.headers.get('Accept-Encoding'))
+            if encoded:
+                self.etag = gzip_etag(self.etag)
+
+        if self._not_modified(meta):
+            self.send_response(304)
+            self.send_header('Last-Modified', self.date_time_string(meta.mtime))
+            self.end_headers()
+            return None
+
+        if encoded:
+            def read():
+                with open(path, 'rb') as f:
+                    return f.read()
+            body = GzipCache.get(('file', path, meta.mtime_ns, meta.size), read)
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Type', meta.ctype)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Last-Modified', self.date_time_string(meta.mtime))
             self.end_headers()
-            if user:
-                self.wfile.write(json.dumps({"status": "success", "user": user}).encode())
-            else:
-                self.wfile.write(json.dumps({"status": "error", "message": "Not logged in"}).encode())
-            return
-        
-        # API: Logout
-        if self.path == '/auth/logout':
-            self.send_response(302)
-            self.send_header('Set-Cookie', 'session=; Path=/; Max-Age=0')
-            self.send_header('Location', '/')
+            return io.BytesIO(body)
+
+        ranges = None
+        if range_header and self._if_range_ok(meta):
+            ranges = parse_byte_ranges(range_header, meta.size)
+        if ranges == []:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{meta.size}')
+            self.send_header('Content-Length', '0')
             self.end_headers()
-            return
+            return None
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        if not ranges:
+            self.body_plan = [(0, meta.size)]
+            self.send_response(200)
+            self.send_header('Content-Type', meta.ctype)
+            self.send_header('Content-Length', str(meta.size))
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.body_plan = [(start, end - start + 1)]
+            self.send_response(206)
+            self.send_header('Content-Type', meta.ctype)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{meta.size}')
+            self.send_header('Content-Length', str(end - start + 1))
+        else:
+            boundary = uuid.uuid4().hex
+            self.body_plan = []
+            for start, end in ranges:
+                self.body_plan.append((f'\r\n--{boundary}\r\nContent-Type: {meta.ctype}\r\n'
+                                       f'Content-Range: bytes {start}-{end}/{meta.size}\r\n\r\n').encode('latin-1'))
+                self.body_plan.append((start, end - start + 1))
+            self.body_plan.append(f'\r\n--{boundary}--\r\n'.encode('latin-1'))
+            length = sum(len(p) if isinstance(p, bytes) else p[1] for p in self.body_plan)
+            self.send_response(206)
+            self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+            self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Last-Modified', self.date_time_string(meta.mtime))
+        self.end_headers()
+        return f
+
+    def _not_modified(self, meta):
+        return not_modified(self.headers, self.etag, meta.mtime)
+
+    def _if_range_ok(self, meta):
+        """If-Range: only honour Range when the validator still matches the current file."""
+        if_range = self.headers.get('If-Range')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == meta.etag
+        return if_range == self.date_time_string(meta.mtime)
+
+    def copyfile(self, source, outputfile):
+        """Send the parts of source listed in body_plan, with sendfile(2) when writing to a socket."""
+        if self.body_plan is None:
+            return super().copyfile(source, outputfile)
+        use_sendfile = isinstance(self.connection, socket.socket) and hasattr(os, 'sendfile')
+        for part in self.body_plan:
+            if isinstance(part, bytes):
+                outputfile.write(part)
+                continue
+            offset, count = part
+            if use_sendfile:
+                self.connection.sendfile(source, offset, count)
+                continue
+            source.seek(offset)
+            while count > 0:
+                chunk = source.read(min(count, 64 * 1024))
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                count -= len(chunk)
+
+    def _dispatch(self, method):
+        route = ROUTER.match(method, self.path)
+        started = time.perf_counter()
+        stream = self.rfile
+        self.response_status = None
+        Metrics.gauge_add('rtoc_http_requests_in_flight', 1)
+        try:
+            if not self._buffer_request_body():
+                return
+            route.handler(self)
+        finally:
+            self.rfile = stream
+            elapsed = time.perf_counter() - started
+            route.record(elapsed)
+            Metrics.gauge_add('rtoc_http_requests_in_flight', -1)
+            labels = (('method', method), ('route', route.pattern))
+            Metrics.observe('rtoc_http_request_duration_seconds', elapsed, labels)
+            Metrics.inc('rtoc_http_requests_total', labels + (('status', self.response_status or 0),))
+
+    def _buffer_request_body(self):
+        """Read the whole request body up front.
+
+        Handlers that reject a request before reading its body would otherwise
+        leave it on the socket, where it would be parsed as the next request.
+        """
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            # Not supported by the handlers, and we can't find the end of it either
+            self.close_connection = True
+            return True
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            self.send_error(400, "Invalid Content-Length")
+            return False
+        if length > MAX_REQUEST_BODY:
+            self.close_connection = True
+            self.send_error(413, "Request body too large")
+            return False
+        if length > 0:
+            self.rfile = io.BytesIO(self.rfile.read(length))
+        return True
+
+    # API: Health check
+    def handle_health(self):
+        self.send_json({"status": "ok", **Warmup.status()})
+
+    # API: Prometheus metrics
+    def handle_metrics(self):
+        self.send_body(Metrics.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+
+    # API: Search
+    def handle_search(self):
+        try:
+            query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            q = query_params.get('q', [''])[0]
+            limit = int(query_params.get('limit', [10])[0])
+            
+            indexer = SearchIndexer.get_instance()
+            indexing = not indexer.is_indexed
+            results = indexer.search(q, limit)
+            
+            payload = {"status": "success", "results": results}
+            if indexing:
+                # File-name matches only; the full index is still being built
+                payload["indexing"] = True
+            self.send_json(payload)
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    # API: Get Current User (Session Check)
+    def handle_user_me(self):
+        user = SessionManager.get_user(self.headers)
+        if user:
+            self.send_json({"status": "success", "user": user})
+        else:
+            self.send_json({"status": "error", "message": "Not logged in"})
+
+    # API: Logout
+    def handle_logout(self):
+        session_id = SessionManager.session_id_from_headers(self.headers)
+        if session_id and SessionTokens.is_token(session_id):
+            claims = SessionTokens.verify(session_id)
+            if claims:
+                TokenRevocations.revoke(claims)
+        elif session_id:
+            InvalidationBus.publish('sessions', session_id)
+        self.send_redirect('/', headers=[('Set-Cookie', 'session=; Path=/; Max-Age=0')])
+
+    # API: Get all permissions
+    def handle_get_permissions(self):
+        try:
+            self.send_page(PermissionService.response(), 'application/json')
+        except Exception as e:
+            log_auth.error(f"Permissions GET error: {e}")
+            self.send_error(500, str(e))
+
+    # API: Comments for a page
+    def handle_get_comments(self):
+        try:
+            query = urllib.parse.urlparse(self.path).query
+            params = urllib.parse.parse_qs(query)
+            page_id = params.get('pageId', [None])[0]
+            sort_by = params.get('sort', ['newest'])[0] 
+            
+            if not page_id:
+                self.send_json({"status": "error", "message": "Missing pageId"}, 400)
+                return
 
-        # API: Get all permissions
-        if self.path == '/api/permissions':
             try:
-                # Merge logic: Static JSON + Supabase Users
-                perms = FileHandler.read_json('permissions.json', default={})
-                
-                try:
-                    db_users = supabase.table('users').select('username, role').execute()
-                    if db_users.data:
-                        for row in db_users.data:
-                            uname = row.get('username')
-                            urole = row.get('role')
-                            if uname and uname not in perms:
-                                perms[uname] = urole
-                except Exception as db_err:
-                    print(f"[PERMISSIONS GET] Supabase fetch error: {db_err}")
-
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "permissions": perms}).encode('utf-8'))
+                page_comments = store.comments_for_page(page_id)
             except Exception as e:
-                print(f"[PERMISSIONS GET] Error: {e}")
-                self.send_error(500, str(e))
-            return
-
-        if self.path.startswith('/api/comments'):
+                log_db.error(f"Error fetching comments for {page_id}: {e}")
+                self.send_json({"status": "error", "message": "Failed to fetch comments"}, 500)
+                return
+            
+            # Fetch latest user data (username, avatar, role) for comments
             try:
-                query = urllib.parse.urlparse(self.path).query
-                params = urllib.parse.parse_qs(query)
-                page_id = params.get('pageId', [None])[0]
-                sort_by = params.get('sort', ['newest'])[0] 
-                
-                if not page_id:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "error", "message": "Missing pageId"}).encode('utf-8'))
-                    return
-
-                try:
-                    response = supabase.table('comments').select('*').eq('page_id', page_id).execute()
-                    page_comments = response.data or []
-                except Exception as e:
-                    print(f"[DB] Error fetching comments for {page_id}: {e}")
-                    self.send_response(500)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "error", "message": "Failed to fetch comments"}).encode('utf-8'))
-                    return
-                
-                # Sort comments based on requested order, with PINNED comments always on top
-                if sort_by == 'oldest':
-                    # Pinned first (False < True for 'not is_pinned'), then oldest (small timestamp)
-                    page_comments.sort(key=lambda c: (not c.get('is_pinned', False), c.get('created_at', '')))
-                elif sort_by == 'top':
-                    # Pinned first (True > False), then highest score
-                    page_comments.sort(key=lambda c: (c.get('is_pinned', False), len(c.get('likes', [])) - len(c.get('dislikes', []))), reverse=True)
-                else:  # newest (default)
-                     # Pinned first (True > False), then newest (large timestamp)
-                    page_comments.sort(key=lambda c: (c.get('is_pinned', False), c.get('created_at', '')), reverse=True)
-                
-                # Fetch latest user data (username, avatar, role) for comments
-                try:
-                    users_response = supabase.table('users').select('id, username, avatar, role').execute()
-                    users_map = {row['id']: row for row in (users_response.data or [])}
-                    for c in page_comments:
-                        # Map text -> content for frontend compatibility
-                        c['content'] = c.get('text', '')
-                        
-                        uid = c.get('user_id')
-                        if uid and uid in users_map:
-                            u_info = users_map[uid]
-                            c['user'] = u_info.get('username', 'Unknown')
-                            c['avatar'] = u_info.get('avatar')
-                            c['role'] = u_info.get('role', 'user')
-                        else:
-                            # Fallback for anonymous or missing users
-                            c['user'] = c.get('user', 'Anonymous')
-                except Exception as e:
-                    print(f"[DB] Error fetching user data for comments: {e}")
-
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "status": "success", 
-                    "comments": page_comments,
-                    "total": len(page_comments)
-                }).encode('utf-8'))
+                users = store.list_users()
             except Exception as e:
-                self.send_error(500, str(e))
-            return
-        
-        # API: Profile Management
-        if self.path.startswith('/api/profile'):
+                log_db.error(f"Error fetching user data for comments: {e}")
+                users = None
+            shape_comments(page_comments, users, sort_by)
+
+            self.send_json({
+                "status": "success", 
+                "comments": page_comments,
+                "total": len(page_comments)
+            })
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    # API: Profile Management
+    def handle_get_profile(self):
+        try:
+            query = urllib.parse.urlparse(self.path).query
+            params = urllib.parse.parse_qs(query)
+            username = params.get('user', [None])[0]
             try:
-                query = urllib.parse.urlparse(self.path).query
-                params = urllib.parse.parse_qs(query)
-                username = params.get('user', [None])[0]
-                try:
-                    response = supabase.table('user_profiles').select('*').eq('username', username).execute()
-                    if response.data:
-                        user_profile = response.data[0]
-                        # Map 'about' to 'bio' for frontend compatibility if needed, 
-                        # but migrate_to_supabase.py used 'about'.
-                        user_profile['bio'] = user_profile.get('about', '')
-                    else:
-                        user_profile = {}
-                except Exception as e:
-                    print(f"[DB] Error fetching profile: {e}")
+                user_profile = store.get_profile(username)
+                if user_profile:
+                    # Map 'about' to 'bio' for frontend compatibility if needed, 
+                    # but migrate_to_supabase.py used 'about'.
+                    user_profile['bio'] = user_profile.get('about', '')
+                else:
                     user_profile = {}
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "status": "success",
-                    "profile": user_profile
-                }).encode())
             except Exception as e:
-                self.send_error(500, str(e))
-            return
+                log_db.error(f"Error fetching profile: {e}")
+                user_profile = {}
+            
+            self.send_json({
+                "status": "success",
+                "profile": user_profile
+            })
+        except Exception as e:
+            self.send_error(500, str(e))
 
-        # API: Activity
-        if self.path.startswith('/api/activity'):
-            try:
-                query = urllib.parse.urlparse(self.path).query
-                params = urllib.parse.parse_qs(query)
-                username = params.get('user', [None])[0]
+    # API: Activity
+    def handle_activity(self):
+        try:
+            query = urllib.parse.urlparse(self.path).query
+            params = urllib.parse.parse_qs(query)
+            username = params.get('user', [None])[0]
 
-                try:
-                    if username:
-                        response = supabase.table('activity_logs').select('*').eq('user', username).order('timestamp', desc=True).limit(50).execute()
-                    else:
-                        response = supabase.table('activity_logs').select('*').order('timestamp', desc=True).limit(50).execute()
-                    logs = response.data or []
-                except Exception as e:
-                    print(f"[DB] Error fetching activity {e}")
-                    logs = []
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "activity": logs}).encode())
+            try:
+                logs = store.recent_activity(username, limit=50)
             except Exception as e:
-                self.send_error(500, str(e))
-            return
+                log_db.error(f"Error fetching activity {e}")
+                logs = []
+            
+            self.send_json({"status": "success", "activity": logs})
+        except Exception as e:
+            self.send_error(500, str(e))
 
-        # Discord Auth
-        if self.path == '/auth/discord/login':
-            oauth_state = str(uuid.uuid4())
-            redirect_uri = self._get_discord_redirect_uri()
-            params = {
-                'client_id': CLIENT_ID,
-                'redirect_uri': redirect_uri,
-                'response_type': 'code',
-                'scope': 'identify guilds.join',
-                'state': oauth_state,
-            }
-            url = f"https://discord.com/api/oauth2/authorize?{urllib.parse.urlencode(params)}"
-            self.send_response(302)
-            proto, _host = self._get_request_proto_host()
-            secure_attr = '; Secure' if proto == 'https' else ''
-            self.send_header('Set-Cookie', f'oauth_state={oauth_state}; Path=/; HttpOnly; SameSite=Lax{secure_attr}; Max-Age=600')
-            self.send_header('Location', url)
-            self.end_headers()
-            return
+    # Discord Auth
+    def handle_discord_login(self):
+        oauth_state = str(uuid.uuid4())
+        redirect_uri = self._get_discord_redirect_uri()
+        params = {
+            'client_id': CLIENT_ID,
+            'redirect_uri': redirect_uri,
+            'response_type': 'code',
+            'scope': 'identify guilds.join',
+            'state': oauth_state,
+        }
+        url = f"https://discord.com/api/oauth2/authorize?{urllib.parse.urlencode(params)}"
+        proto, _host = self._get_request_proto_host()
+        secure_attr = '; Secure' if proto == 'https' else ''
+        self.send_redirect(url, headers=[('Set-Cookie', f'oauth_state={oauth_state}; Path=/; HttpOnly; SameSite=Lax{secure_attr}; Max-Age=600')])
+
+    # Discord OAuth callback
+    def handle_discord_callback(self):
+        try:
+            query = urllib.parse.urlparse(self.path).query
+            params = urllib.parse.parse_qs(query)
+            code = params.get('code', [None])[0]
+            returned_state = params.get('state', [None])[0]
+            cookie_header = self.headers.get('Cookie', '')
+            cookies = {}
+            for c in cookie_header.split(';'):
+                if '=' in c:
+                    k, v = c.split('=', 1)
+                    cookies[k.strip()] = v.strip()
+            expected_state = cookies.get('oauth_state')
             
-        elif self.path.startswith('/auth/discord/callback'):
-            try:
-                query = urllib.parse.urlparse(self.path).query
-                params = urllib.parse.parse_qs(query)
-                code = params.get('code', [None])[0]
-                returned_state = params.get('state', [None])[0]
-                cookie_header = self.headers.get('Cookie', '')
-                cookies = {}
-                for c in cookie_header.split(';'):
-                    if '=' in c:
-                        k, v = c.split('=', 1)
-                        cookies[k.strip()] = v.strip()
-                expected_state = cookies.get('oauth_state')
-                
-                if not code:
-                    self.send_error(400, "No code provided")
-                    return
+            if not code:
+                self.send_error(400, "No code provided")
+                return
 
-                if not returned_state or not expected_state or returned_state != expected_state:
-                    self.send_error(400, "Invalid OAuth state")
-                    return
+            if not returned_state or not expected_state or returned_state != expected_state:
+                self.send_error(400, "Invalid OAuth state")
+                return
 
-                if not _discord_oauth_mark_code_seen(code, ttl_seconds=60):
-                    self.send_error(409, "OAuth code already used")
-                    return
+            if not _discord_oauth_mark_code_seen(code, ttl_seconds=60):
+                self.send_error(409, "OAuth code already used")
+                return
 
-                # Short-circuit if we're in an active Discord OAuth rate-limit cooldown
-                rate_limit_remaining = _discord_oauth_get_rate_limit_remaining_seconds()
-                if rate_limit_remaining > 0:
-                    msg = f"Authentication temporarily rate-limited by Discord. Please try again in {int(rate_limit_remaining)} seconds."
-                    self.send_error(503, msg)
-                    return
+            # Short-circuit if we're in an active Discord OAuth rate-limit cooldown
+            rate_limit_remaining = _discord_oauth_get_rate_limit_remaining_seconds()
+            if rate_limit_remaining > 0:
+                msg = f"Authentication temporarily rate-limited by Discord. Please try again in {int(rate_limit_remaining)} seconds."
+                self.send_error(503, msg)
+                return
 
-                redirect_uri = self._get_discord_redirect_uri()
+            redirect_uri = self._get_discord_redirect_uri()
 
-                data = urllib.parse.urlencode({
-                    'client_id': CLIENT_ID,
-                    'client_secret': CLIENT_SECRET,
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': redirect_uri
-                }).encode()
-                
-                req = urllib.request.Request(
-                    "https://discord.com/api/oauth2/token", 
-                    data=data, 
-                    headers={'Content-Type': 'application/x-www-form-urlencoded', 'User-Agent': 'DiscordBot'}
-                )
-                # Prevent concurrent token exchanges from spiking into rate-limits.
-                with _discord_oauth_exchange_lock:
-                    with _urlopen_with_rate_limit_retry(req) as res:
-                        token_data = json.loads(res.read().decode())
-                        access_token = token_data['access_token']
-
-                req_user = urllib.request.Request(
-                    "https://discord.com/api/users/@me", 
-                    headers={'Authorization': f"Bearer {access_token}", 'User-Agent': 'DiscordBot'}
-                )
-                with _urlopen_with_rate_limit_retry(req_user) as res_user:
-                    user_data = json.loads(res_user.read().decode())
-                
-                # --- AUTO-JOIN SERVER ---
-                try:
-                    if BOT_TOKEN and GUILD_ID:
-                        join_url = f"https://discord.com/api/guilds/{GUILD_ID}/members/{user_data['id']}"
-                        join_data = json.dumps({'access_token': access_token}).encode()
-                        join_req = urllib.request.Request(
-                            join_url,
-                            data=join_data,
-                            method='PUT',
-                            headers={
-                                'Authorization': f"Bot {BOT_TOKEN}",
-                                'Content-Type': 'application/json',
-                                'User-Agent': 'DiscordBot'
-                            }
-                        )
-                        # We don't strictly need to check the response, but it's good practice.
-                        # 201 Created = Joined, 204 No Content = Already joined
-                        with _urlopen_with_rate_limit_retry(join_req) as join_res:
-                            print(f"Auto-join status: {join_res.status}")
-                except Exception as e:
-                    print(f"Auto-join failed: {e}")
-                # ------------------------
+            data = urllib.parse.urlencode({
+                'client_id': CLIENT_ID,
+                'client_secret': CLIENT_SECRET,
+                'grant_type': 'authorization_code',
+                'code': code,
+                'redirect_uri': redirect_uri
+            }).encode()
+            
+            req = urllib.request.Request(
+                "https://discord.com/api/oauth2/token", 
+                data=data, 
+                headers={'Content-Type': 'application/x-www-form-urlencoded', 'User-Agent': 'DiscordBot'}
+            )
+            # Prevent concurrent token exchanges from spiking into rate-limits.
+            with _discord_oauth_exchange_lock:
+                with _urlopen_with_rate_limit_retry(req) as res:
+                    token_data = json.loads(res.read().decode())
+                    access_token = token_data['access_token']
 
-                # Save user to database and get role from permissions
-                if user_data.get('avatar'):
-                    ext = 'gif' if user_data['avatar'].startswith('a_') else 'png'
-                    avatar_url = f"https://cdn.discordapp.com/avatars/{user_data['id']}/{user_data['avatar']}.{ext}"
-                else:
-                    try:
-                        index = (int(user_data['id']) >> 22) % 6
-                    except:
-                        index = 0
-                    avatar_url = f"https://cdn.discordapp.com/embed/avatars/{index}.png"
-
-                final_user = UserDatabase.save({
-                    'id': user_data['id'],
-                    'username': user_data['username'],
-                    'avatar': avatar_url
-                })
-                
-                # Create session
-                session_id = SessionManager.create(final_user['id'])
-                
-                # Check if client wants JSON (API call from callback.html)
-                accept_header = self.headers.get('Accept', '')
-                if 'application/json' in accept_header:
-                    # API response for cross-origin callback
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=None; Secure; Max-Age=2592000')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
-                        "status": "success",
-                        "user": final_user,
-                        "session_id": session_id
-                    }).encode())
-                else:
-                    # Traditional redirect for direct browser access
-                    user_json = json.dumps(final_user)
-                    b64_user = base64.b64encode(user_json.encode()).decode()
-                    
-                    self.send_response(302)
-                    self.send_header('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=None; Secure; Max-Age=2592000')
-                    self.send_header('Location', f"/?user_data={b64_user}&session_id={session_id}")
-                    self.end_headers()
+            req_user = urllib.request.Request(
+                "https://discord.com/api/users/@me", 
+                headers={'Authorization': f"Bearer {access_token}", 'User-Agent': 'DiscordBot'}
+            )
+            with _urlopen_with_rate_limit_retry(req_user) as res_user:
+                user_data = json.loads(res_user.read().decode())
+            
+            # Save user to database and get role from permissions
+            avatar_url = discord_avatar_url(user_data)
 
-                # Persist session & user data to git so they survive Render restarts
-                try:
-                    supabase.table('activity_logs').insert({
-                        "user": final_user.get('username', 'unknown'),
-                        "action": "logged in",
-                        "type": "system",
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    }).execute()
-                except: pass
+            final_user = UserDatabase.save({
+                'id': user_data['id'],
+                'username': user_data['username'],
+                'avatar': avatar_url
+            })
+            
+            # Create session
+            session_id = SessionManager.create(final_user['id'], final_user)
+
+            # Guild auto-join and the activity entry don't change the login result
+            if BOT_TOKEN and GUILD_ID:
+                jobs.submit('guild_join', user_id=user_data['id'], access_token=access_token)
+            jobs.submit('log_activity', entry={
+                "user": final_user.get('username', 'unknown'),
+                "action": "logged in",
+                "type": "system",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            })
+            
+            # Check if client wants JSON (API call from callback.html)
+            accept_header = self.headers.get('Accept', '')
+            if 'application/json' in accept_header:
+                # API response for cross-origin callback
+                self.send_json({
+                    "status": "success",
+                    "user": final_user,
+                    "session_id": session_id
+                }, headers=[('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=None; Secure; Max-Age={SESSION_MAX_AGE}')])
+            else:
+                # Traditional redirect for direct browser access
+                user_json = json.dumps(final_user)
+                b64_user = base64.b64encode(user_json.encode()).decode()
                 
-            except urllib.error.HTTPError as e:
-                if getattr(e, 'code', None) in (429, 503):
+                self.send_redirect(f"/?user_data={b64_user}&session_id={session_id}",
+                                   headers=[('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=None; Secure; Max-Age={SESSION_MAX_AGE}')])
+            
+        except urllib.error.HTTPError as e:
+            if getattr(e, 'code', None) in (429, 503):
+                retry_after = None
+                try:
+                    retry_after = e.headers.get('Retry-After')
+                except Exception:
                     retry_after = None
+
+                msg = "Authentication temporarily rate-limited by Discord. Please try again."
+                if retry_after:
                     try:
-                        retry_after = e.headers.get('Retry-After')
+                        _discord_oauth_set_rate_limit(float(retry_after))
                     except Exception:
-                        retry_after = None
-
-                    msg = "Authentication temporarily rate-limited by Discord. Please try again."
-                    if retry_after:
-                        try:
-                            _discord_oauth_set_rate_limit(float(retry_after))
-                        except Exception:
-                            pass
-                        msg = f"Authentication temporarily rate-limited by Discord. Please try again in {retry_after} seconds."
-                    self.send_error(503, msg)
-                else:
-                    print(f"OAuth HTTP Error: {e}")
-                    self.send_error(500, f"Authentication Failed: {str(e)}")
-            except Exception as e:
-                print(f"OAuth Error: {e}")
+                        pass
+                    msg = f"Authentication temporarily rate-limited by Discord. Please try again in {retry_after} seconds."
+                self.send_error(503, msg)
+            else:
+                log_discord.error(f"OAuth HTTP Error: {e}")
                 self.send_error(500, f"Authentication Failed: {str(e)}")
-            return
+        except Exception as e:
+            log_discord.error(f"OAuth Error: {e}")
+            self.send_error(500, f"Authentication Failed: {str(e)}")
 
-        # Dev Login (Localhost only)
-        if self.path == '/api/dev/login' and not os.environ.get('RENDER'):
-            user_data = {"id": "dev-admin-id", "username": "DevAdmin", "role": "owner", "avatar": None}
-            # Create session
-            session_id = SessionManager.create(user_data['id'])
-            # Save user
-            UserDatabase.save(user_data)
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=Lax; Max-Age=2592000')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "status": "success", 
-                "user": user_data, 
-                "session_id": session_id,
-                "message": "Dev login successful"
-            }).encode())
-            return
+    # Dev Login (Localhost only)
+    def handle_dev_login(self):
+        user_data = {"id": "dev-admin-id", "username": "DevAdmin", "role": "owner", "avatar": None}
+        # Save user
+        final_user = UserDatabase.save(user_data)
+        # Create session
+        session_id = SessionManager.create(user_data['id'], final_user)
+        
+        self.send_json({
+            "status": "success", 
+            "user": user_data, 
+            "session_id": session_id,
+            "message": "Dev login successful"
+        }, headers=[('Set-Cookie', f'session={session_id}; Path=/; HttpOnly; SameSite=Lax; Max-Age={SESSION_MAX_AGE}')])
 
-        # API: List all pages
-        if self.path.startswith('/api/pages'):
-            try:
-                pages = []
-                for root, dirs, files in os.walk(os.getcwd()):
-                    dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'node_modules']
-                    for file in files:
-                        if file.endswith('.html'):
-                            rel_path = os.path.relpath(os.path.join(root, file), os.getcwd())
-                            pages.append({"path": rel_path.replace('\\', '/'), "name": file})
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "pages": pages}).encode('utf-8'))
-            except Exception as e:
-                self.send_error(500, str(e))
-            return
+    # API: List all pages
+    def handle_list_pages(self):
+        try:
+            pages = []
+            for root, dirs, files in os.walk(os.getcwd()):
+                dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'node_modules']
+                for file in files:
+                    if file.endswith('.html'):
+                        rel_path = os.path.relpath(os.path.join(root, file), os.getcwd())
+                        pages.append({"path": rel_path.replace('\\', '/'), "name": file})
+            
+            self.send_json({"status": "success", "pages": pages})
+        except Exception as e:
+            self.send_error(500, str(e))
 
-        # API: List all assets
-        if self.path.startswith('/api/assets'):
-            try:
-                target_dir = os.path.join(os.getcwd(), 'assets', 'images')
-                assets = []
-                if os.path.exists(target_dir):
-                    for f in os.listdir(target_dir):
-                        if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-                            assets.append({"filename": f, "url": f"/assets/images/{f}"})
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "assets": assets}).encode('utf-8'))
-            except Exception as e:
-                self.send_error(500, str(e))
-            return
+    # API: List all assets
+    def handle_list_assets(self):
+        try:
+            target_dir = os.path.join(os.getcwd(), 'assets', 'images')
+            assets = []
+            if os.path.exists(target_dir):
+                for f in os.listdir(target_dir):
+                    if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
+                        assets.append({"filename": f, "url": f"/assets/images/{f}"})
+            
+            self.send_json({"status": "success", "assets": assets})
+        except Exception as e:
+            self.send_error(500, str(e))
 
+    def serve_page_or_static(self):
         # Serve static files (HTML, CSS, JS, images, etc.)
         # Handle root path by serving index.html
         if self.path == '/':
@@ -1068,704 +3833,821 @@ class SaveRequestHandler(http.server.SimpleHTTPRequestHandler):
         if clean_path.startswith('/'): clean_path = clean_path[1:]
         
         if clean_path.endswith('.html'):
-            try:
-                response = supabase.table('wiki_pages').select('content').eq('path', clean_path).execute()
-                if response.data:
-                    content = response.data[0]['content']
-                    # make sure editor script is present so admins can toggle edit
-                    if 'editor.js' not in content:
-                        if '</body>' in content.lower():
-                            # similar injection logic as in save handler
-                            lower = content.lower()
-                            idx = lower.rfind('</body>')
-                            if idx != -1:
-                                content = content[:idx] + '<script src="/scripts/editor.js"></script>\n' + content[idx:]
-                        else:
-                            content += '\n<script src="/scripts/editor.js"></script>'
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-                    self.end_headers()
-                    self.wfile.write(content.encode('utf-8'))
-                    return
-            except Exception as e:
-                print(f"[DB] Error serving page {clean_path} from Supabase: {e}")
+            page = load_page(clean_path)
+            if page is not None:
+                self.send_page(page)
+                return
+        
+        if self.command == 'HEAD':
+            super().do_HEAD()
+        else:
+            super().do_GET()
+
+    # Save page
+    def handle_save(self):
+        try:
+            user = get_authenticated_user(self)
+            log_pages.debug("POST /save authenticated user: %s", user)
+            
+            if not is_admin(user):
+                log_pages.info("Save: admin check failed for user: %s", user)
+                self.send_error(403, f"Permission denied: Admins only. Current user: {user.get('username') if user else 'Guest'}")
+                return
+
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            relative_path = data.get('file')
+            content = data.get('content')
+            user_info = data.get('user')
+
+            if not relative_path or content is None:
+                self.send_error(400, "Missing 'file' or 'content'")
+                return
+            
+            if relative_path.startswith('/'): relative_path = relative_path[1:]
+            safe_path = os.path.normpath(os.path.join(os.getcwd(), relative_path))
+            
+            # Case-insensitive check for Windows compatibility
+            if not safe_path.lower().startswith(os.getcwd().lower()):
+                log_pages.warning(f"Save: access denied: {safe_path} not in {os.getcwd()}")
+                self.send_error(403, "Access denied")
+                return
 
-            # If we reach here it means either the page isn't in Supabase or an error
-            # occurred fetching it.  We'll try to serve the local file ourselves and
-            # perform the same editor-script injection.
+            content = HtmlPipeline.process(content, relative_path)
+
+            # Ensure directory exists for nested pages
+            os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+
+            with open(safe_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            
+            # Phase 2: Persist page to Supabase
+            old_content = None
             try:
-                file_path = os.path.normpath(os.path.join(os.getcwd(), clean_path))
-                if os.path.isfile(file_path):
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-
-                    if 'editor.js' not in content:
-                        if '</body>' in content.lower():
-                            lower = content.lower()
-                            idx = lower.rfind('</body>')
-                            if idx != -1:
-                                content = content[:idx] + '<script src="/scripts/editor.js"></script>\n' + content[idx:]
-                        else:
-                            content += '\n<script src="/scripts/editor.js"></script>'
-
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-                    self.end_headers()
-                    self.wfile.write(content.encode('utf-8'))
-                    return
+                # Fetch existing content for diff logging
+                old_content = store.get_page(relative_path)
+                store.save_page(relative_path, content)
             except Exception as e:
-                print(f"[INJECT] Error reading local file {clean_path}: {e}")
-        
-        super().do_GET()
+                log_db.error(f"Error saving page to Supabase: {e}")
+            # Reads prefer the mirror while the database is down, so it must not keep the old copy
+            PageMirror.write(page_key(relative_path), content)
 
+            InvalidationBus.publish('pages', page_key(relative_path))
 
-    def do_POST(self):
-        if self.path == '/save':
-            try:
-                user = get_authenticated_user(self)
-                print(f"[SAVE] POST /save authenticated user: {user}")
-                
-                if not is_admin(user):
-                    print(f"[SAVE] Admin check failed for user: {user}")
-                    self.send_error(403, f"Permission denied: Admins only. Current user: {user.get('username') if user else 'Guest'}")
-                    return
+            # Activity Log
+            if user_info:
+                try:
+                    log_entry = {
+                        "user": user_info.get('username', 'Unknown'),
+                        "action": "edited",
+                        "type": "page",
+                        "details": {
+                            "target": relative_path,
+                            "old_content": old_content,
+                            "new_content": content
+                        },
+                        "timestamp": datetime.now(timezone.utc).isoformat()
+                    }
+                    jobs.submit('log_activity', entry=log_entry)
+                except: pass
 
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                relative_path = data.get('file')
-                content = data.get('content')
-                user_info = data.get('user')
+            self.send_json({"status": "success"})
+            
+        except Exception as e:
+            self.send_error(500, f"Server error: {str(e)}")
 
-                if not relative_path or content is None:
-                    self.send_error(400, "Missing 'file' or 'content'")
-                    return
-                
-                if relative_path.startswith('/'): relative_path = relative_path[1:]
-                safe_path = os.path.normpath(os.path.join(os.getcwd(), relative_path))
-                
-                # Case-insensitive check for Windows compatibility
-                if not safe_path.lower().startswith(os.getcwd().lower()):
-                    print(f"[SAVE] Access denied: {safe_path} not in {os.getcwd()}")
-                    self.send_error(403, "Access denied")
-                    return
+    # API: Delete Page
+    def handle_delete_page(self):
+        try:
+            user = get_authenticated_user(self)
+            if not is_admin(user):
+                self.send_error(403, "Permission denied: Admins only")
+                return
 
-                # Ensure saved pages always include the editor script.
-                if 'editor.js' not in content:
-                    if '</body>' in content.lower():
-                        lower = content.lower()
-                        idx = lower.rfind('</body>')
-                        if idx != -1:
-                            content = content[:idx] + '<script src="/scripts/editor.js"></script>\n' + content[idx:]
-                    else:
-                        content = content + '\n<script src="/scripts/editor.js"></script>'
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body)
+            
+            file_path = data.get('path', '')
+            
+            # Security: normalize and validate path
+            if file_path.startswith('/'):
+                file_path = file_path[1:]
+            
+            # Protected pages that cannot be deleted
+            protected = ['index.html', 'pages/characters.html']
+            if any(file_path.endswith(p) for p in protected):
+                self.send_json({"status": "error", "message": "Cannot delete protected page"}, 403)
+                return
+            
+            safe_path = os.path.normpath(os.path.join(os.getcwd(), file_path))
+            
+            # Security: must be within project directory
+            if not safe_path.startswith(os.getcwd()):
+                self.send_error(403, "Access denied")
+                return
+            
+            # Check file exists
+            if not os.path.exists(safe_path):
+                self.send_json({"status": "error", "message": "File not found"}, 404)
+                return
+            
+            # Delete the file
+            os.remove(safe_path)
+            log_pages.info(f"Deleted file: {safe_path}")
+            
+            # Phase 2: Delete from Supabase
+            try:
+                store.delete_page(file_path)
+            except Exception as e:
+                log_db.error(f"Error deleting page from Supabase: {e}")
+            PageMirror.remove(page_key(file_path))
 
-                # Ensure directory exists for nested pages
-                os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+            InvalidationBus.publish('pages', page_key(file_path))
 
-                with open(safe_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
-                # Phase 2: Persist page to Supabase
-                old_content = None
-                try:
-                    # Fetch existing content for diff logging
-                    old_res = supabase.table('wiki_pages').select('content').eq('path', relative_path).execute()
-                    if old_res.data:
-                        old_content = old_res.data[0].get('content')
-
-                    supabase.table('wiki_pages').upsert({
-                        'path': relative_path,
-                        'content': content,
-                        'updated_at': datetime.now(timezone.utc).isoformat()
-                    }).execute()
-                except Exception as e:
-                    print(f"[DB] Error saving page to Supabase: {e}")
+            # Log the deletion
+            try:
+                log_entry = {
+                    "user": user.get('username', 'Admin'),
+                    "action": "deleted",
+                    "type": "system",
+                    "details": {"target": file_path},
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+                jobs.submit('log_activity', entry=log_entry)
+            except: pass
+            
+            self.send_json({"status": "success", "message": "Page deleted"})
+            
+        except Exception as e:
+            log_pages.error(f"Delete error: {e}")
+            self.send_error(500, str(e))
 
-                # Activity Log
-                if user_info:
-                    try:
-                        log_entry = {
-                            "user": user_info.get('username', 'Unknown'),
-                            "action": "edited",
-                            "type": "page",
-                            "details": {
-                                "target": relative_path,
-                                "old_content": old_content,
-                                "new_content": content
-                            },
-                            "timestamp": datetime.now(timezone.utc).isoformat()
-                        }
-                        supabase.table('activity_logs').insert(log_entry).execute()
-                    except: pass
+    # API: Upload File (for banners)
+    def handle_upload(self):
+        try:
+            # Authentication Check
+            user = get_authenticated_user(self)
+            if not user:
+                log_upload.info("Access denied: No user logged in")
+                self.send_error(403, "Login required")
+                return
 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
-                
-            except Exception as e:
-                self.send_error(500, f"Server error: {str(e)}")
+            content_type = self.headers.get('Content-Type', '')
+            if 'multipart/form-data' not in content_type:
+                self.send_error(400, "Content-Type must be multipart/form-data")
+                return
 
-        # API: Delete Page
-        elif self.path == '/api/pages/delete':
             try:
-                user = get_authenticated_user(self)
-                if not is_admin(user):
-                    self.send_error(403, "Permission denied: Admins only")
-                    return
+               boundary = content_type.split("boundary=")[1].encode()
+               log_upload.debug("Boundary found: %s", boundary)
+            except IndexError:
+                log_upload.warning(f"Missing boundary in content-type: {content_type}")
+                self.send_error(400, "Invalid Content-Type: missing boundary")
+                return
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body)
-                
-                file_path = data.get('path', '')
-                
-                # Security: normalize and validate path
-                if file_path.startswith('/'):
-                    file_path = file_path[1:]
-                
-                # Protected pages that cannot be deleted
-                protected = ['index.html', 'pages/characters.html']
-                if any(file_path.endswith(p) for p in protected):
-                    self.send_response(403)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "error", "message": "Cannot delete protected page"}).encode('utf-8'))
-                    return
-                
-                safe_path = os.path.normpath(os.path.join(os.getcwd(), file_path))
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            
+            # Robust multipart parsing
+            # Parts are separated by b'--' + boundary
+            parts = body.split(b'--' + boundary)
+            
+            found_filename = None
+            file_content = None
+            
+            for part in parts:
+                # Skip empty parts or end guard
+                if not part or part == b'--\r\n': continue
                 
-                # Security: must be within project directory
-                if not safe_path.startswith(os.getcwd()):
-                    self.send_error(403, "Access denied")
-                    return
+                if b'filename="' in part:
+                    # Header/Body separator is \r\n\r\n
+                    split_idx = part.find(b'\r\n\r\n')
+                    if split_idx == -1: continue
+                    
+                    headers = part[:split_idx].decode('utf-8', errors='ignore')
+                    # Content follows headers + 4 bytes (\r\n\r\n)
+                    # And usually ends with \r\n before the next boundary
+                    raw_content = part[split_idx+4:]
+                    
+                    # Remove trailing \r\n which is part of multipart framing, not the file
+                    if raw_content.endswith(b'\r\n'):
+                        raw_content = raw_content[:-2]
+                        
+                    import re
+                    m = re.search(r'filename="([^"]+)"', headers)
+                    if m:
+                        found_filename = m.group(1)
+                        file_content = raw_content
+                        break
+                        
+            if found_filename and file_content:
+                # Determine extension
+                ext = os.path.splitext(found_filename)[1].lower()
+                if not ext: ext = '.png'
                 
-                # Check file exists
-                if not os.path.exists(safe_path):
-                    self.send_response(404)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "error", "message": "File not found"}).encode('utf-8'))
-                    return
+                # Generate unique filename
+                new_filename = f"{uuid.uuid4()}{ext}"
                 
-                # Delete the file
-                os.remove(safe_path)
-                print(f"[DELETE] Deleted file: {safe_path}")
+                # Ensure directory exists
+                upload_dir = os.path.join(os.getcwd(), 'assets', 'uploads')
+                os.makedirs(upload_dir, exist_ok=True)
                 
-                # Phase 2: Delete from Supabase
-                try:
-                    supabase.table('wiki_pages').delete().eq('path', file_path).execute()
-                except Exception as e:
-                    print(f"[DB] Error deleting page from Supabase: {e}")
-
-                # Log the deletion
+                file_path = os.path.join(upload_dir, new_filename)
+                with open(file_path, 'wb') as f:
+                    f.write(file_content)
+            
                 try:
                     log_entry = {
-                        "user": user.get('username', 'Admin'),
-                        "action": "deleted",
-                        "type": "system",
-                        "details": {"target": file_path},
+                        "user": user.get('username', 'Unknown'),
+                        "action": "uploaded",
+                        "type": "asset",
+                        "details": {"target": new_filename},
                         "timestamp": datetime.now(timezone.utc).isoformat()
                     }
-                    supabase.table('activity_logs').insert(log_entry).execute()
+                    jobs.submit('log_activity', entry=log_entry)
                 except: pass
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "message": "Page deleted"}).encode('utf-8'))
+                # Return URL consistent with serving path
+                file_url = f"/assets/uploads/{new_filename}"
+                log_upload.info(f"Success: {file_url}")
                 
-            except Exception as e:
-                print(f"[DELETE ERROR] {e}")
-                self.send_error(500, str(e))
-
-        # API: Upload File (for banners)
-        elif self.path == '/api/upload':
-            try:
-                # Authentication Check
-                user = get_authenticated_user(self)
-                if not user:
-                    print("[UPLOAD] Access denied: No user logged in")
-                    self.send_error(403, "Login required")
-                    return
-
-                content_type = self.headers.get('Content-Type', '')
-                if 'multipart/form-data' not in content_type:
-                    self.send_error(400, "Content-Type must be multipart/form-data")
-                    return
+                self.send_json({"status": "success", "url": file_url})
+            else:
+                log_upload.warning("No file found in parsing")
+                self.send_error(400, "No file found")
 
-                try:
-                   boundary = content_type.split("boundary=")[1].encode()
-                   print(f"[UPLOAD] Boundary found: {boundary.decode()}")
-                except IndexError:
-                    print(f"[UPLOAD] Error: Missing boundary in content-type: {content_type}")
-                    self.send_error(400, "Invalid Content-Type: missing boundary")
-                    return
+        except Exception as e:
+            log_upload.exception(f"Upload error: {e}")
+            import traceback
+            traceback.print_exc()
+            self.send_error(500, str(e))
 
-                content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length)
-                
-                # Robust multipart parsing
-                # Parts are separated by b'--' + boundary
-                parts = body.split(b'--' + boundary)
-                
-                found_filename = None
-                file_content = None
-                
-                for part in parts:
-                    # Skip empty parts or end guard
-                    if not part or part == b'--\r\n': continue
-                    
-                    if b'filename="' in part:
-                        # Header/Body separator is \r\n\r\n
-                        split_idx = part.find(b'\r\n\r\n')
-                        if split_idx == -1: continue
-                        
-                        headers = part[:split_idx].decode('utf-8', errors='ignore')
-                        # Content follows headers + 4 bytes (\r\n\r\n)
-                        # And usually ends with \r\n before the next boundary
-                        raw_content = part[split_idx+4:]
-                        
-                        # Remove trailing \r\n which is part of multipart framing, not the file
-                        if raw_content.endswith(b'\r\n'):
-                            raw_content = raw_content[:-2]
-                            
-                        import re
-                        m = re.search(r'filename="([^"]+)"', headers)
-                        if m:
-                            found_filename = m.group(1)
-                            file_content = raw_content
-                            break
-                            
-                if found_filename and file_content:
-                    # Determine extension
-                    ext = os.path.splitext(found_filename)[1].lower()
-                    if not ext: ext = '.png'
-                    
-                    # Generate unique filename
-                    new_filename = f"{uuid.uuid4()}{ext}"
-                    
-                    # Ensure directory exists
-                    upload_dir = os.path.join(os.getcwd(), 'assets', 'uploads')
-                    os.makedirs(upload_dir, exist_ok=True)
-                    
-                    file_path = os.path.join(upload_dir, new_filename)
-                    with open(file_path, 'wb') as f:
-                        f.write(file_content)
-                
-                    try:
-                        log_entry = {
-                            "user": user.get('username', 'Unknown'),
-                            "action": "uploaded",
-                            "type": "asset",
-                            "details": {"target": new_filename},
-                            "timestamp": datetime.now(timezone.utc).isoformat()
-                        }
-                        supabase.table('activity_logs').insert(log_entry).execute()
-                    except: pass
-                    
-                    # Return URL consistent with serving path
-                    file_url = f"/assets/uploads/{new_filename}"
-                    print(f"[UPLOAD] Success: {file_url}")
-                    
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "success", "url": file_url}).encode())
-                else:
-                    print("[UPLOAD] Error: No file found in parsing")
-                    self.send_error(400, "No file found")
+    # API: Profile Update
+    def handle_update_profile(self):
+        try:
+            user = get_authenticated_user(self)
+            if not user:
+                self.send_error(403, "Login required")
+                return
 
-            except Exception as e:
-                print(f"[UPLOAD ERROR] {e}")
-                import traceback
-                traceback.print_exc()
-                self.send_error(500, str(e))
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_len)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            target_username = data.get('username')
+            if not target_username:
+                self.send_error(400, "Username required")
+                return
 
-        elif self.path == '/api/profile':
-            try:
-                user = get_authenticated_user(self)
-                if not user:
-                    self.send_error(403, "Login required")
-                    return
+            # Security: Only allow user to edit their OWN profile, or admin
+            if not is_admin(user) and user.get('username') != target_username:
+                self.send_error(403, "Permission denied")
+                return
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_data = self.rfile.read(content_len)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                target_username = data.get('username')
-                if not target_username:
-                    self.send_error(400, "Username required")
-                    return
+            # Prepare profile data
+            profile_update = {}
+            if 'bio' in data: profile_update['about'] = data['bio']
+            if 'about' in data: profile_update['about'] = data['about']
+            if 'banner' in data: profile_update['banner'] = data['banner']
+            if 'rank' in data: profile_update['rank'] = data['rank']
+            if 'title' in data: profile_update['title'] = data['title']
 
-                # Security: Only allow user to edit their OWN profile, or admin
-                if not is_admin(user) and user.get('username') != target_username:
-                    self.send_error(403, "Permission denied")
-                    return
+            # Use upsert to create or update profile
+            store.upsert_profile({
+                "username": target_username,
+                **profile_update
+            })
+            
+            self.send_json({"status": "success", "message": "Profile updated"})
 
-                # Prepare profile data
-                profile_update = {}
-                if 'bio' in data: profile_update['about'] = data['bio']
-                if 'about' in data: profile_update['about'] = data['about']
-                if 'banner' in data: profile_update['banner'] = data['banner']
-                if 'rank' in data: profile_update['rank'] = data['rank']
-                if 'title' in data: profile_update['title'] = data['title']
-
-                # Use upsert to create or update profile
-                supabase.table('user_profiles').upsert({
-                    "username": target_username,
-                    **profile_update
-                }).execute()
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "message": "Profile updated"}).encode())
+        except Exception as e:
+            log_server.error(f"Profile POST error: {e}")
+            self.send_error(500, str(e))
 
-            except Exception as e:
-                print(f"[PROFILE POST ERROR] {e}")
-                self.send_error(500, str(e))
+    # API: Update a user's role
+    def handle_update_permissions(self):
+        try:
+            user = get_authenticated_user(self)
+            if not is_admin(user):
+                self.send_error(403, "Permission denied")
+                return
 
-        # API: Profile Update
-        elif self.path == '/api/profile':
-            try:
-                user = SessionManager.get_user(self.headers)
-                if not user:
-                    self.send_error(403, "Login required")
-                    return
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            target_user = data.get('username')
+            new_role = data.get('role')
+            if not target_user or not new_role:
+                self.send_error(400, "Missing username or role")
+                return
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_data = self.rfile.read(content_len)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                target_username = data.get('username')
-                if not target_username:
-                    self.send_error(400, "Username required")
-                    return
+            # Update permissions.json
+            PermissionService.set_role(target_user, new_role)
 
-                # Security: Only allow user to edit their OWN profile, or admin
-                if not is_admin(user) and user.get('username') != target_username:
-                    self.send_error(403, "Permission denied")
-                    return
+            # Update Supabase
+            updated = store.set_user_role(target_user, new_role)
+            InvalidationBus.publish('permissions', target_user)
+            # Signed tokens issued before now carry the old role
+            for row in updated or ():
+                TokenRevocations.bump_role_version(row['id'])
+            
+            self.send_json({"status": "success"})
+        except Exception as e:
+            log_auth.error(f"Permissions POST error: {e}")
+            self.send_error(500, str(e))
 
-                # Prepare profile data
-                profile_update = {}
-                if 'bio' in data: profile_update['about'] = data['bio']
-                if 'about' in data: profile_update['about'] = data['about']
-                if 'banner' in data: profile_update['banner'] = data['banner']
-                if 'rank' in data: profile_update['rank'] = data['rank']
-                if 'title' in data: profile_update['title'] = data['title']
-
-                # Use upsert to create or update profile
-                supabase.table('user_profiles').upsert({
-                    "username": target_username,
-                    **profile_update
-                }).execute()
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "message": "Profile updated"}).encode())
+    # API: Post a comment
+    def handle_post_comment(self):
+        try:
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body.decode('utf-8'))
+            
+            page_id = data.get('pageId')
+            user = data.get('user')
+            user_id = data.get('user_id')
+            content = data.get('content')
+            parent_id = data.get('parent_id')
+            role = data.get('role', 'user')
+            avatar = data.get('avatar')
+            
+            if not page_id or not content or not user:
+                self.send_error(400, "Missing required fields")
                 return
+            
+            # Sanitize user_id: If "anonymous" or obviously invalid, set to None for Null in DB
+            if user_id == 'anonymous' or not (user_id and str(user_id).isdigit()):
+                user_id = None
+            
+            # Check if user exists, otherwise Lazy Sync
+            if user_id:
+                user_record = UserDatabase.get(user_id)
+                if not user_record and user:
+                    log_comments.info("Lazy Sync: Creating missing user %s (%s)", user, user_id)
+                    UserDatabase.save({
+                        'id': user_id,
+                        'username': user,
+                        'avatar': avatar,
+                        'role': role
+                    })
 
+            # Create new comment
+            new_comment = {
+                "id": str(uuid.uuid4()),
+                "page_id": page_id,
+                "user_id": user_id,
+                "parent_id": parent_id,
+                "text": content,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "is_pinned": False,
+                "likes": [],
+                "dislikes": [],
+                "replies": []
+            }
+            
+            log_comments.debug("Attempting to insert comment: %s for page %s", new_comment['id'], page_id)
+            
+            try:
+                inserted = store.insert_comment(new_comment)
+                log_comments.debug("Insert successful: %s", inserted)
             except Exception as e:
-                print(f"[PROFILE POST ERROR] {e}")
-                self.send_error(500, str(e))
+                log_comments.error(f"Failed to insert comment into 'comments' table: {e}")
+                if hasattr(e, 'message'): log_comments.error(f"  Details: {e.message}")
+                # If it's a 409 or duplicate key, we might need to handle it, but uuid4 should be unique
+                self.send_error(500, f"Database error: {str(e)}")
                 return
+            
+            # Fetch user data to return fully populated comment to frontend
+            user_record = UserDatabase.get(user_id)
+            frontend_comment = {
+                **new_comment,
+                "user": user, # Username from request
+                "role": role,
+                "avatar": user_record.get('avatar') if user_record else avatar,
+                "parent_id": parent_id,
+                "is_deleted": False
+            }
+            
+            # We need to map 'text' to 'content' for the frontend
+            frontend_comment['content'] = frontend_comment['text']
+        
+            self.send_json({"status": "success", "comment": frontend_comment})
+            
+        except Exception as e:
+            log_comments.error(f"Comment POST error: {e}")
+            self.send_error(500, str(e))
 
-        elif self.path == '/api/permissions':
+    # API: Vote on a comment
+    def handle_vote_comment(self):
+        try:
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body)
+            
+            page_id = data.get('pageId')
+            comment_id = data.get('commentId')
+            user_id = data.get('userId')
+            vote_type = data.get('voteType')  # 'like' or 'dislike'
+            
             try:
-                user = get_authenticated_user(self)
-                if not is_admin(user):
-                    self.send_error(403, "Permission denied")
+                comment = store.get_comment(comment_id)
+                if not comment:
+                    self.send_error(404, "Comment not found")
                     return
 
-                content_length = int(self.headers.get('Content-Length', 0))
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
+                likes = comment.get('likes', [])
+                dislikes = comment.get('dislikes', [])
                 
-                target_user = data.get('username')
-                new_role = data.get('role')
-                if not target_user or not new_role:
-                    self.send_error(400, "Missing username or role")
-                    return
-
-                # Update permissions.json
-                perms = FileHandler.read_json('permissions.json', default={})
-                perms[target_user] = new_role
-                FileHandler.write_json('permissions.json', perms)
-
-                # Update Supabase
-                supabase.table('users').update({'role': new_role}).eq('username', target_user).execute()
+                # Remove from both first
+                if user_id in likes: likes.remove(user_id)
+                if user_id in dislikes: dislikes.remove(user_id)
+                
+                # Add to appropriate list
+                if vote_type == 'like':
+                    likes.append(user_id)
+                elif vote_type == 'dislike':
+                    dislikes.append(user_id)
+                    
+                store.update_comment(comment_id, {'likes': likes, 'dislikes': dislikes})
                 
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success"}).encode())
             except Exception as e:
-                print(f"[PERMISSIONS POST ERROR] {e}")
-                self.send_error(500, str(e))
+                log_db.error(f"Error voting on comment: {e}")
+                self.send_error(500, "Database error")
+                return
+            
+            self.send_json({"status": "success"})
+            
+        except Exception as e:
+            self.send_error(500, str(e))
 
-        # === COMMENTS API ===
-        elif self.path == '/api/comments':
+    # API: Edit a comment
+    def handle_edit_comment(self):
+        try:
+            user = get_authenticated_user(self)
+            if not user:
+                self.send_error(401, "Login required")
+                return
+
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body)
+            
+            page_id = data.get('pageId')
+            comment_id = data.get('commentId')
+            user_id = data.get('userId')
+            new_content = data.get('content')
+            # Trust is_admin only from server side check
+            is_admin_req = is_admin(user)
+            
+            success = False
             try:
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body.decode('utf-8'))
-                
-                page_id = data.get('pageId')
-                user = data.get('user')
-                user_id = data.get('user_id')
-                content = data.get('content')
-                parent_id = data.get('parent_id')
-                role = data.get('role', 'user')
-                avatar = data.get('avatar')
-                
-                if not page_id or not content or not user:
-                    self.send_error(400, "Missing required fields")
-                    return
-                
-                # Sanitize user_id: If "anonymous" or obviously invalid, set to None for Null in DB
-                if user_id == 'anonymous' or not (user_id and str(user_id).isdigit()):
-                    user_id = None
+                comment = store.get_comment(comment_id)
+                if comment:
+                    if comment.get('user_id') == user['id'] or is_admin_req:
+                        store.update_comment(comment_id, {'text': new_content})
+                        success = True
+            except Exception as e:
+                log_db.error(f"Error editing comment: {e}")
                 
-                # Check if user exists, otherwise Lazy Sync
-                if user_id:
-                    user_record = UserDatabase.get(user_id)
-                    if not user_record and user:
-                        print(f"[DB] Lazy Sync: Creating missing user {user} ({user_id})")
-                        UserDatabase.save({
-                            'id': user_id,
-                            'username': user,
-                            'avatar': avatar,
-                            'role': role
-                        })
+            self.send_json({"status": "success" if success else "error", "message": "Permission denied" if not success else None})
+            
+        except Exception as e:
+            self.send_error(500, str(e))
 
-                # Create new comment
-                new_comment = {
-                    "id": str(uuid.uuid4()),
-                    "page_id": page_id,
-                    "user_id": user_id,
-                    "parent_id": parent_id,
-                    "text": content,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "is_pinned": False,
-                    "likes": [],
-                    "dislikes": [],
-                    "replies": []
-                }
-                
-                print(f"[DB] Attempting to insert comment: {new_comment['id']} for page {page_id}")
-                
-                try:
-                    insert_result = supabase.table('comments').insert(new_comment).execute()
-                    print(f"[DB] Insert successful: {insert_result.data}")
-                except Exception as e:
-                    print(f"[DB ERROR] Failed to insert comment into 'comments' table: {e}")
-                    if hasattr(e, 'message'): print(f"  Details: {e.message}")
-                    # If it's a 409 or duplicate key, we might need to handle it, but uuid4 should be unique
-                    self.send_error(500, f"Database error: {str(e)}")
-                    return
-                
-                # Fetch user data to return fully populated comment to frontend
-                user_record = UserDatabase.get(user_id)
-                frontend_comment = {
-                    **new_comment,
-                    "user": user, # Username from request
-                    "role": role,
-                    "avatar": user_record.get('avatar') if user_record else avatar,
-                    "parent_id": parent_id,
-                    "is_deleted": False
-                }
-                
-                # We need to map 'text' to 'content' for the frontend
-                frontend_comment['content'] = frontend_comment['text']
+    # API: Delete a comment
+    def handle_delete_comment(self):
+        try:
+            user = get_authenticated_user(self)
+            if not user:
+                self.send_error(401, "Login required")
+                return
+
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body)
             
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "comment": frontend_comment}).encode('utf-8'))
-                
-            except Exception as e:
-                print(f"[COMMENT POST ERROR] {e}")
-                self.send_error(500, str(e))
+            page_id = data.get('pageId')
+            comment_id = data.get('commentId')
+            user_id = user['id']
+            
+            # Robust Admin Check: Using existing is_admin helper
+            is_admin_req = is_admin(user)
 
-        elif self.path == '/api/comments/vote':
             try:
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body)
-                
-                page_id = data.get('pageId')
-                comment_id = data.get('commentId')
-                user_id = data.get('userId')
-                vote_type = data.get('voteType')  # 'like' or 'dislike'
-                
-                try:
-                    response = supabase.table('comments').select('*').eq('id', comment_id).execute()
-                    if not response.data:
-                        self.send_error(404, "Comment not found")
+                comment = store.get_comment(comment_id)
+                if comment:
+                    if comment.get('user_id') == str(user_id) or is_admin_req:
+                        store.update_comment(comment_id, {
+                            'text': '[This comment has been deleted]',
+                            'is_deleted': True
+                        })
+                        
+                        self.send_json({"status": "success"})
                         return
                         
-                    comment = response.data[0]
-                    likes = comment.get('likes', [])
-                    dislikes = comment.get('dislikes', [])
-                    
-                    # Remove from both first
-                    if user_id in likes: likes.remove(user_id)
-                    if user_id in dislikes: dislikes.remove(user_id)
+                self.send_error(403, "Permission denied")
+                return
+            except Exception as e:
+                log_db.error(f"Error deleting comment: {e}")
+                self.send_error(500, "Database error")
+                return
+                
+        except Exception as e:
+            log_comments.error(f"Delete error: {e}")
+            self.send_error(500, str(e))
+
+    # API: Pin/unpin a comment
+    def handle_pin_comment(self):
+        try:
+            user = get_authenticated_user(self)
+            if not is_admin(user):
+                self.send_error(403, "Permission denied")
+                return
+
+            content_len = int(self.headers.get('Content-Length', 0))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body)
+            
+            page_id = data.get('pageId')
+            comment_id = data.get('commentId')
+            # Admin check already done above
+            
+            try:
+                comment = store.get_comment(comment_id)
+                if comment:
+                    new_pin_status = not comment.get('is_pinned', False)
                     
-                    # Add to appropriate list
-                    if vote_type == 'like':
-                        likes.append(user_id)
-                    elif vote_type == 'dislike':
-                        dislikes.append(user_id)
-                        
-                    supabase.table('comments').update({'likes': likes, 'dislikes': dislikes}).eq('id', comment_id).execute()
+                    store.update_comment(comment_id, {'is_pinned': new_pin_status})
                     
-                except Exception as e:
-                    print(f"[DB] Error voting on comment: {e}")
-                    self.send_error(500, "Database error")
+                    self.send_json({"status": "success"})
                     return
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
-                
+                    
+                self.send_error(404, "Comment not found")
             except Exception as e:
-                self.send_error(500, str(e))
+                log_db.error(f"Error pinning comment: {e}")
+                self.send_error(500, "Database error")
+            
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    def handle_not_found(self):
+        self.send_error(404)
+
+    def handle_method_not_allowed(self):
+        # HEAD on a GET route with side effects (see NO_HEAD_ROUTES)
+        self.send_body(b'', 'text/plain', 405, headers=[('Allow', 'GET')])
+
+
+ROUTES = [
+    ('GET', '/api/health', SaveRequestHandler.handle_health),
+    ('GET', '/api/metrics', SaveRequestHandler.handle_metrics),
+    ('GET', '/api/search*', SaveRequestHandler.handle_search),
+    ('GET', '/api/user/me', SaveRequestHandler.handle_user_me),
+    ('GET', '/auth/logout', SaveRequestHandler.handle_logout),
+    ('GET', '/api/permissions', SaveRequestHandler.handle_get_permissions),
+    ('GET', '/api/comments*', SaveRequestHandler.handle_get_comments),
+    ('GET', '/api/profile*', SaveRequestHandler.handle_get_profile),
+    ('GET', '/api/activity*', SaveRequestHandler.handle_activity),
+    ('GET', '/auth/discord/login', SaveRequestHandler.handle_discord_login),
+    ('GET', '/auth/discord/callback*', SaveRequestHandler.handle_discord_callback),
+    ('GET', '/api/pages*', SaveRequestHandler.handle_list_pages),
+    ('GET', '/api/assets*', SaveRequestHandler.handle_list_assets),
+    ('POST', '/save', SaveRequestHandler.handle_save),
+    ('POST', '/api/pages/delete', SaveRequestHandler.handle_delete_page),
+    ('POST', '/api/upload', SaveRequestHandler.handle_upload),
+    ('POST', '/api/profile', SaveRequestHandler.handle_update_profile),
+    ('POST', '/api/permissions', SaveRequestHandler.handle_update_permissions),
+    ('POST', '/api/comments', SaveRequestHandler.handle_post_comment),
+    ('POST', '/api/comments/vote', SaveRequestHandler.handle_vote_comment),
+    ('POST', '/api/comments/edit', SaveRequestHandler.handle_edit_comment),
+    ('POST', '/api/comments/delete', SaveRequestHandler.handle_delete_comment),
+    ('POST', '/api/comments/pin', SaveRequestHandler.handle_pin_comment),
+]
+if not os.environ.get('RENDER'):
+    ROUTES.append(('GET', '/api/dev/login', SaveRequestHandler.handle_dev_login))
+
+# GET routes that change state (OAuth state and codes, sessions); HEAD must not run them
+NO_HEAD_ROUTES = ('/auth/logout', '/auth/discord/login', '/auth/discord/callback*', '/api/dev/login')
+
+ROUTER = Router(ROUTES, fallbacks={
+    'GET': SaveRequestHandler.serve_page_or_static,
+    'HEAD': SaveRequestHandler.handle_method_not_allowed,
+    'POST': SaveRequestHandler.handle_not_found,
+}, no_head=NO_HEAD_ROUTES)
+
+
+# === POOLED SERVER ===
+class PooledHTTPServer(socketserver.TCPServer):
+    """TCPServer that hands accepted connections to a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue. When the queue is full the
+    connection gets an immediate 503 with Retry-After instead of waiting behind
+    a slow Supabase query or Discord retry.
+
+    A keep-alive connection keeps its worker between requests for up to
+    KEEPALIVE_TIMEOUT, but only while nothing else is waiting: as soon as
+    connections are queued, handlers answer with Connection: close and idle
+    connections are closed (see SaveRequestHandler._next_request_ready).
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    # The accept loop drains the kernel backlog quickly, the real limit is the queue below
+    request_queue_size = 128
+
+    def __init__(self, server_address, RequestHandlerClass, workers=None, queue_size=None, retry_after=None, bind_and_activate=True):
+        self.workers = max(1, int(workers if workers is not None else WORKER_THREADS))
+        self.retry_after = int(retry_after if retry_after is not None else OVERLOAD_RETRY_AFTER)
+        self._pending = queue.Queue(maxsize=max(1, int(queue_size if queue_size is not None else ACCEPT_QUEUE_SIZE)))
+        self._threads = []
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"worker-{i}", daemon=self.daemon_threads)
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject_overloaded(request)
 
-        elif self.path == '/api/comments/edit':
+    def is_busy(self):
+        """True while connections are waiting for a worker; handlers then stop keeping connections alive."""
+        return not self._pending.empty()
+
+    def _worker_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
             try:
-                user = get_authenticated_user(self)
-                if not user:
-                    self.send_error(401, "Login required")
-                    return
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body)
-                
-                page_id = data.get('pageId')
-                comment_id = data.get('commentId')
-                user_id = data.get('userId')
-                new_content = data.get('content')
-                # Trust is_admin only from server side check
-                is_admin_req = is_admin(user)
-                
-                success = False
-                try:
-                    response = supabase.table('comments').select('*').eq('id', comment_id).execute()
-                    if response.data:
-                        comment = response.data[0]
-                        if comment.get('user_id') == user['id'] or is_admin_req:
-                            supabase.table('comments').update({
-                                'text': new_content
-                            }).eq('id', comment_id).execute()
-                            success = True
-                except Exception as e:
-                    print(f"[DB] Error editing comment: {e}")
-                    
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success" if success else "error", "message": "Permission denied" if not success else None}).encode('utf-8'))
-                
-            except Exception as e:
-                self.send_error(500, str(e))
+    def _reject_overloaded(self, request):
+        body = json.dumps({"status": "error", "message": "Server busy, please retry", "code": 503}).encode()
+        head = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1')
+        try:
+            request.settimeout(1.0)
+            request.sendall(head + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
 
-        elif self.path == '/api/comments/delete':
+    def server_close(self):
+        super().server_close()
+        # Drop connections that never reached a worker, then stop the workers
+        while True:
             try:
-                user = get_authenticated_user(self)
-                if not user:
-                    self.send_error(401, "Login required")
-                    return
+                request, _addr = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            self.shutdown_request(request)
+        for _ in self._threads:
+            try:
+                self._pending.put(None, timeout=1.0)
+            except queue.Full:
+                break
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body)
-                
-                page_id = data.get('pageId')
-                comment_id = data.get('commentId')
-                user_id = user['id']
-                
-                # Robust Admin Check: Using existing is_admin helper
-                is_admin_req = is_admin(user)
 
-                try:
-                    response = supabase.table('comments').select('*').eq('id', comment_id).execute()
-                    if response.data:
-                        comment = response.data[0]
-                        if comment.get('user_id') == str(user_id) or is_admin_req:
-                            supabase.table('comments').update({
-                                'text': '[This comment has been deleted]',
-                                'is_deleted': True
-                            }).eq('id', comment_id).execute()
-                            
-                            self.send_response(200)
-                            self.send_header('Content-type', 'application/json')
-                            self.end_headers()
-                            self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
-                            return
-                            
-                    self.send_error(403, "Permission denied")
-                    return
-                except Exception as e:
-                    print(f"[DB] Error deleting comment: {e}")
-                    self.send_error(500, "Database error")
-                    return
-                    
-            except Exception as e:
-                print(f"[DELETE ERROR] {e}")
-                self.send_error(500, str(e))
+class ReusePortHTTPServer(PooledHTTPServer):
+    """Pooled server whose socket sets SO_REUSEPORT, so every pre-fork worker can bind PORT."""
+    allow_reuse_port = True
+
 
-        elif self.path == '/api/comments/pin':
+def make_server(port=PORT, handler=None):
+    """Build the HTTP server for the configured SERVER_MODE."""
+    handler = handler or SaveRequestHandler
+    if SERVER_MODE == 'single':
+        # One thread serves every client in turn, so a kept-alive idle client would stall the rest;
+        # answer as HTTP/1.0, which closes each connection after its response
+        handler = type(handler.__name__, (handler,), {'protocol_version': 'HTTP/1.0'})
+        # Allow reuse of address to prevent 'Address already in use' errors on quick restarts
+        socketserver.TCPServer.allow_reuse_address = True
+        return socketserver.TCPServer(("", port), handler)
+    return PooledHTTPServer(("", port), handler)
+
+
+# === PRE-FORK ===
+def serve_prefork(port=PORT, workers=WORKER_PROCESSES):
+    """Run `workers` processes that accept on the same port and relay cache invalidations.
+
+    With SO_REUSEPORT each worker binds its own socket and the kernel spreads
+    connections across them; otherwise the parent binds once and the workers
+    inherit the listening socket. Each worker keeps its own in-memory caches,
+    kept coherent through InvalidationBus. Dead workers are restarted.
+    """
+    reuse_port = hasattr(socket, 'SO_REUSEPORT')
+    listener = None
+    if not reuse_port:
+        listener = socket.create_server(("", port), backlog=PooledHTTPServer.request_queue_size)
+
+    channels = {}  # worker pid -> parent end of its socketpair
+
+    def spawn():
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        pid = os.fork()
+        if pid == 0:
+            parent_end.close()
+            for other in channels.values():
+                other.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            InvalidationBus.attach(child_end)
             try:
-                user = get_authenticated_user(self)
-                if not is_admin(user):
-                    self.send_error(403, "Permission denied")
-                    return
+                if listener is not None:
+                    httpd = PooledHTTPServer(("", port), SaveRequestHandler, bind_and_activate=False)
+                    httpd.socket.close()
+                    httpd.socket = listener
+                else:
+                    httpd = ReusePortHTTPServer(("", port), SaveRequestHandler)
+                Warmup.start()
+                SessionExpiry.start()
+                httpd.serve_forever()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+        child_end.close()
+        parent_end.setblocking(False)
+        channels[pid] = parent_end
 
-                content_len = int(self.headers.get('Content-Length', 0))
-                post_body = self.rfile.read(content_len)
-                data = json.loads(post_body)
-                
-                page_id = data.get('pageId')
-                comment_id = data.get('commentId')
-                # Admin check already done above
-                
-                try:
-                    response = supabase.table('comments').select('*').eq('id', comment_id).execute()
-                    if response.data:
-                        comment = response.data[0]
-                        new_pin_status = not comment.get('is_pinned', False)
-                        
-                        supabase.table('comments').update({
-                            'is_pinned': new_pin_status
-                        }).eq('id', comment_id).execute()
-                        
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
-                        return
-                        
-                    self.send_error(404, "Comment not found")
-                except Exception as e:
-                    print(f"[DB] Error pinning comment: {e}")
-                    self.send_error(500, "Database error")
-                
-            except Exception as e:
-                self.send_error(500, str(e))
+    stopping = []
 
+    def stop(signum, frame):
+        stopping.append(signum)
 
-        else:
-            self.send_error(404)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(max(1, workers)):
+        spawn()
+    log_server.info(f"Server started at http://localhost:{port} ({len(channels)} worker processes, SO_REUSEPORT={'on' if reuse_port else 'off'})")
+
+    while not stopping:
+        try:
+            readable, _, _ = select.select(list(channels.values()), [], [], 1.0)
+        except InterruptedError:
+            continue
+        for source in readable:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                continue
+            for target in channels.values():
+                if target is not source:
+                    try:
+                        target.send(data)
+                    except OSError:
+                        pass
+
+        # Restart workers that died
+        while True:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if not pid:
+                break
+            dead = channels.pop(pid, None)
+            if dead is not None:
+                dead.close()
+                if stopping:
+                    continue
+                log_server.warning(f"Worker {pid} exited, restarting")
+                # Don't spin if workers die straight away (e.g. the port is taken)
+                time.sleep(1.0)
+                spawn()
+
+    log_server.info("Shutting down server...")
+    for pid in list(channels):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(channels):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    if listener is not None:
+        listener.close()
 
 
 if __name__ == '__main__':
@@ -1774,17 +4656,25 @@ if __name__ == '__main__':
         if not os.path.exists('assets/uploads'):
             os.makedirs('assets/uploads')
 
-        # Allow reuse of address to prevent 'Address already in use' errors on quick restarts
-        socketserver.TCPServer.allow_reuse_address = True
+        if SERVER_MODE == 'prefork' and not hasattr(os, 'fork'):
+            log_server.warning("os.fork is not available on this platform, using the pooled server")
+        elif SERVER_MODE == 'prefork':
+            serve_prefork()
+            sys.exit(0)
 
-        with socketserver.TCPServer(("", PORT), SaveRequestHandler) as httpd:
-            print(f"Server started at http://localhost:{PORT}")
+        with make_server() as httpd:
+            if isinstance(httpd, PooledHTTPServer):
+                log_server.info(f"Server started at http://localhost:{PORT} ({httpd.workers} workers, queue {httpd._pending.maxsize})")
+            else:
+                log_server.info(f"Server started at http://localhost:{PORT}")
+            Warmup.start()
+            SessionExpiry.start()
             try:
                 httpd.serve_forever()
             except KeyboardInterrupt:
-                print("\nShutting down server...")
+                log_server.info("Shutting down server...")
                 httpd.server_close()
     except Exception as e:
-        print(f"FAILED TO START SERVER: {e}")
+        log_server.critical(f"FAILED TO START SERVER: {e}")
         import traceback
         traceback.print_exc()
\ No newline at end of file
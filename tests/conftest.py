@@ -0,0 +1,25 @@
+"""
+pytest setup for the unit tests in this directory.
+
+server.py reads its configuration from the environment at import time, so
+it is pointed at a throwaway SQLite database and scratch files before any
+test imports it. The other scripts here (repro_comments.py, loadtest.py)
+drive a running server and are not collected.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCRATCH = tempfile.mkdtemp(prefix='rtoc-tests-')
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(SCRATCH, 'wiki.db'))
+os.environ.setdefault('REVOCATIONS_FILE', os.path.join(SCRATCH, 'revoked_sessions.json'))
+os.environ.setdefault('JOB_DEAD_LETTER_FILE', os.path.join(SCRATCH, 'dead_jobs.jsonl'))
+os.environ.setdefault('PAGE_MIRROR_DIR', os.path.join(SCRATCH, 'cache', 'pages'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+collect_ignore = ['repro_comments.py', 'loadtest.py', 'fake_postgrest.py']
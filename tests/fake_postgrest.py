@@ -0,0 +1,316 @@
+"""
+In-memory stand-in for the Supabase PostgREST endpoint used by server.py.
+
+Supports the subset of the REST API the wiki calls: select with column lists,
+eq/lt/gt/in filters (and or=(...) groups of them), order, limit, insert, upsert (Prefer: resolution=merge-duplicates),
+PATCH and DELETE. Every request can be delayed to mimic network latency to a
+hosted database, and setting `outage` makes every request fail with a 503.
+
+    python tests/fake_postgrest.py --port 54321 --latency 0.02
+
+then start the wiki with SUPABASE_URL=http://127.0.0.1:54321.
+"""
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+
+# Primary key column of each table in supabase_schema.sql
+PRIMARY_KEYS = {
+    'users': 'id',
+    'user_profiles': 'username',
+    'comments': 'id',
+    'sessions': 'session_id',
+    'activity_logs': 'id',
+    'wiki_pages': 'path',
+}
+
+COLUMN_DEFAULTS = {
+    'comments': lambda: {'id': str(uuid.uuid4()), 'created_at': now(), 'is_pinned': False,
+                         'likes': [], 'dislikes': [], 'replies': [], 'parent_id': None},
+    'sessions': lambda: {'created_at': now(), 'last_seen': now()},
+    'activity_logs': lambda: {'timestamp': now()},
+    'wiki_pages': lambda: {'updated_at': now()},
+    'users': lambda: {'role': 'user', 'avatar': None},
+}
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.tables = {name: {} for name in PRIMARY_KEYS}
+        self.lock = threading.Lock()
+        self._serial = 0
+
+    def _key(self, table, row):
+        pk = PRIMARY_KEYS.get(table)
+        if pk == 'id' and table == 'activity_logs' and row.get('id') is None:
+            self._serial += 1
+            row['id'] = self._serial
+        return row.get(pk)
+
+    def insert(self, table, rows, merge=False):
+        stored = []
+        with self.lock:
+            data = self.tables.setdefault(table, {})
+            for row in rows:
+                new = COLUMN_DEFAULTS.get(table, dict)()
+                existing = row.get(PRIMARY_KEYS.get(table))
+                if merge and existing in data:
+                    new = dict(data[existing])
+                new.update(row)
+                key = self._key(table, new)
+                if key is None:
+                    key = str(uuid.uuid4())
+                data[key] = new
+                stored.append(dict(new))
+        return stored
+
+    def select(self, table, filters, order=None, limit=None):
+        with self.lock:
+            rows = [dict(r) for r in self.tables.get(table, {}).values() if matches(r, filters)]
+        if order:
+            column, _, direction = order.partition('.')
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column) or ''),
+                      reverse=direction.startswith('desc'))
+        if limit is not None:
+            rows = rows[:limit]
+        return rows
+
+    def update(self, table, filters, values):
+        changed = []
+        with self.lock:
+            for row in self.tables.get(table, {}).values():
+                if matches(row, filters):
+                    row.update(values)
+                    changed.append(dict(row))
+        return changed
+
+    def delete(self, table, filters):
+        removed = []
+        with self.lock:
+            data = self.tables.get(table, {})
+            for key in [k for k, r in data.items() if matches(r, filters)]:
+                removed.append(data.pop(key))
+        return removed
+
+
+def unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_filter(column, expression):
+    """(column, op, value) for 'eq.x', 'lt.x', 'gt.x', 'is.null' or 'in.(a,b)'; None for anything else."""
+    op, _, value = expression.partition('.')
+    if op == 'in' and value.startswith('(') and value.endswith(')'):
+        return column, op, [unquote(v) for v in value[1:-1].split(',')]
+    if op in ('eq', 'lt', 'gt') or (op == 'is' and value == 'null'):
+        return column, op, unquote(value)
+    return None
+
+
+def parse_group(op, value):
+    """(None, 'or'|'and', conditions) for the inside of or=(...) / and(...), nested groups included."""
+    conditions = []
+    for part in split_top_level(value):
+        name, _, rest = part.partition('(')
+        if name in ('and', 'or') and rest.endswith(')'):
+            conditions.append(parse_group(name, rest[:-1]))
+        else:
+            column, _, expression = part.partition('.')
+            condition = parse_filter(column, expression)
+            if condition:
+                conditions.append(condition)
+    return None, op, conditions
+
+
+def test(row, column, op, value):
+    if op == 'or':
+        return any(test(row, *condition) for condition in value)
+    if op == 'and':
+        return all(test(row, *condition) for condition in value)
+    actual = row.get(column)
+    if op == 'is':
+        return actual is None
+    if op == 'in':
+        return str(actual) in value
+    if op == 'eq':
+        return str(actual) == value
+    if actual is None:
+        return False
+    return str(actual) < value if op == 'lt' else str(actual) > value
+
+
+def matches(row, filters):
+    """Filters are (column, op, value) triples; plain (column, value) pairs mean eq."""
+    for condition in filters:
+        column, op, value = condition if len(condition) == 3 else (condition[0], 'eq', condition[1])
+        if not test(row, column, op, value):
+            return False
+    return True
+
+
+def parse_query(query):
+    """Split a PostgREST query string into (columns, eq filters, order, limit)."""
+    columns, filters, order, limit = None, [], None, None
+    for name, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        if name == 'select':
+            columns = None if value.strip() == '*' else [c.strip() for c in value.split(',')]
+        elif name == 'order':
+            order = value.split(',')[0]
+        elif name == 'limit':
+            limit = int(value)
+        elif name in ('on_conflict', 'columns'):
+            continue
+        elif name == 'or' and value.startswith('(') and value.endswith(')'):
+            filters.append(parse_group('or', value[1:-1]))
+        else:
+            condition = parse_filter(name, value)
+            if condition:
+                filters.append(condition)
+    return columns, filters, order, limit
+
+
+def split_top_level(value):
+    """Split on commas that are outside double quotes and parentheses."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, c in enumerate(value):
+        if c == '"':
+            quoted = not quoted
+        elif not quoted and c in '()':
+            depth += 1 if c == '(' else -1
+        elif not quoted and depth == 0 and c == ',':
+            parts.append(value[start:i])
+            start = i + 1
+    parts.append(value[start:])
+    return parts
+
+
+def project(rows, columns):
+    if not columns:
+        return rows
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+
+class FakePostgRESTHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _table_and_query(self):
+        parsed = urllib.parse.urlparse(self.path)
+        prefix = '/rest/v1/'
+        if not parsed.path.startswith(prefix):
+            return None, parsed.query
+        return parsed.path[len(prefix):].strip('/'), parsed.query
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'null') if length else None
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        latency = self.server.latency
+        if latency:
+            jitter = self.server.jitter
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+    def _handle(self, method):
+        # Read the body up front so one left unread (postgrest-py sends '{}' with DELETE) can't corrupt the next request
+        body = self._body()
+        self._delay()
+        self.server.calls += 1
+        if self.server.outage:
+            self._reply(503, {'message': 'upstream unavailable'})
+            return
+        table, query = self._table_and_query()
+        if table is None:
+            self._reply(404, {'message': 'not found'})
+            return
+        columns, filters, order, limit = parse_query(query)
+        db = self.server.db
+        if method == 'GET':
+            rows = db.select(table, filters, order, limit)
+        elif method == 'POST':
+            rows = body if isinstance(body, list) else [body]
+            merge = 'merge-duplicates' in self.headers.get('Prefer', '')
+            rows = db.insert(table, rows, merge=merge)
+        elif method == 'PATCH':
+            rows = db.update(table, filters, body or {})
+        else:
+            rows = db.delete(table, filters)
+        if method != 'GET' and 'return=minimal' in self.headers.get('Prefer', ''):
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._reply(200 if method in ('GET', 'PATCH', 'DELETE') else 201, project(rows, columns))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakePostgREST(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0):
+        super().__init__(('127.0.0.1', port), FakePostgRESTHandler)
+        self.db = FakeDatabase()
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self.outage = False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-postgrest', daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- seconds on top of --latency')
+    args = parser.parse_args()
+    fake = FakePostgREST(args.port, args.latency, args.jitter)
+    print(f"Fake PostgREST listening on {fake.url} (latency {args.latency}s)")
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
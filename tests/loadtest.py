@@ -0,0 +1,384 @@
+"""
+Load test and benchmark for the wiki server.
+
+Starts server.py (or async_server.py) from a scratch copy of the repository,
+pointed at the in-memory fake PostgREST in tests/fake_postgrest.py, drives a
+set of traffic scenarios against it and reports throughput and p50/p95/p99
+latency per scenario.
+
+    python tests/loadtest.py                         # all scenarios, 10s each
+    python tests/loadtest.py --latency 0.03 --concurrency 16 --duration 20
+    python tests/loadtest.py --scenarios pages,search --json results.json
+    python tests/loadtest.py --baseline results.json # exit 1 on regressions
+
+Scenarios:
+    pages      page views of pages/**/*.html
+    search     search-as-you-type bursts (one request per typed prefix)
+    comments   comment listing for a handful of pages
+    votes      vote storm on a few hot comments
+    save       /save edits by an admin session
+    mixed      weighted mix of all of the above
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from fake_postgrest import FakePostgREST
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_ID = 'loadtest-admin'
+ADMIN_SESSION = 'loadtest-admin-session'
+COMMENT_PAGES = 8
+HOT_COMMENTS = 3
+SEARCH_WORDS = ['cultivation', 'regressor', 'characters', 'sect', 'realm', 'technique', 'cycle', 'sword']
+
+# Large or irrelevant entries are symlinked into the scratch copy instead of copied
+LINKED = {'assets'}
+SKIPPED = {'.git', '__pycache__', 'tests'}
+
+
+# === SANDBOX ===
+def make_sandbox():
+    """Copy the tree into a temp dir so /save edits never touch the working copy."""
+    root = tempfile.mkdtemp(prefix='rtoc-loadtest-')
+    for name in os.listdir(REPO_ROOT):
+        src = os.path.join(REPO_ROOT, name)
+        dst = os.path.join(root, name)
+        if name in SKIPPED or name.endswith('.log'):
+            continue
+        if name in LINKED:
+            os.symlink(src, dst)
+        elif os.path.isdir(src):
+            shutil.copytree(src, dst, ignore=shutil.ignore_patterns('__pycache__'))
+        else:
+            shutil.copy2(src, dst)
+    return root
+
+
+def list_pages(root):
+    pages = []
+    for dirpath, _, files in os.walk(os.path.join(root, 'pages')):
+        for name in files:
+            if name.endswith('.html'):
+                pages.append(os.path.relpath(os.path.join(dirpath, name), root).replace('\\', '/'))
+    return sorted(pages)
+
+
+def seed(db, pages):
+    """Seed users, an admin session and comments so the API scenarios hit real rows."""
+    db.insert('users', [{'id': ADMIN_ID, 'username': 'loadtest', 'avatar': None, 'role': 'owner'}])
+    db.insert('sessions', [{'session_id': ADMIN_SESSION, 'user_id': ADMIN_ID}])
+    users = [{'id': f'user-{i}', 'username': f'reader{i}', 'avatar': None, 'role': 'user'} for i in range(50)]
+    db.insert('users', users)
+    comment_pages = [p[len('pages/'):-len('.html')] for p in pages[:COMMENT_PAGES]]
+    comment_ids = []
+    for page_id in comment_pages:
+        rows = db.insert('comments', [
+            {'page_id': page_id, 'user_id': users[i % len(users)]['id'], 'text': f'Comment {i} on {page_id}'}
+            for i in range(20)
+        ])
+        comment_ids.extend(row['id'] for row in rows)
+    return comment_pages, comment_ids[:HOT_COMMENTS]
+
+
+class SQLiteSeeder:
+    """Writes seed rows straight into the server's SQLite file (STORAGE_BACKEND=sqlite)."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+
+    def insert(self, table, rows, merge=False):
+        stored = []
+        for row in rows:
+            if table == 'comments':
+                row = dict({'id': str(uuid.uuid4()), 'likes': [], 'dislikes': [], 'replies': []}, **row)
+            values = [json.dumps(v) if isinstance(v, (list, dict)) else v for v in row.values()]
+            names = ', '.join(f'"{k}"' for k in row)
+            marks = ', '.join('?' for _ in row)
+            self.conn.execute(f'INSERT OR REPLACE INTO {table} ({names}) VALUES ({marks})', values)
+            stored.append(row)
+        return stored
+
+
+# === SERVER PROCESS ===
+def start_server(root, entry, port, db_url, extra_env):
+    env = dict(os.environ)
+    env.pop('RENDER', None)
+    env.update({
+        'PORT': str(port),
+        'SUPABASE_URL': db_url,
+        'SUPABASE_KEY': 'loadtest',
+        'SQLITE_PATH': 'wiki.db',
+        'LOG_LEVEL': 'WARNING',
+        'PYTHONUNBUFFERED': '1',
+    })
+    env.update(extra_env)
+    log = open(os.path.join(root, 'loadtest-server.log'), 'w')
+    proc = subprocess.Popen([sys.executable, entry], cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with {proc.returncode}, see {log.name}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"Server did not become healthy on port {port}, see {log.name}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# === SCENARIOS ===
+ADMIN_HEADERS = {'Cookie': f'session={ADMIN_SESSION}', 'Content-Type': 'application/json'}
+
+
+def page_views(ctx, rng):
+    while True:
+        page = rng.choice(ctx['pages'])
+        yield 'GET', '/' + page, None, {}
+
+
+def search_typing(ctx, rng):
+    while True:
+        word = rng.choice(SEARCH_WORDS)
+        for i in range(1, len(word) + 1):
+            yield 'GET', f'/api/search?q={word[:i]}', None, {}
+
+
+def comment_listing(ctx, rng):
+    while True:
+        yield 'GET', f"/api/comments?pageId={rng.choice(ctx['comment_pages'])}", None, {}
+
+
+def vote_storm(ctx, rng):
+    while True:
+        body = {
+            'pageId': ctx['comment_pages'][0],
+            'commentId': rng.choice(ctx['hot_comments']),
+            'userId': f'user-{rng.randrange(50)}',
+            'voteType': rng.choice(('like', 'dislike')),
+        }
+        yield 'POST', '/api/comments/vote', json.dumps(body), {'Content-Type': 'application/json'}
+
+
+def save_edits(ctx, rng):
+    while True:
+        page = rng.choice(ctx['save_pages'])
+        content = ctx['originals'][page] + f'\n<!-- loadtest {uuid.uuid4()} -->\n'
+        body = {'file': page, 'content': content, 'user': 'loadtest'}
+        yield 'POST', '/save', json.dumps(body), ADMIN_HEADERS
+
+
+def mixed(ctx, rng):
+    streams = [(page_views, 60), (search_typing, 20), (comment_listing, 15), (vote_storm, 4), (save_edits, 1)]
+    generators = [factory(ctx, rng) for factory, _ in streams]
+    weights = [weight for _, weight in streams]
+    while True:
+        yield next(rng.choices(generators, weights)[0])
+
+
+SCENARIOS = {
+    'pages': page_views,
+    'search': search_typing,
+    'comments': comment_listing,
+    'votes': vote_storm,
+    'save': save_edits,
+    'mixed': mixed,
+}
+
+
+# === DRIVER ===
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def run_scenario(name, ctx, port, concurrency, duration, seed_value):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        requests = SCENARIOS[name](ctx, rng)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local, failed = [], 0
+        while time.perf_counter() < stop_at:
+            method, path, body, headers = next(requests)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                res = conn.getresponse()
+                res.read()
+                if res.status >= 400:
+                    failed += 1
+                if res.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['scenario']:<10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against a previous --json run."""
+    previous = {r['scenario']: r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        old = previous.get(r['scenario'])
+        if not old:
+            continue
+        if old['rps'] and r['rps'] < old['rps'] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: throughput {r['rps']:.1f} req/s vs {old['rps']:.1f}")
+        for key in ('p95_ms', 'p99_ms'):
+            if old[key] and r[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{r['scenario']}: {key} {r[key]:.2f} vs {old[key]:.2f}")
+        if r['errors'] > old['errors']:
+            regressions.append(f"{r['scenario']}: {r['errors']} errors vs {old['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the wiki server against a fake Supabase.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated list of scenarios')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client connections per scenario')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake database latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='random +/- seconds on the database latency')
+    parser.add_argument('--storage', choices=('supabase', 'sqlite'), default='supabase',
+                        help='STORAGE_BACKEND for the server; supabase runs against the fake PostgREST')
+    parser.add_argument('--entry', default='server.py', help='server entry point (server.py or async_server.py)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the server, e.g. SERVER_MODE=prefork')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against results from a previous --json run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression vs --baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch copy for inspection')
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    extra_env['STORAGE_BACKEND'] = args.storage
+
+    root = make_sandbox()
+    fake = FakePostgREST(latency=args.latency, jitter=args.jitter).start()
+    pages = list_pages(root)
+    save_pages = pages[-4:]
+    port = free_port()
+    proc = start_server(root, args.entry, port, fake.url, extra_env)
+    results = []
+    try:
+        # The server creates the SQLite schema on startup, so seed once it is up
+        db = SQLiteSeeder(os.path.join(root, 'wiki.db')) if args.storage == 'sqlite' else fake.db
+        comment_pages, hot_comments = seed(db, pages)
+        ctx = {
+            'pages': pages,
+            'comment_pages': comment_pages,
+            'hot_comments': hot_comments,
+            'save_pages': save_pages,
+            'originals': {p: open(os.path.join(root, p), encoding='utf-8').read() for p in save_pages},
+        }
+        latency = 'sqlite' if args.storage == 'sqlite' else f"db latency {args.latency * 1000:.0f} ms"
+        print(f"{args.entry} on port {port}, {len(pages)} pages, {latency}, "
+              f"{args.concurrency} connections, {args.duration:.0f}s per scenario\n")
+        for name in names:
+            results.append(run_scenario(name, ctx, port, args.concurrency, args.duration, args.seed))
+    finally:
+        stop_server(proc)
+        fake.shutdown()
+        if args.keep:
+            print(f"Scratch copy kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print_report(results)
+    if args.storage == 'supabase':
+        print(f"\nDatabase calls: {fake.calls}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
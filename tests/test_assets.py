@@ -0,0 +1,121 @@
+"""scripts/build_assets.py minifiers and AssetManifest.rewrite / restore."""
+import importlib.util
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import ROOT
+from server import AssetManifest
+
+_spec = importlib.util.spec_from_file_location('build_assets', os.path.join(ROOT, 'scripts', 'build_assets.py'))
+build_assets = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(build_assets)
+minify_js = build_assets.minify_js
+minify_css = build_assets.minify_css
+
+
+def test_minify_js_drops_comments_and_spaces():
+    source = "// header\nfunction add(a, b) {\n    /* sum */\n    return a + b;\n}\n"
+    assert minify_js(source) == "function add(a,b){\nreturn a+b;\n}\n"
+
+
+def test_minify_js_keeps_strings_regexes_and_templates():
+    source = (
+        "const s = 'a // not a comment';\n"
+        "const d = \"/* nor this */\";\n"
+        "const r = /[/]\\/+ x/g.test(s);\n"
+        "const t = `x ${ {a: 1}.a } // ${d}`;\n"
+    )
+    out = minify_js(source)
+    assert "'a // not a comment'" in out
+    assert '"/* nor this */"' in out
+    assert '/[/]\\/+ x/g' in out
+    assert '`x ${' in out and '} // ${d}`' in out
+
+
+def test_minify_js_keeps_line_breaks_and_operator_spacing():
+    out = minify_js("let a = 1\nlet b = a\n++b\nlet c = a + +b\nlet e = a - -b\nreturn typeof a\n")
+    assert out.splitlines() == ['let a=1', 'let b=a', '++b', 'let c=a+ +b', 'let e=a- -b', 'return typeof a']
+
+
+def test_minify_js_division_is_not_a_regex():
+    assert minify_js("const x = a / b / c;\n") == "const x=a/b/c;\n"
+
+
+def test_minify_css():
+    out = minify_css("/* theme */\nbody , p > a {\n  color: red ;\n  content: ' a  b ';\n}\n")
+    assert out == "body,p>a{color: red;content: ' a  b '}\n"
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node not installed')
+@pytest.mark.parametrize('name', sorted(n for n in os.listdir(os.path.join(ROOT, 'scripts')) if n.endswith('.js')))
+def test_minified_site_scripts_still_parse(name, tmp_path):
+    with open(os.path.join(ROOT, 'scripts', name), 'r', encoding='utf-8') as f:
+        minified = minify_js(f.read())
+    target = tmp_path / name
+    target.write_text(minified, encoding='utf-8')
+    result = subprocess.run(['node', '--check', str(target)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.fixture
+def manifest(monkeypatch):
+    monkeypatch.setattr(AssetManifest, 'entries', {
+        'scripts/main.js': 'dist/scripts/main.0123456789.js',
+        'styles/main.css': 'dist/styles/main.abcdef0123.css',
+    })
+
+
+def test_rewrite_points_references_at_builds(manifest):
+    html = ('<link href="../../styles/main.css?v=3" rel="stylesheet">'
+            '<script src="/scripts/main.js"></script>'
+            '<script src="scripts/unknown.js"></script>'
+            '<a href="https://cdn.example/scripts/main.js">')
+    out = AssetManifest.rewrite(html)
+    assert 'href="../../dist/styles/main.abcdef0123.css"' in out
+    assert 'src="/dist/scripts/main.0123456789.js"' in out
+    assert 'src="scripts/unknown.js"' in out
+    assert 'https://cdn.example/scripts/main.js' in out
+
+
+def test_restore_undoes_rewrite(manifest):
+    html = '<link href="/styles/main.css"><script src="../scripts/main.js"></script>'
+    assert AssetManifest.restore(AssetManifest.rewrite(html)) == html
+
+
+def test_rewrite_without_manifest_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(AssetManifest, 'entries', {})
+    html = '<script src="/scripts/main.js"></script>'
+    assert AssetManifest.rewrite(html) == html
+
+
+def test_css_urls_are_rewritten_for_the_dist_location():
+    css = ("a{background:url('../assets/images/hero.png')}"
+           'b{background:url(../fonts/x.woff2?v=1#iefix)}'
+           'c{background:url("/assets/logo.png?v=2")}'
+           'd{background:url(data:image/png;base64,AAAA)}'
+           "e{background:url('https://cdn.example/x.png')}"
+           "f{background:url('theme.css')}")
+    out = build_assets.rewrite_css_urls(css, 'styles/main.css', 'dist/styles/main.css',
+                                        {'styles/theme.css': 'dist/styles/theme.0123456789.css'})
+    assert "url('../../assets/images/hero.png')" in out
+    assert 'url(../../fonts/x.woff2?v=1#iefix)' in out
+    assert 'url("/assets/logo.png?v=2")' in out
+    assert 'url(data:image/png;base64,AAAA)' in out
+    assert "url('https://cdn.example/x.png')" in out
+    assert "url('theme.0123456789.css')" in out
+
+
+def test_built_css_urls_resolve_to_the_original_assets(tmp_path):
+    for folder in ('scripts', 'styles', 'assets/images'):
+        (tmp_path / folder).mkdir(parents=True)
+    (tmp_path / 'scripts' / 'main.js').write_text('let a = 1;\n', encoding='utf-8')
+    (tmp_path / 'assets' / 'images' / 'hero.png').write_bytes(b'png')
+    (tmp_path / 'styles' / 'main.css').write_text(".hero {\n  background: url('../assets/images/hero.png');\n}\n",
+                                                   encoding='utf-8')
+    manifest = build_assets.build(str(tmp_path), str(tmp_path / 'dist'))
+    built = tmp_path / manifest['styles/main.css']
+    url = build_assets.CSS_URL_RE.search(built.read_text(encoding='utf-8')).group(2)
+    assert (built.parent / url).resolve() == (tmp_path / 'assets' / 'images' / 'hero.png').resolve()
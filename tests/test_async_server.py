@@ -0,0 +1,117 @@
+"""async_server.py connection handling: bridged responses and request framing."""
+import asyncio
+import http.client
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import async_server
+from conftest import ROOT
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def port():
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(async_server.AsyncWikiServer(port).serve_forever())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            assert time.monotonic() < deadline, 'async server did not start'
+            time.sleep(0.02)
+    yield port
+    loop.call_soon_threadsafe(task.cancel)
+
+
+def test_bridged_response_says_when_the_connection_closes(port, monkeypatch):
+    monkeypatch.setattr(async_server, 'KEEPALIVE_MAX_REQUESTS', 3)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    closes = []
+    for _ in range(7):
+        conn.request('GET', '/styles/main.css')
+        res = conn.getresponse()
+        res.read()
+        assert res.status == 200
+        closes.append(res.getheader('Connection'))
+    conn.close()
+    assert closes == ['keep-alive', 'keep-alive', 'close'] * 2 + ['keep-alive']
+
+
+def test_bridged_response_to_connection_close_request(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/styles/main.css', headers={'Connection': 'close'})
+    res = conn.getresponse()
+    res.read()
+    assert res.getheader('Connection') == 'close' and res.will_close
+    conn.close()
+
+
+def test_chunked_request_body_is_refused(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(b'POST /api/comments HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                     b'4\r\n{"a"\r\n0\r\n\r\nGET /api/health HTTP/1.1\r\nHost: x\r\n\r\n')
+        data = b''
+        while chunk := sock.recv(65536):
+            data += chunk
+    assert data.startswith(b'HTTP/1.1 411 ')
+    assert b'Connection: close' in data and data.count(b'HTTP/1.1') == 1
+
+
+IMAGE = 'assets/images/hong_su_ryeong.png'
+
+
+def image_bytes():
+    with open(os.path.join(ROOT, IMAGE), 'rb') as f:
+        return f.read()
+
+
+def test_bridged_file_body_is_not_buffered():
+    raw, file_body = async_server._run_bridged(f'GET /{IMAGE} HTTP/1.1\r\nHost: x\r\n\r\n'.encode(), ('127.0.0.1', 0))
+    try:
+        assert raw.endswith(b'\r\n\r\n') and b'Content-Length: %d' % len(image_bytes()) in raw
+        assert file_body[1] == [(0, len(image_bytes()))]
+    finally:
+        file_body[0].close()
+
+
+def test_static_file_is_streamed_whole(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    for _ in range(2):  # and the connection stays usable afterwards
+        conn.request('GET', '/' + IMAGE)
+        res = conn.getresponse()
+        assert res.status == 200 and res.read() == image_bytes()
+    conn.request('HEAD', '/' + IMAGE)
+    res = conn.getresponse()
+    assert res.status == 200 and res.read() == b''
+    assert int(res.getheader('Content-Length')) == len(image_bytes())
+    conn.close()
+
+
+def test_static_file_ranges_are_streamed(port):
+    data = image_bytes()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/' + IMAGE, headers={'Range': 'bytes=10-19'})
+    res = conn.getresponse()
+    assert res.status == 206 and res.read() == data[10:20]
+    conn.request('GET', '/' + IMAGE, headers={'Range': 'bytes=0-3,-4'})
+    res = conn.getresponse()
+    body = res.read()
+    boundary = res.getheader('Content-Type').split('boundary=')[1].encode()
+    assert res.status == 206 and body.count(b'Content-Range: bytes') == 2
+    assert b'\r\n\r\n' + data[:4] + b'\r\n--' + boundary + b'\r\n' in body
+    assert body.endswith(b'\r\n\r\n' + data[-4:] + b'\r\n--' + boundary + b'--\r\n')
+    conn.close()
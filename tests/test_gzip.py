@@ -0,0 +1,71 @@
+"""accepts_gzip negotiation and the GzipCache byte budget."""
+import gzip
+import random
+
+import pytest
+
+import server
+from server import GzipCache, accepts_gzip, negotiate_gzip
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('deflate, br', False),
+    ('', False),
+    (None, False),
+    ('*', True),
+    ('GZIP;q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip;q=nonsense', False),
+    ('*;q=0', False),
+    # An explicit gzip entry wins over '*' in either order
+    ('*;q=0, gzip', True),
+    ('gzip, *;q=0', True),
+    ('gzip;q=0, *', False),
+    ('*, gzip;q=0', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(GzipCache, '_entries', type(GzipCache._entries)())
+    monkeypatch.setattr(GzipCache, '_bytes', 0)
+    return GzipCache
+
+
+def test_gzip_cache_compresses_once_per_key(empty_cache):
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return b'cultivation ' * 500
+
+    first = empty_cache.get(('body', b'k'), produce)
+    second = empty_cache.get(('body', b'k'), produce)
+    assert first is second
+    assert len(calls) == 1
+    assert gzip.decompress(first) == b'cultivation ' * 500
+
+
+def test_gzip_cache_evicts_oldest_over_budget(empty_cache, monkeypatch):
+    monkeypatch.setattr(server, 'GZIP_CACHE_BYTES', 2000)
+    for i in range(20):
+        # Incompressible, so every entry costs ~170 bytes
+        empty_cache.get(('body', i), lambda i=i: random.Random(i).randbytes(150))
+    assert empty_cache._bytes <= 2000
+    assert ('body', 19) in empty_cache._entries
+    assert ('body', 0) not in empty_cache._entries
+
+
+def test_negotiate_gzip_skips_small_and_binary_bodies():
+    big = b'x' * (server.GZIP_MIN_SIZE + 1)
+    assert negotiate_gzip(b'tiny', 'text/html', 'gzip') == (b'tiny', [])
+    assert negotiate_gzip(big, 'image/png', 'gzip') == (big, [])
+    body, headers = negotiate_gzip(big, 'text/html', 'identity')
+    assert body == big and headers == [('Vary', 'Accept-Encoding')]
+    body, headers = negotiate_gzip(big, 'text/html', '*;q=0, gzip')
+    assert ('Content-Encoding', 'gzip') in headers
+    assert gzip.decompress(body) == big
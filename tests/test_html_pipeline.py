@@ -0,0 +1,77 @@
+"""HtmlPipeline: every step is idempotent, and render_page only fingerprints final pages."""
+import os
+
+import pytest
+
+from conftest import ROOT
+from server import AssetManifest, EDITOR_SCRIPT_TAG, HtmlPipeline, inject_editor_script, normalize_nav, render_page
+
+LEGACY_PAGE = """<html><head><link href="../styles/main.css" rel="stylesheet"></head><body>
+<nav class="nav"><div class="nav-container">
+    <a class="logo" href="../index.html">RToC</a>
+    <ul class="nav-links">
+        <li><a href="concepts.html" class="nav-link active" style="color: red">Concepts</a></li>
+    </ul>
+    <input class="search">
+</div>
+</nav>
+<p>Qi condensation</p>
+</body></html>
+"""
+
+
+def site_pages():
+    pages = [os.path.join('pages', n) for n in sorted(os.listdir(os.path.join(ROOT, 'pages'))) if n.endswith('.html')]
+    return ['index.html'] + pages
+
+
+@pytest.fixture
+def manifest(monkeypatch):
+    monkeypatch.setattr(AssetManifest, 'entries', {'styles/main.css': 'dist/styles/main.abcdef0123.css'})
+
+
+def test_process_normalizes_a_legacy_page():
+    out = HtmlPipeline.process(LEGACY_PAGE, 'pages/qi.html')
+    assert 'class="nav-start"' in out and 'class="nav-end"' in out
+    assert 'nav-link active' not in out and 'style="color: red"' not in out
+    assert out.count(EDITOR_SCRIPT_TAG) == 1
+    assert out.index(EDITOR_SCRIPT_TAG) < out.index('</body>')
+    assert HtmlPipeline.is_final(out)
+
+
+def test_process_is_idempotent():
+    once = HtmlPipeline.process(LEGACY_PAGE, 'pages/qi.html')
+    assert HtmlPipeline.process(once, 'pages/qi.html') == once
+
+
+@pytest.mark.parametrize('path', site_pages())
+def test_stored_site_pages_are_already_final(path):
+    with open(os.path.join(ROOT, path), 'r', encoding='utf-8') as f:
+        content = f.read()
+    assert HtmlPipeline.process(content, path) == content
+
+
+def test_editor_script_goes_before_the_last_body_close():
+    html = '<body><pre>&lt;/body&gt; </body></pre></BODY >'
+    out = inject_editor_script(html)
+    assert out.endswith(EDITOR_SCRIPT_TAG + '\n</BODY >')
+    assert inject_editor_script(out) == out
+    assert inject_editor_script('<p>fragment</p>') == '<p>fragment</p>\n' + EDITOR_SCRIPT_TAG
+
+
+def test_normalize_nav_leaves_grouped_navs_alone():
+    grouped = HtmlPipeline.process(LEGACY_PAGE, 'pages/qi.html')
+    assert normalize_nav(grouped, 'pages/qi.html') == grouped
+
+
+def test_saving_served_html_strips_fingerprints(manifest):
+    served = render_page(HtmlPipeline.process(LEGACY_PAGE, 'pages/qi.html'), 'pages/qi.html')
+    assert 'dist/styles/main.abcdef0123.css' in served
+    stored = HtmlPipeline.process(served, 'pages/qi.html')
+    assert 'dist/' not in stored and 'href="../styles/main.css"' in stored
+
+
+def test_render_page_applies_the_pipeline_only_to_legacy_content(manifest):
+    final = HtmlPipeline.process(LEGACY_PAGE, 'pages/qi.html')
+    assert render_page(final) == AssetManifest.rewrite(final)
+    assert render_page(LEGACY_PAGE, 'pages/qi.html') == AssetManifest.rewrite(final)
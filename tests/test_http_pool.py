@@ -0,0 +1,147 @@
+"""HTTPConnectionPool reuse, stale-connection handling and error bodies against a local socket server."""
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import server
+from server import HTTPConnectionPool
+
+
+class ScriptedServer:
+    """Keep-alive HTTP/1.1 server that answers each request per a script of actions.
+
+    'ok' / 404 send a response and keep the connection; 'close' responds and
+    then closes it without saying so; 'drop' reads the request and closes
+    without a response. Every request seen is recorded as (connection, method).
+    """
+    def __init__(self, *actions):
+        self.actions = list(actions)
+        self.requests = []
+        self.connections = 0
+        self.closed = threading.Event()  # set once a 'close' action has shut its connection
+        self.sock = socket.create_server(('127.0.0.1', 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn, self.connections), daemon=True).start()
+
+    def _serve(self, conn, number):
+        with conn, conn.makefile('rb') as f:
+            while True:
+                request_line = f.readline()
+                if not request_line:
+                    return
+                length = 0
+                for line in iter(f.readline, b'\r\n'):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                f.read(length)
+                self.requests.append((number, request_line.split()[0].decode()))
+                action = self.actions.pop(0) if self.actions else 'ok'
+                if action == 'drop':
+                    return
+                status, body = (404, b'{"message": "Unknown Member"}') if action == 404 else (200, b'hello')
+                conn.sendall(f"HTTP/1.1 {status} X\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+                if action == 'close':
+                    conn.shutdown(socket.SHUT_RDWR)
+                    self.closed.set()
+                    return
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def scripted():
+    servers = []
+
+    def start(*actions):
+        servers.append(ScriptedServer(*actions))
+        return servers[-1]
+    yield start
+    for s in servers:
+        s.close()
+
+
+def get(pool, url, method='GET', data=None):
+    with pool.urlopen(urllib.request.Request(url + '/x', data=data, method=method)) as res:
+        return res.read()
+
+
+def idle_count(pool):
+    return sum(len(v) for v in pool._idle.values())
+
+
+def test_connection_is_reused(scripted):
+    upstream = scripted('ok', 'ok', 'ok')
+    pool = HTTPConnectionPool(max_idle=2)
+    assert [get(pool, upstream.url) for _ in range(3)] == [b'hello'] * 3
+    assert upstream.connections == 1 and idle_count(pool) == 1
+
+
+def test_connection_closed_while_idle_is_not_used(scripted):
+    upstream = scripted('close', 'ok')
+    pool = HTTPConnectionPool()
+    get(pool, upstream.url)
+    assert upstream.closed.wait(2)
+    assert get(pool, upstream.url, 'POST', b'{}') == b'hello'
+    assert upstream.connections == 2
+    assert upstream.requests == [(1, 'GET'), (2, 'POST')]
+
+
+def test_idempotent_request_is_retried_on_a_fresh_connection(scripted):
+    upstream = scripted('ok', 'drop', 'ok')
+    pool = HTTPConnectionPool()
+    get(pool, upstream.url)
+    assert get(pool, upstream.url, 'PUT', b'{}') == b'hello'
+    assert upstream.requests == [(1, 'GET'), (1, 'PUT'), (2, 'PUT')]
+
+
+def test_post_on_a_reused_connection_is_not_replayed(scripted):
+    upstream = scripted('ok', 'drop', 'ok')
+    pool = HTTPConnectionPool()
+    get(pool, upstream.url)
+    with pytest.raises((ConnectionError, server.http.client.RemoteDisconnected)):
+        get(pool, upstream.url, 'POST', b'code=abc')
+    assert upstream.requests == [(1, 'GET'), (1, 'POST')]
+    # The slot was released
+    assert get(pool, upstream.url) == b'hello'
+
+
+def test_error_status_raises_with_body_and_keeps_the_connection(scripted):
+    upstream = scripted(404, 'ok')
+    pool = HTTPConnectionPool()
+    with pytest.raises(urllib.error.HTTPError) as info:
+        get(pool, upstream.url)
+    assert info.value.code == 404 and b'Unknown Member' in info.value.read()
+    assert get(pool, upstream.url) == b'hello'
+    assert upstream.connections == 1
+
+
+def test_unread_response_does_not_return_its_connection(scripted):
+    upstream = scripted('ok')
+    pool = HTTPConnectionPool()
+    with pool.urlopen(urllib.request.Request(upstream.url + '/x')):
+        pass
+    assert idle_count(pool) == 0
+
+
+def test_join_guild_returns_its_connection(scripted, monkeypatch):
+    upstream = scripted('ok')
+    pool = HTTPConnectionPool()
+    monkeypatch.setattr(server, '_urlopen_with_rate_limit_retry',
+                        lambda req: pool.urlopen(urllib.request.Request(upstream.url + '/join', data=req.data, method='PUT')))
+    server.join_guild('42', 'token')
+    assert upstream.requests == [(1, 'PUT')]
+    assert idle_count(pool) == 1
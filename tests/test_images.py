@@ -0,0 +1,53 @@
+"""ImageDerivatives: query parsing, width snapping and cleanup of failed renders."""
+import os
+
+import pytest
+
+import server
+from server import ImageDerivatives
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_wants_parses_width_and_format():
+    assert ImageDerivatives.wants('assets/images/a.png', 'w=300') == (300, None)
+    assert ImageDerivatives.wants('assets/images/a.JPG', 'w=300&fmt=webp') == (300, 'webp')
+    assert ImageDerivatives.wants('assets/images/a.png', 'fmt=webp') == (None, 'webp')
+    assert ImageDerivatives.wants('assets/images/a.png', 'fmt=gif') is None
+    assert ImageDerivatives.wants('assets/images/a.png', 'v=2') is None
+    assert ImageDerivatives.wants('assets/images/a.png', '') is None
+    assert ImageDerivatives.wants('styles/main.css', 'w=300') is None
+
+
+def test_snap_rounds_up_to_an_allowed_width(monkeypatch):
+    monkeypatch.setattr(server, 'IMAGE_WIDTHS', (160, 320, 640))
+    assert ImageDerivatives.snap(1) == 160
+    assert ImageDerivatives.snap(320) == 320
+    assert ImageDerivatives.snap(321) == 640
+    assert ImageDerivatives.snap(5000) == 640
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'IMAGE_CACHE_DIR', str(tmp_path / 'cache'))
+    path = tmp_path / 'source.png'
+    Image.new('RGB', (400, 200), 'red').save(path)
+    return str(path)
+
+
+def test_render_writes_the_resized_derivative(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(ImageDerivatives, '_account', staticmethod(lambda added: None))
+    target = str(tmp_path / 'cache' / 'out.webp')
+    assert ImageDerivatives._render(source, target, 100, 'webp') == target
+    with Image.open(target) as img:
+        assert img.size == (100, 50) and img.format == 'WEBP'
+
+
+def test_failed_save_leaves_no_temp_file(source, tmp_path, monkeypatch):
+    def broken_save(self, *args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(Image.Image, 'save', broken_save)
+    target = str(tmp_path / 'cache' / 'out.webp')
+    with pytest.raises(OSError):
+        ImageDerivatives._render(source, target, 100, 'webp')
+    assert os.listdir(tmp_path / 'cache') == []
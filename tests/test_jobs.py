@@ -0,0 +1,116 @@
+"""JobQueue retries, dead-lettering and the queue bound."""
+import json
+import threading
+import time
+import urllib.error
+
+import pytest
+
+import server
+from server import JobQueue
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def http_error(code):
+    return urllib.error.HTTPError('https://discord.com/api', code, 'error', {}, None)
+
+
+@pytest.fixture
+def dead_letters(tmp_path, monkeypatch):
+    path = tmp_path / 'dead_jobs.jsonl'
+    monkeypatch.setattr(server, 'JOB_DEAD_LETTER_FILE', str(path))
+
+    def read():
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    return read
+
+
+def test_failed_job_is_retried_until_it_succeeds(dead_letters):
+    calls = []
+
+    def flaky(n):
+        calls.append(n)
+        if len(calls) < 3:
+            raise OSError('connection reset')
+
+    queue = JobQueue({'flaky': flaky}, workers=1, max_attempts=5, retry_delay=0.01)
+    assert queue.submit('flaky', n=7)
+    wait_for(lambda: len(calls) == 3 and queue.pending() == 0)
+    time.sleep(0.05)
+    assert calls == [7, 7, 7]
+    assert dead_letters() == []
+
+
+def test_job_is_dead_lettered_after_max_attempts(dead_letters):
+    calls = []
+
+    def broken(**payload):
+        calls.append(payload)
+        raise http_error(503)
+
+    queue = JobQueue({'guild_join': broken}, workers=1, max_attempts=3, retry_delay=0.01)
+    queue.submit('guild_join', user_id='42', access_token='secret')
+    wait_for(lambda: dead_letters())
+    assert len(calls) == 3
+    [record] = dead_letters()
+    assert record['job'] == 'guild_join' and record['attempts'] == 3
+    assert record['payload'] == {'user_id': '42', 'access_token': '[redacted]'}
+    assert 'secret' not in json.dumps(record)
+
+
+def test_permanent_client_error_is_not_retried(dead_letters):
+    calls = []
+
+    def forbidden():
+        calls.append(1)
+        raise http_error(403)
+
+    queue = JobQueue({'forbidden': forbidden}, workers=1, max_attempts=5, retry_delay=0.01)
+    queue.submit('forbidden')
+    wait_for(lambda: dead_letters())
+    assert len(calls) == 1 and dead_letters()[0]['attempts'] == 1
+
+
+@pytest.mark.parametrize('error, retry', [
+    (http_error(429), True),
+    (http_error(408), True),
+    (http_error(502), True),
+    (http_error(404), False),
+    (http_error(401), False),
+    (OSError('timed out'), True),
+])
+def test_retryable(error, retry):
+    assert JobQueue.retryable(error) is retry
+
+
+def test_full_queue_rejects_and_dead_letters(dead_letters):
+    running, release = threading.Event(), threading.Event()
+
+    def block(n):
+        running.set()
+        release.wait(2)
+
+    queue = JobQueue({'block': block}, workers=1, size=1, retry_delay=0.01)
+    try:
+        assert queue.submit('block', n=1)
+        assert running.wait(2)
+        assert queue.submit('block', n=2)
+        assert not queue.submit('block', n=3)
+        [record] = dead_letters()
+        assert record['payload'] == {'n': 3} and record['error'] == 'queue full' and record['attempts'] == 0
+    finally:
+        release.set()
+    wait_for(lambda: queue.pending() == 0)
+
+
+def test_unknown_job_is_refused():
+    with pytest.raises(ValueError):
+        JobQueue({}).submit('nope')
@@ -0,0 +1,77 @@
+"""Keep-alive connections must not hold a worker while other clients wait."""
+import http.client
+import socket
+import threading
+import time
+
+import pytest
+
+import server
+from server import PooledHTTPServer, SaveRequestHandler
+
+
+def serve(httpd):
+    threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    return httpd.server_address[1]
+
+
+def get(conn, path='/api/health'):
+    conn.request('GET', path)
+    res = conn.getresponse()
+    res.read()
+    return res
+
+
+@pytest.fixture
+def pooled():
+    httpd = PooledHTTPServer(('127.0.0.1', 0), SaveRequestHandler, workers=2)
+    yield serve(httpd)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_idle_keep_alive_clients_do_not_block_a_new_one(pooled):
+    idle = [http.client.HTTPConnection('127.0.0.1', pooled, timeout=5) for _ in range(2)]
+    for conn in idle:
+        assert get(conn).status == 200
+    started = time.monotonic()
+    newcomer = http.client.HTTPConnection('127.0.0.1', pooled, timeout=5)
+    assert get(newcomer).status == 200
+    assert time.monotonic() - started < 2
+    for conn in idle + [newcomer]:
+        conn.close()
+
+
+def test_keep_alive_connection_is_reused_when_the_pool_is_free(pooled):
+    conn = http.client.HTTPConnection('127.0.0.1', pooled, timeout=5)
+    first = get(conn)
+    port = conn.sock.getsockname()[1]
+    second = get(conn)
+    assert first.status == second.status == 200
+    assert conn.sock is not None and conn.sock.getsockname()[1] == port
+    assert second.getheader('Connection') is None
+    conn.close()
+
+
+def test_pipelined_requests_are_all_answered(pooled):
+    with socket.create_connection(('127.0.0.1', pooled), timeout=5) as sock:
+        sock.sendall(b'GET /api/health HTTP/1.1\r\nHost: x\r\n\r\n' * 2 +
+                     b'GET /api/health HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+        data = b''
+        while chunk := sock.recv(65536):
+            data += chunk
+    assert data.count(b'HTTP/1.1 200') == 3
+
+
+def test_single_mode_closes_each_connection(monkeypatch):
+    monkeypatch.setattr(server, 'SERVER_MODE', 'single')
+    httpd = server.make_server(0)
+    port = serve(httpd)
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        res = get(conn)
+        assert res.status == 200 and res.version == 10 and res.will_close
+        conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
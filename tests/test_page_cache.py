@@ -0,0 +1,53 @@
+"""PageCache TTL, LRU bound and the version check that keeps stale renders out."""
+import pytest
+
+import server
+from server import InvalidationBus, PageCache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(PageCache, '_entries', type(PageCache._entries)())
+    monkeypatch.setattr(PageCache, '_versions', {})
+
+
+def test_put_then_get():
+    PageCache.put('pages/a.html', 'body', PageCache.version('pages/a.html'))
+    assert PageCache.get('pages/a.html') == 'body'
+    assert PageCache.get('pages/b.html') is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, 'monotonic', lambda: now[0])
+    PageCache.put('pages/a.html', 'body', 0)
+    now[0] += server.PAGE_CACHE_TTL - 1
+    assert PageCache.get('pages/a.html') == 'body'
+    now[0] += 2
+    assert PageCache.get('pages/a.html') is None
+    assert 'pages/a.html' not in PageCache._entries
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    monkeypatch.setattr(server, 'PAGE_CACHE_SIZE', 2)
+    PageCache.put('a', 'A', 0)
+    PageCache.put('b', 'B', 0)
+    assert PageCache.get('a') == 'A'  # b is now the oldest
+    PageCache.put('c', 'C', 0)
+    assert PageCache.get('b') is None
+    assert PageCache.get('a') == 'A' and PageCache.get('c') == 'C'
+
+
+def test_render_started_before_an_invalidation_is_not_stored():
+    version = PageCache.version('pages/a.html')
+    PageCache.invalidate('pages/a.html')  # a save lands while the old content renders
+    PageCache.put('pages/a.html', 'stale', version)
+    assert PageCache.get('pages/a.html') is None
+    PageCache.put('pages/a.html', 'fresh', PageCache.version('pages/a.html'))
+    assert PageCache.get('pages/a.html') == 'fresh'
+
+
+def test_pages_topic_invalidates():
+    PageCache.put('pages/a.html', 'body', 0)
+    InvalidationBus.publish('pages', 'pages/a.html')
+    assert PageCache.get('pages/a.html') is None
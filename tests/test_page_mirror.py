@@ -0,0 +1,192 @@
+"""CircuitBreaker open/probe/close and the PageMirror fallback used by load_page."""
+import http.client
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import server
+from server import CircuitBreaker, PageCache, PageMirror
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def test_breaker_opens_after_threshold_and_closes_on_probe():
+    attempts = []
+    recovered = threading.Event()
+
+    def probe():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OSError('still down')
+
+    breaker = CircuitBreaker('test', probe, failures=3, interval=0.01, on_recover=recovered.set)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.is_open and not breaker.allow()
+    assert recovered.wait(2)
+    assert len(attempts) == 3
+    wait_for(lambda: not breaker.is_open)
+    assert breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker('test', lambda: None, failures=2, interval=60)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert not breaker.is_open
+
+
+class FakeStore:
+    def __init__(self, pages=None):
+        self.pages = dict(pages or {})
+        self.down = False
+
+    def get_page_record(self, clean_path):
+        if self.down:
+            raise OSError('database unreachable')
+        content = self.pages.get(clean_path)
+        return None if content is None else {'content': content, 'updated_at': None}
+
+    def get_page(self, clean_path):
+        record = self.get_page_record(clean_path)
+        return record and record['content']
+
+    def save_page(self, clean_path, content):
+        if self.down:
+            raise OSError('database unreachable')
+        self.pages[clean_path] = content
+
+    def delete_page(self, clean_path):
+        if self.down:
+            raise OSError('database unreachable')
+        self.pages.pop(clean_path, None)
+
+    def log_activity(self, entry):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """A site directory with one tracked page, a mirror dir and a fresh cache and breaker."""
+    (tmp_path / 'pages').mkdir()
+    (tmp_path / 'pages' / 'a.html').write_text('<p>site</p>', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(server, 'PAGE_MIRROR_DIR', str(tmp_path / 'cache' / 'pages'))
+    monkeypatch.setattr(server, 'render_page', lambda content, clean_path: content)
+    monkeypatch.setattr(PageCache, '_entries', type(PageCache._entries)())
+    monkeypatch.setattr(PageCache, '_versions', {})
+    monkeypatch.setattr(PageMirror, '_stale', set())
+    store = FakeStore()
+    monkeypatch.setattr(server, 'store', store)
+    breaker = CircuitBreaker('wiki_pages', probe=lambda: store.get_page('index.html'),
+                             failures=1, interval=60, on_recover=PageMirror.revalidate)
+    monkeypatch.setattr(server, 'page_breaker', breaker)
+    return tmp_path, store
+
+
+@pytest.mark.parametrize('clean_path', ['../outside.html', '/etc/passwd', 'pages/../../x.html', '.'])
+def test_file_path_stays_inside_the_root(tmp_path, clean_path):
+    assert PageMirror.file_path(clean_path, str(tmp_path)) is None
+
+
+def test_file_path_rejects_a_sibling_sharing_the_prefix(tmp_path):
+    root = tmp_path / 'site'
+    assert PageMirror.file_path('../site-other/a.html', str(root)) is None
+    assert PageMirror.file_path('pages/a.html', str(root)) == str(root / 'pages' / 'a.html')
+
+
+def test_database_hit_writes_the_mirror_not_the_site_file(site):
+    root, store = site
+    store.pages['pages/a.html'] = '<p>db</p>'
+    assert server.load_page('pages/a.html').body == b'<p>db</p>'
+    assert (root / 'pages' / 'a.html').read_text(encoding='utf-8') == '<p>site</p>'
+    assert (root / 'cache' / 'pages' / 'pages' / 'a.html').read_text(encoding='utf-8') == '<p>db</p>'
+    assert not [n for n in os.listdir(root / 'cache' / 'pages' / 'pages') if n.startswith('.mirror-')]
+
+
+def test_outage_serves_the_mirror_then_revalidates(site):
+    root, store = site
+    store.pages['pages/a.html'] = '<p>v1</p>'
+    server.load_page('pages/a.html')
+    PageCache.invalidate(server.page_key('pages/a.html'))
+
+    store.down = True
+    assert server.load_page('pages/a.html').body == b'<p>v1</p>'
+    assert server.page_breaker.is_open
+    assert PageMirror._stale == {'pages/a.html'}
+
+    store.down = False
+    store.pages['pages/a.html'] = '<p>v2</p>'
+    PageMirror.revalidate()
+    assert (root / 'cache' / 'pages' / 'pages' / 'a.html').read_text(encoding='utf-8') == '<p>v2</p>'
+    assert PageCache.get(server.page_key('pages/a.html')) is None
+
+
+def test_outage_without_a_mirror_copy_falls_back_to_the_site_file(site):
+    _, store = site
+    store.down = True
+    assert server.load_page('pages/a.html').body == b'<p>site</p>'
+
+
+def test_page_missing_from_the_database_ignores_the_mirror(site):
+    root, store = site
+    mirror = root / 'cache' / 'pages' / 'pages'
+    mirror.mkdir(parents=True)
+    (mirror / 'gone.html').write_text('<p>deleted</p>', encoding='utf-8')
+    assert server.load_page('pages/gone.html') is None
+    assert server.load_page('pages/a.html').body == b'<p>site</p>'
+
+
+@pytest.fixture
+def admin_post(site, monkeypatch):
+    """POST JSON to a running SaveRequestHandler as an admin."""
+    monkeypatch.setattr(server, 'get_authenticated_user', lambda handler: {'id': '1', 'username': 'root'})
+    monkeypatch.setattr(server, 'is_admin', lambda user: True)
+    httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.SaveRequestHandler, workers=1)
+    threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def post(path, payload):
+        conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=5)
+        conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        res = conn.getresponse()
+        body = json.loads(res.read())
+        conn.close()
+        return res.status, body
+    yield post
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_page_saved_during_an_outage_is_served_from_the_mirror(site, admin_post):
+    root, store = site
+    store.pages['pages/a.html'] = '<p>v1</p>'
+    server.load_page('pages/a.html')
+    store.down = True
+    status, _ = admin_post('/save', {'file': 'pages/a.html', 'content': '<p>v2</p>'})
+    assert status == 200
+    mirrored = (root / 'cache' / 'pages' / 'pages' / 'a.html').read_text(encoding='utf-8')
+    assert '<p>v2</p>' in mirrored
+    assert server.load_page('pages/a.html').body.decode('utf-8') == mirrored
+
+
+def test_deleted_page_is_not_served_from_the_mirror(site, admin_post):
+    root, store = site
+    store.pages['pages/a.html'] = '<p>v1</p>'
+    server.load_page('pages/a.html')
+    assert (root / 'cache' / 'pages' / 'pages' / 'a.html').exists()
+    status, _ = admin_post('/api/pages/delete', {'path': 'pages/a.html'})
+    assert status == 200
+    assert not (root / 'cache' / 'pages' / 'pages' / 'a.html').exists()
+    store.down = True
+    assert server.load_page('pages/a.html') is None
@@ -0,0 +1,117 @@
+"""PermissionService: merged role map, cached response and user-row refreshes."""
+import json
+import threading
+
+import pytest
+
+import server
+from server import InvalidationBus, PermissionService
+
+
+class FakeStore:
+    def __init__(self, users):
+        self.users = {u['id']: dict(u) for u in users}
+        self.list_calls = 0
+        self.get_calls = []
+        self.during_list = None
+        self.fail = False
+
+    def list_users(self):
+        self.list_calls += 1
+        if self.fail:
+            raise OSError('database unreachable')
+        if self.during_list:
+            self.during_list()
+        return [dict(u) for u in self.users.values()]
+
+    def get_user(self, user_id):
+        self.get_calls.append(user_id)
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    (tmp_path / 'permissions.json').write_text(json.dumps({'root': 'admin'}), encoding='utf-8')
+    monkeypatch.setattr(PermissionService, 'FILE', str(tmp_path / 'permissions.json'))
+    monkeypatch.setattr(PermissionService, '_static', {})
+    monkeypatch.setattr(PermissionService, '_stamp', None)
+    monkeypatch.setattr(PermissionService, '_users', {})
+    monkeypatch.setattr(PermissionService, '_users_loaded', False)
+    monkeypatch.setattr(PermissionService, '_dirty', set())
+    monkeypatch.setattr(PermissionService, '_response', None)
+    fake = FakeStore([{'id': '1', 'username': 'ada', 'role': 'editor'},
+                      {'id': '2', 'username': 'root', 'role': 'user'}])
+    monkeypatch.setattr(server, 'store', fake)
+    return fake
+
+
+def permissions():
+    return json.loads(PermissionService.response().body)['permissions']
+
+
+def test_file_roles_win_over_the_users_table(store):
+    assert permissions() == {'root': 'admin', 'ada': 'editor'}
+
+
+def test_response_is_cached_until_something_changes(store):
+    first = PermissionService.response()
+    assert PermissionService.response() is first
+    assert store.list_calls == 1
+    PermissionService.note_user({'id': '3', 'username': 'bob', 'role': 'user'})
+    assert permissions()['bob'] == 'user'
+    assert store.list_calls == 1
+
+
+def test_rename_saved_by_another_worker_replaces_the_old_name(store):
+    permissions()
+    store.users['1']['username'] = 'ada2'
+    InvalidationBus._deliver('users', '1')
+    perms = permissions()
+    assert 'ada' not in perms and perms['ada2'] == 'editor'
+    assert store.list_calls == 1 and store.get_calls == ['1']
+
+
+def test_deleted_user_drops_out(store):
+    permissions()
+    del store.users['1']
+    PermissionService._user_saved('1')
+    assert 'ada' not in permissions()
+
+
+def test_user_list_is_read_without_holding_the_lock(store):
+    finished = threading.Event()
+
+    def concurrent_save():
+        def save():
+            PermissionService.note_user({'id': '1', 'username': 'ada', 'role': 'admin'})
+            PermissionService._user_saved('1')
+            finished.set()
+        thread = threading.Thread(target=save)
+        thread.start()
+        thread.join(2)
+        store.users['1']['role'] = 'admin'
+
+    store.during_list = concurrent_save
+    permissions()
+    assert finished.is_set()
+    # Saved while the list was being read, so the next build re-reads that row
+    assert PermissionService._response is None
+    assert permissions()['ada'] == 'admin'
+    assert store.get_calls == ['1']
+
+
+def test_fetch_error_is_not_cached(store):
+    store.fail = True
+    assert permissions() == {'root': 'admin'}
+    store.fail = False
+    assert permissions() == {'root': 'admin', 'ada': 'editor'}
+    assert store.list_calls == 2
+
+
+def test_set_role_updates_file_and_map(store):
+    permissions()
+    PermissionService.set_role('ada', 'admin')
+    assert permissions()['ada'] == 'admin'
+    with open(PermissionService.FILE, encoding='utf-8') as f:
+        assert json.load(f) == {'root': 'admin', 'ada': 'admin'}
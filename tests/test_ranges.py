@@ -0,0 +1,50 @@
+"""parse_byte_ranges and the conditional-request helpers."""
+import pytest
+
+from server import MAX_RANGES, etag_matches, not_modified, parse_byte_ranges
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=100-', [(100, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('bytes=0-0, 10-19', [(0, 0), (10, 19)]),
+    ('BYTES=0-1', [(0, 1)]),
+    # Nothing satisfiable -> 416
+    ('bytes=1000-', []),
+    ('bytes=-0', []),
+    # Ignored -> full 200 response
+    ('items=0-1', None),
+    ('bytes=', None),
+    ('bytes=5', None),
+    ('bytes=-', None),
+    ('bytes=9-3', None),
+    ('bytes=a-b', None),
+    ('bytes=5-x', None),
+    ('bytes=x-5', None),
+])
+def test_parse_byte_ranges(header, expected):
+    assert parse_byte_ranges(header, 1000) == expected
+
+
+def test_too_many_ranges_are_ignored():
+    header = 'bytes=' + ','.join(f'{i}-{i}' for i in range(MAX_RANGES + 1))
+    assert parse_byte_ranges(header, 1000) is None
+
+
+def test_etag_matches_weak_and_lists():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"x", "abc"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+
+
+def test_not_modified_prefers_if_none_match():
+    headers = {'If-None-Match': '"old"', 'If-Modified-Since': 'Sun, 01 Jan 2090 00:00:00 GMT'}
+    assert not not_modified(headers, '"new"', 1000)
+    assert not_modified({'If-Modified-Since': 'Thu, 01 Jan 1970 00:16:40 GMT'}, '"e"', 1000)
+    assert not not_modified({'If-Modified-Since': 'Thu, 01 Jan 1970 00:16:39 GMT'}, '"e"', 1000)
+    assert not not_modified({'If-Modified-Since': 'garbage'}, '"e"', 1000)
@@ -0,0 +1,60 @@
+"""Router.match: exact and prefix routes, fallbacks, and which GET routes HEAD may run."""
+from server import ROUTER, Router, SaveRequestHandler
+
+
+def handler(name):
+    def h(request):
+        return name
+    h.__name__ = name
+    return h
+
+
+def make_router():
+    return Router([
+        ('GET', '/api/health', handler('health')),
+        ('GET', '/api/search*', handler('search')),
+        ('GET', '/api/search/advanced*', handler('advanced')),
+        ('GET', '/auth/logout', handler('logout')),
+        ('POST', '/save', handler('save')),
+    ], fallbacks={
+        'GET': handler('static'),
+        'HEAD': handler('not_allowed'),
+        'POST': handler('not_found'),
+    }, no_head=('/auth/logout',))
+
+
+def test_exact_match_ignores_query_and_fragment():
+    router = make_router()
+    assert router.match('GET', '/api/health?x=1#top').pattern == '/api/health'
+
+
+def test_longest_prefix_wins():
+    router = make_router()
+    assert router.match('GET', '/api/search?q=qi').pattern == '/api/search*'
+    assert router.match('GET', '/api/search/advanced?q=qi').pattern == '/api/search/advanced*'
+
+
+def test_unmatched_paths_use_the_method_fallback():
+    router = make_router()
+    assert router.match('GET', '/pages/intro.html').handler.__name__ == 'static'
+    assert router.match('POST', '/api/health').handler.__name__ == 'not_found'
+    assert router.match('PUT', '/save') is None
+
+
+def test_head_runs_read_only_get_routes():
+    router = make_router()
+    assert router.match('HEAD', '/api/health').pattern == '/api/health'
+    assert router.match('HEAD', '/pages/intro.html').handler.__name__ == 'static'
+
+
+def test_head_never_runs_get_routes_with_side_effects():
+    router = make_router()
+    assert router.match('HEAD', '/auth/logout').handler.__name__ == 'not_allowed'
+    assert router.match('GET', '/auth/logout').handler.__name__ == 'logout'
+
+
+def test_server_routes_refuse_head_on_login_logout_and_callback():
+    for path in ('/auth/logout', '/auth/discord/login', '/auth/discord/callback?code=abc&state=x', '/api/dev/login'):
+        assert ROUTER.match('HEAD', path).handler is SaveRequestHandler.handle_method_not_allowed, path
+    assert ROUTER.match('HEAD', '/api/permissions').handler is SaveRequestHandler.handle_get_permissions
+    assert ROUTER.match('HEAD', '/index.html').handler is SaveRequestHandler.serve_page_or_static
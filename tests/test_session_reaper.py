@@ -0,0 +1,67 @@
+"""SessionExpiry.reap against both storage backends."""
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from fake_postgrest import FakePostgREST
+
+NOW = 2_000_000_000.0
+DAY = 24 * 3600
+
+
+def stamp(days_ago):
+    return datetime.fromtimestamp(NOW - days_ago * DAY, timezone.utc).isoformat()
+
+
+# session id -> (created days ago, last seen days ago or None, expired?)
+SESSIONS = {
+    'fresh': (1, 0, False),
+    'active-but-old': (31, 0, True),
+    'idle': (20, 15, True),
+    'recently-seen': (20, 1, False),
+    'null-seen-recent': (2, None, False),
+    'null-seen-idle': (15, None, True),
+    'null-seen-old': (40, None, True),
+}
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return server.SQLiteStore(str(tmp_path / 'wiki.db'))
+
+
+@pytest.fixture
+def supabase_store():
+    fake = FakePostgREST().start()
+    try:
+        yield server.SupabaseStore(server.create_client(fake.url, 'test-key'))
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+@pytest.fixture(params=['sqlite', 'supabase'])
+def backend(request, monkeypatch):
+    backend_store = request.getfixturevalue(f'{request.param}_store')
+    monkeypatch.setattr(server, 'store', backend_store)
+    monkeypatch.setattr(server, 'SESSION_MAX_AGE', 30 * DAY)
+    monkeypatch.setattr(server, 'SESSION_IDLE_TIMEOUT', 14 * DAY)
+    for session_id, (created, seen, _) in SESSIONS.items():
+        backend_store.create_session({'session_id': session_id, 'user_id': '1', 'created_at': stamp(created),
+                                      'last_seen': None if seen is None else stamp(seen)})
+    return backend_store
+
+
+def test_reap_deletes_exactly_the_expired_sessions(backend):
+    expired = {sid for sid, (_, _, gone) in SESSIONS.items() if gone}
+    assert server.SessionExpiry.reap(now=NOW) == len(expired)
+    for session_id in SESSIONS:
+        assert (backend.get_session(session_id) is None) == (session_id in expired), session_id
+    assert server.SessionExpiry.reap(now=NOW) == 0
+
+
+def test_reap_works_in_batches(backend, monkeypatch):
+    monkeypatch.setattr(server, 'SESSION_REAP_BATCH', 2)
+    assert server.SessionExpiry.reap(now=NOW) == sum(gone for _, _, gone in SESSIONS.values())
+    assert backend.get_session('fresh') is not None
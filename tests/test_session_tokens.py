@@ -0,0 +1,102 @@
+"""SessionTokens signing and verification, and TokenRevocations."""
+import pytest
+
+import server
+from server import SessionTokens, TokenRevocations
+
+USER = {'id': '42', 'username': 'ada', 'avatar': None, 'role': 'editor'}
+
+
+@pytest.fixture(autouse=True)
+def signing(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'SESSION_SIGNING_KEY', 'test-key')
+    monkeypatch.setattr(server, 'REVOCATIONS_FILE', str(tmp_path / 'revoked_sessions.json'))
+    monkeypatch.setattr(TokenRevocations, '_data', {'tokens': {}, 'role_versions': {}})
+
+
+def test_issued_token_round_trips():
+    token = SessionTokens.issue(USER)
+    assert SessionTokens.is_token(token)
+    claims = SessionTokens.verify(token)
+    assert SessionTokens.user(claims) == USER
+    assert SessionTokens.is_current(claims)
+
+
+def test_disabled_without_a_signing_key(monkeypatch):
+    token = SessionTokens.issue(USER)
+    monkeypatch.setattr(server, 'SESSION_SIGNING_KEY', '')
+    assert SessionTokens.verify(token) is None
+
+
+def test_other_key_is_rejected(monkeypatch):
+    token = SessionTokens.issue(USER)
+    monkeypatch.setattr(server, 'SESSION_SIGNING_KEY', 'another-key')
+    assert SessionTokens.verify(token) is None
+
+
+def test_tampered_claims_are_rejected():
+    body, _, signature = SessionTokens.issue(USER).rpartition('.')
+    forged = SessionTokens.issue(dict(USER, role='admin')).rpartition('.')[0]
+    assert SessionTokens.verify(f"{forged}.{signature}") is None
+    other = 'A' if signature[-1] != 'A' else 'B'
+    assert SessionTokens.verify(f"{body}.{signature[:-1]}{other}") is None
+
+
+@pytest.mark.parametrize('token', [
+    'v1.',
+    'v1.x',
+    'v1..',
+    'v1.x.y',
+    'v1.!!!.sig',
+    'v1.x.é',
+    'v1.é.abc',
+    'v1.\udcff.abc',
+    'év1.x.y',
+])
+def test_malformed_tokens_are_rejected(token):
+    assert SessionTokens.verify(token) is None
+
+
+def test_signed_garbage_claims_are_rejected():
+    for payload in (b'not json', b'[1, 2]', b'{"exp": 9999999999}', b'{"exp": 9999999999, "jti": ["x"]}',
+                    b'{"exp": "9999999999", "jti": "x"}', b'{"exp": null, "jti": "x"}', b'{"exp": true, "jti": "x"}'):
+        body = SessionTokens.PREFIX + SessionTokens._b64(payload)
+        assert SessionTokens.verify(f"{body}.{SessionTokens._sign(body)}") is None
+
+
+def test_non_ascii_bearer_header_is_not_logged_in():
+    assert server.SessionManager.get_user({'Authorization': 'Bearer v1.x.é'}) is None
+
+
+def test_expired_token_is_rejected(monkeypatch):
+    token = SessionTokens.issue(USER)
+    monkeypatch.setattr(server.time, 'time', lambda: 10 ** 12)
+    assert SessionTokens.verify(token) is None
+
+
+def test_revoked_token_is_rejected():
+    token = SessionTokens.issue(USER)
+    other = SessionTokens.issue(USER)
+    TokenRevocations.revoke(SessionTokens.verify(token))
+    assert SessionTokens.verify(token) is None
+    assert SessionTokens.verify(other) is not None
+
+
+def test_revocations_survive_a_reload():
+    token = SessionTokens.issue(USER)
+    TokenRevocations.revoke(SessionTokens.verify(token))
+    TokenRevocations._data = {'tokens': {}, 'role_versions': {}}
+    TokenRevocations.load()
+    assert SessionTokens.verify(token) is None
+
+
+def test_role_change_makes_older_tokens_stale(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(server.time, 'time', lambda: now[0])
+    before = SessionTokens.issue(USER)
+    now[0] += 1
+    TokenRevocations.bump_role_version(USER['id'])
+    now[0] += 1
+    after = SessionTokens.issue(USER)
+    assert not SessionTokens.is_current(SessionTokens.verify(before))
+    assert SessionTokens.is_current(SessionTokens.verify(after))